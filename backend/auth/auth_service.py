@@ -7,9 +7,10 @@ from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, get_read_db
 from models.database import User, Session as DBSession
 from schemas.schemas import UserLogin, SessionCreate
+from services.metrics import track
 import os
 
 # 設定
@@ -17,21 +18,27 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30
+# 運用用エンドポイント（プロファイル等）を使えるユーザー（カンマ区切りのユーザーID）
+ADMIN_USER_IDS = {i.strip() for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}
 
 security = HTTPBearer()
+# 未認証でもアクセスできるエンドポイント用（ヘッダーがなくても403にしない）
+optional_security = HTTPBearer(auto_error=False)
 
 
 class AuthService:
     @staticmethod
     def hash_password(password: str) -> str:
         """パスワードをハッシュ化"""
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        with track("auth", "bcrypt_hash"):
+            salt = bcrypt.gensalt()
+            return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
     
     @staticmethod
     def verify_password(password: str, hashed_password: str) -> bool:
         """パスワードを検証"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+        with track("auth", "bcrypt_verify"):
+            return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
     
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -43,7 +50,8 @@ class AuthService:
             expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        with track("auth", "jwt_encode"):
+            encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     
     @staticmethod
@@ -55,7 +63,8 @@ class AuthService:
     def verify_access_token(token: str) -> dict:
         """アクセストークンを検証"""
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            with track("auth", "jwt_decode"):
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id: str = payload.get("sub")
             if user_id is None:
                 raise HTTPException(
@@ -152,7 +161,7 @@ def get_current_user(
 
 
 def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
     """現在のユーザーを取得（オプショナル）"""
@@ -163,3 +172,30 @@ def get_current_user_optional(
         return get_current_user(credentials, db)
     except HTTPException:
         return None
+
+
+def get_current_user_optional_read(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_read_db)
+) -> Optional[User]:
+    """
+    現在のユーザーを取得（オプショナル、POSTでも読み取り専用のエンドポイント用）
+
+    get_db はPOSTをプライマリの書き込みとして扱い、そのユーザーをプライマリに固定してしまうため、
+    ルートと同じ get_read_db のセッションで参照する。
+    """
+    return get_current_user_optional(credentials, db)
+
+
+def is_admin(user_id) -> bool:
+    return user_id is not None and str(user_id) in ADMIN_USER_IDS
+
+
+def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """管理者のみ（ADMIN_USER_IDS）"""
+    if not is_admin(current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="管理者のみ利用できます"
+        )
+    return current_user
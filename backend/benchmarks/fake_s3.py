@@ -0,0 +1,141 @@
+"""
+ベンチマーク・テスト用のインメモリS3クライアント
+
+boto3のS3クライアントのうち、本アプリが利用するメソッドだけを実装する。
+ネットワークを介さないため、計測結果にS3のレイテンシは含まれない。
+"""
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+
+class InMemoryS3Client:
+    def __init__(self):
+        self._objects: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _bucket(self, bucket: str) -> Dict[str, dict]:
+        return self._objects.setdefault(bucket, {})
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType: Optional[str] = None, **kwargs) -> dict:
+        self._count("put_object")
+        if not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        etag = '"%s"' % hashlib.md5(Body).hexdigest()
+        with self._lock:
+            self._bucket(Bucket)[Key] = {
+                "Body": bytes(Body),
+                "ContentType": ContentType or "binary/octet-stream",
+                "ETag": etag,
+                "LastModified": datetime.now(timezone.utc),
+            }
+        return {"ETag": etag}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._count("get_object")
+        obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        body = obj["Body"]
+        if kwargs.get("Range"):
+            first, _, last = kwargs["Range"][len("bytes="):].partition("-")
+            body = body[int(first):int(last) + 1 if last else len(body)]
+        return {
+            "Body": _Body(body),
+            "ContentLength": len(body),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+        }
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._count("head_object")
+        obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+        }
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._count("delete_object")
+        with self._lock:
+            self._bucket(Bucket).pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        self._count("delete_objects")
+        deleted = []
+        with self._lock:
+            for item in Delete.get("Objects", []):
+                self._bucket(Bucket).pop(item["Key"], None)
+                deleted.append({"Key": item["Key"]})
+        return {"Deleted": deleted}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", MaxKeys: int = 1000,
+                        ContinuationToken: Optional[str] = None, StartAfter: Optional[str] = None,
+                        **kwargs) -> dict:
+        """S3と同じくキーのバイト順でページングして返す"""
+        self._count("list_objects_v2")
+        start = ContinuationToken or StartAfter or ""
+        keys: List[str] = sorted(
+            (k for k in self._bucket(Bucket) if k.startswith(Prefix) and k > start),
+            key=lambda k: k.encode("utf-8"),
+        )
+        page = keys[:MaxKeys]
+        contents = [
+            {
+                "Key": k,
+                "Size": len(self._bucket(Bucket)[k]["Body"]),
+                "ETag": self._bucket(Bucket)[k]["ETag"],
+                "LastModified": self._bucket(Bucket)[k]["LastModified"],
+            }
+            for k in page
+        ]
+        truncated = len(keys) > MaxKeys
+        response = {"KeyCount": len(contents), "IsTruncated": truncated}
+        if contents:
+            response["Contents"] = contents
+        if truncated:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600, **kwargs) -> str:
+        self._count("generate_presigned_url")
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+class _Body:
+    """botocoreのStreamingBody互換の最小実装"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if amt is None:
+            chunk = self._data[self._pos:]
+        else:
+            chunk = self._data[self._pos:self._pos + amt]
+        self._pos += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        pass
@@ -0,0 +1,286 @@
+"""
+リアルタイム配信のファンアウト計測
+
+多数の待機中の購読者を作り、公開写真イベントを配信したときの
+- publish_local の所要時間（イベントループを占有する時間）
+- 発行から各購読者が受信するまでのレイテンシ（p50/p95/p99）
+- 購読者1件あたりのメモリ
+をJSONで出力する。
+
+--transport ws はアプリを子プロセスのuvicornで起動し、実際のWebSocket接続で計測する。
+--transport memory はソケットを使わずハブとキューだけを計測する。
+
+使い方（backendディレクトリで実行）:
+    python -m benchmarks.fanout --connections 10000 --cells 100 --events 50 --transport ws
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from benchmarks.run import _git_revision, percentile
+
+# 東京駅周辺（5桁のGeohashで縦横10セル程度の範囲）
+CENTER = (35.681, 139.767)
+SPREAD_DEG = 0.2
+
+
+def _event_points(cells: int, rng: random.Random, precision: int) -> Dict[str, tuple]:
+    """購読対象のセルと、そのセル内の代表点"""
+    from services import geohash
+
+    points: Dict[str, tuple] = {}
+    while len(points) < cells:
+        lat = CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lng = CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        points.setdefault(geohash.encode(lat, lng, precision), (lat, lng))
+    return points
+
+
+def _max_rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _raise_fd_limit(needed: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f"⚠️ ファイルディスクリプタの上限が不足しています（{target} < {needed}）", file=sys.stderr)
+
+
+def _summarize(latencies: List[float], publish_ms: List[float], expected: int) -> dict:
+    values = sorted(v * 1000 for v in latencies)
+    publish = sorted(publish_ms)
+    return {
+        "deliveries": len(values),
+        "expected_deliveries": expected,
+        "delivery_latency_ms": {
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+            "max": round(values[-1], 3) if values else 0.0,
+        },
+        "publish_ms": {
+            "p50": round(percentile(publish, 50), 3),
+            "p99": round(percentile(publish, 99), 3),
+            "max": round(publish[-1], 3) if publish else 0.0,
+        },
+    }
+
+
+async def _publish_events(hub, points: Dict[str, tuple], events: int, rng: random.Random,
+                          sent_at: Dict[str, float], interval: float) -> Tuple[List[float], int]:
+    """イベントを発行し、(publish_localの所要時間の一覧, 送信予定の合計) を返す"""
+    publish_ms = []
+    expected = 0
+    cells = list(points)
+    for i in range(events):
+        lat, lng = points[rng.choice(cells)]
+        event_id = f"bench-{i}"
+        sent_at[event_id] = time.perf_counter()
+        started = time.perf_counter()
+        expected += hub.publish_local({"id": event_id, "lat": lat, "lng": lng})
+        publish_ms.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return publish_ms, expected
+
+
+async def run_memory(args) -> dict:
+    from services.live_updates import LiveHub, Subscriber
+
+    rng = random.Random(args.seed)
+    hub = LiveHub(precision=args.precision, max_cells=args.cells)
+    points = _event_points(args.cells, rng, args.precision)
+    cells = list(points)
+    sent_at: Dict[str, float] = {}
+    latencies: List[float] = []
+
+    async def consume(subscriber: Subscriber):
+        while True:
+            message = await subscriber.queue.get()
+            if message is None:
+                return
+            latencies.append(time.perf_counter() - sent_at[json.loads(message)["photo"]["id"]])
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    subscribers = []
+    for i in range(args.connections):
+        subscriber = Subscriber(queue_size=args.queue_size)
+        hub.register(subscriber)
+        hub.set_cells(subscriber, [cells[i % len(cells)]])
+        subscribers.append(subscriber)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    consumers = [asyncio.create_task(consume(s)) for s in subscribers]
+    publish_ms, expected = await _publish_events(hub, points, args.events, rng, sent_at, args.interval)
+    await asyncio.sleep(0.5)
+    for task in consumers:
+        task.cancel()
+
+    result = _summarize(latencies, publish_ms, expected)
+    result["memory_per_subscriber_bytes"] = round((after - before) / args.connections, 1)
+    return result
+
+
+def _serve(port: int, pipe, fd_limit: int):
+    """子プロセス: uvicornでアプリを起動し、親からの指示でイベントを発行する"""
+    import uvicorn
+
+    _raise_fd_limit(fd_limit)
+    os.environ.setdefault("S3_BUCKET_NAME", "bench-bucket")
+    from main import create_app
+    from services.live_updates import live_hub
+
+    async def serve():
+        server = uvicorn.Server(uvicorn.Config(
+            create_app(), host="127.0.0.1", port=port, log_level="warning", backlog=4096))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        pipe.send(("ready", _max_rss_kb()))
+
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, pipe.recv)
+            if command[0] == "publish":
+                _, event_id, lat, lng = command
+                started = time.perf_counter()
+                delivered = live_hub.publish_local({"id": event_id, "lat": lat, "lng": lng, "sent_at": time.time()})
+                pipe.send((delivered, (time.perf_counter() - started) * 1000))
+            elif command[0] == "rss":
+                pipe.send((len(live_hub), _max_rss_kb()))
+            else:
+                break
+        server.should_exit = True
+        await server_task
+
+    asyncio.run(serve())
+
+
+async def run_ws(args) -> dict:
+    """サーバーを別プロセスで起動し、このプロセスから実際のWebSocket接続を張って計測する"""
+    import multiprocessing
+
+    import websockets
+
+    fd_limit = args.connections + 1024
+    _raise_fd_limit(fd_limit)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.get_context("spawn").Process(target=_serve, args=(port, child_pipe, fd_limit), daemon=True)
+    server.start()
+    loop = asyncio.get_running_loop()
+    _, server_rss_before = await loop.run_in_executor(None, parent_pipe.recv)
+
+    async def call(*command):
+        parent_pipe.send(command)
+        return await loop.run_in_executor(None, parent_pipe.recv)
+
+    rng = random.Random(args.seed)
+    points = _event_points(args.cells, rng, args.precision)
+    cells = list(points)
+    latencies: List[float] = []
+
+    async def connect(i: int):
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}/photos/live", ping_interval=None, open_timeout=120)
+        await ws.send(json.dumps({"type": "subscribe", "cells": [cells[i % len(cells)]]}))
+        await ws.recv()
+        return ws
+
+    async def receive(ws):
+        async for message in ws:
+            data = json.loads(message)
+            if data.get("type") == "photo":
+                latencies.append(time.time() - data["photo"]["sent_at"])
+
+    connections = []
+    started = time.perf_counter()
+    for offset in range(0, args.connections, args.connect_batch):
+        batch = range(offset, min(offset + args.connect_batch, args.connections))
+        connections.extend(await asyncio.gather(*(connect(i) for i in batch)))
+    connect_s = time.perf_counter() - started
+    subscribers, server_rss_after = await call("rss")
+
+    receivers = [asyncio.create_task(receive(ws)) for ws in connections]
+    publish_ms = []
+    expected = 0
+    for i in range(args.events):
+        lat, lng = points[rng.choice(cells)]
+        delivered, elapsed_ms = await call("publish", f"bench-{i}", lat, lng)
+        expected += delivered
+        publish_ms.append(elapsed_ms)
+        await asyncio.sleep(args.interval)
+    await asyncio.sleep(2.0)
+
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in connections), return_exceptions=True)
+    parent_pipe.send(("stop",))
+    server.join(timeout=30)
+
+    result = _summarize(latencies, publish_ms, expected)
+    result["connect_s"] = round(connect_s, 3)
+    result["server_subscribers"] = subscribers
+    result["server_rss_per_connection_bytes"] = round(
+        (server_rss_after - server_rss_before) * 1024 / max(args.connections, 1), 1)
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="リアルタイム配信のファンアウト計測")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--cells", type=int, default=100, help="購読者を分散させるセル数（1なら全員が同じセル）")
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.05, help="イベントの発行間隔（秒）")
+    parser.add_argument("--transport", choices=["ws", "memory"], default="ws")
+    parser.add_argument("--precision", type=int, default=5,
+                        help="Geohash桁数（ws時はサーバーの LIVE_CELL_PRECISION と合わせる）")
+    parser.add_argument("--queue-size", type=int, default=32, help="memory時の購読者キュー長")
+    parser.add_argument("--connect-batch", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="結果JSONの出力先（省略時は標準出力）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    runner = run_ws if args.transport == "ws" else run_memory
+    result = asyncio.run(runner(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "result": result,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
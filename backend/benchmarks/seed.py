@@ -0,0 +1,156 @@
+"""
+ベンチマーク用の合成データ投入
+
+ユーザー・セッション・位置情報付き写真を乱数シード固定で生成するため、
+同じ引数で実行すれば毎回同じデータ量・分布になる。
+"""
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+import bcrypt
+from geoalchemy2.elements import WKTElement
+from sqlalchemy import insert, text
+from sqlalchemy.engine import Engine
+
+from models.database import Photo, Session as DBSession, User, VisibilityEnum
+from services import photo_timeline, user_stats
+
+BENCH_PASSWORD = "bench-password"
+
+# 写真の撮影地点はこれらの都市の周辺に集中させる
+CITY_CENTERS: List[Tuple[float, float]] = [
+    (35.6812, 139.7671),  # 東京
+    (34.7025, 135.4959),  # 大阪
+    (35.0116, 135.7681),  # 京都
+    (43.0687, 141.3508),  # 札幌
+    (33.5902, 130.4017),  # 福岡
+]
+
+VISIBILITY_MIX = [
+    (VisibilityEnum.public, 0.5),
+    (VisibilityEnum.unlisted, 0.2),
+    (VisibilityEnum.private, 0.3),
+]
+
+BATCH_SIZE = 1000
+
+
+@dataclass
+class SeedResult:
+    user_ids: List[uuid.UUID] = field(default_factory=list)
+    emails: List[str] = field(default_factory=list)
+    refresh_tokens: List[str] = field(default_factory=list)
+    photo_count: int = 0
+
+
+def prepare_schema(engine: Engine, reset: bool = False):
+    """マイグレーションでスキーマを作成する（resetなら既存テーブルを削除してから）"""
+    from alembic import command
+    from alembic.config import Config
+
+    from services.schema_drift import ALEMBIC_INI
+
+    if reset:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS idempotency_keys, photo_tombstones, sync_state, user_stats, "
+                              "photo_timeline_days, photos, sessions, users, alembic_version CASCADE"))
+    with engine.connect() as conn:
+        config = Config(ALEMBIC_INI)
+        config.attributes["connection"] = conn
+        config.attributes["configure_logger"] = False
+        command.upgrade(config, "head")
+        conn.commit()
+
+
+def _pick_visibility(rng: random.Random) -> VisibilityEnum:
+    r = rng.random()
+    for visibility, weight in VISIBILITY_MIX:
+        if r < weight:
+            return visibility
+        r -= weight
+    return VISIBILITY_MIX[-1][0]
+
+
+def _insert_batches(conn, table, rows: List[dict]):
+    for i in range(0, len(rows), BATCH_SIZE):
+        conn.execute(insert(table), rows[i:i + BATCH_SIZE])
+
+
+def seed(
+    engine: Engine,
+    users: int,
+    sessions_per_user: int,
+    photos_per_user: int,
+    random_seed: int = 42,
+    session_hash_rounds: int = 4,
+) -> SeedResult:
+    """
+    合成データを投入する
+
+    ログインの計測が本番と同じコストになるよう、パスワードは通常のラウンド数でハッシュ化する。
+    リフレッシュトークンは件数が多いため session_hash_rounds で投入時間を抑える。
+    """
+    rng = random.Random(random_seed)
+    result = SeedResult()
+    now = datetime.now(timezone.utc)
+
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    session_salt = bcrypt.gensalt(rounds=session_hash_rounds)
+
+    user_rows, session_rows, photo_rows = [], [], []
+    for i in range(users):
+        user_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        email = f"bench{i}@example.com"
+        result.user_ids.append(user_id)
+        result.emails.append(email)
+        user_rows.append({
+            "id": user_id,
+            "email": email,
+            "password_hash": password_hash,
+            "username": f"bench{i}",
+        })
+
+        for _ in range(sessions_per_user):
+            token = f"bench-{user_id.hex}-{rng.getrandbits(64):016x}"
+            result.refresh_tokens.append(token)
+            session_rows.append({
+                "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+                "user_id": user_id,
+                "refresh_token_hash": bcrypt.hashpw(token.encode("utf-8"), session_salt).decode("utf-8"),
+                "expires_at": now + timedelta(days=30),
+            })
+
+        for _ in range(photos_per_user):
+            photo_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+            center_lat, center_lng = rng.choice(CITY_CENTERS)
+            lat = center_lat + rng.gauss(0, 0.05)
+            lng = center_lng + rng.gauss(0, 0.05)
+            created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            photo_rows.append({
+                "id": photo_id,
+                "user_id": user_id,
+                "s3_key": f"photos/{photo_id}.jpg",
+                "mime_type": "image/jpeg",
+                "size_bytes": rng.randint(200_000, 5 * 1024 * 1024),
+                "title": f"bench photo {photo_id.hex[:8]}",
+                "lat": lat,
+                "lng": lng,
+                "location": WKTElement(f"POINT({lng} {lat})", srid=4326),
+                "visibility": _pick_visibility(rng),
+                "taken_at": created_at - timedelta(hours=rng.randint(0, 72)),
+                "created_at": created_at,
+            })
+
+    with engine.begin() as conn:
+        _insert_batches(conn, User.__table__, user_rows)
+        _insert_batches(conn, DBSession.__table__, session_rows)
+        _insert_batches(conn, Photo.__table__, photo_rows)
+        conn.execute(user_stats.RECONCILE_SQL, {"user_ids": result.user_ids})
+        photo_timeline.rebuild(conn, result.user_ids)
+        conn.execute(text("ANALYZE users; ANALYZE sessions; ANALYZE photos"))
+
+    result.photo_count = len(photo_rows)
+    return result
@@ -0,0 +1,7 @@
+-- 開発環境用のサンプルユーザー（alembic upgrade head の後に実行）
+--   docker-compose exec -T db psql -U user -d mobileapp < backend/dev_seed.sql
+-- パスワードハッシュは 'password' のbcryptハッシュ
+INSERT INTO users (id, email, password_hash, username) VALUES 
+    ('550e8400-e29b-41d4-a716-446655440001', 'test1@example.com', '$2b$12$pvU4FTRcN72EPi/ij1E2sOO2uc.cFl5hUSYT6Bt38BWP8t9V5gXFe', 'テストユーザー1'),
+    ('550e8400-e29b-41d4-a716-446655440002', 'test2@example.com', '$2b$12$pvU4FTRcN72EPi/ij1E2sOO2uc.cFl5hUSYT6Bt38BWP8t9V5gXFe', 'テストユーザー2')
+ON CONFLICT (email) DO NOTHING;
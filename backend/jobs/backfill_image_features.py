@@ -0,0 +1,109 @@
+"""
+画像特徴のバックフィル
+
+知覚ハッシュ・プレースホルダー（BlurHash・代表色）・サイズ・CRC32が未設定の写真を
+S3から取得して解析し、保存する。CRC32が揃うとZIPエクスポートを Range で再開できるようになる。取得と解析は複数プロセスで並列に行う。
+カラム追加前にアップロードされた写真に対して一度実行する（再実行しても未設定分だけ処理する）。
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.backfill_image_features [--workers 4] [--batch-size 200] [--limit N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+_COLUMNS = ("phash", "blurhash", "dominant_color", "width", "height")
+
+
+def _process(item):
+    """ワーカープロセスで実行: 画像を取得して解析する"""
+    from services.image_analysis import analyze_image
+    from services.s3_service import s3_service
+
+    photo_id, s3_key = item
+    try:
+        content = s3_service.get_image_bytes(s3_key)
+    except Exception as e:
+        return photo_id, None, None, str(e)
+    try:
+        return photo_id, analyze_image(content), zlib.crc32(content), None
+    except Exception as e:
+        return photo_id, None, zlib.crc32(content), str(e)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="画像特徴が未設定の写真を解析して埋める")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="処理する最大件数")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from sqlalchemy import func, or_, select, type_coerce
+    from sqlalchemy.dialects.postgresql import JSONB
+
+    from database import SessionLocal, get_engine
+    from models.database import Photo
+
+    get_engine()
+    started = time.perf_counter()
+    updated = 0
+    failed = []
+
+    missing = or_(Photo.crc32.is_(None), *(getattr(Photo, column).is_(None) for column in _COLUMNS))
+    db = SessionLocal()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            last_id = None
+            while args.limit is None or updated + len(failed) < args.limit:
+                batch_size = args.batch_size
+                if args.limit is not None:
+                    batch_size = min(batch_size, args.limit - updated - len(failed))
+                query = select(Photo.id, Photo.s3_key).where(missing).order_by(Photo.id).limit(batch_size)
+                if last_id is not None:
+                    query = query.where(Photo.id > last_id)
+                rows = [tuple(row) for row in db.execute(query)]
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                # 解析が揃ってから短いトランザクションで書き込む（差分同期の採番を待たせない）
+                results = list(pool.map(_process, rows))
+                for photo_id, features, crc, error in results:
+                    if features is None or features["phash"] is None:
+                        failed.append({"photo_id": str(photo_id), "error": error or "画像をデコードできません"})
+                        if crc is not None:
+                            # 解析できなくてもCRCは埋める（エクスポートの再開に使う）
+                            db.query(Photo).filter(Photo.id == photo_id).update(
+                                {"crc32": crc}, synchronize_session=False)
+                        continue
+                    values = {column: features[column] for column in _COLUMNS}
+                    values["crc32"] = crc
+                    # EXIFは未設定の場合だけ埋める
+                    if features["exif"] is not None:
+                        values["exif"] = func.coalesce(Photo.exif, type_coerce(features["exif"], JSONB))
+                    db.query(Photo).filter(Photo.id == photo_id).update(values, synchronize_session=False)
+                    updated += 1
+                db.commit()
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "updated": updated,
+        "failed": len(failed),
+        "failures": failed[:100],
+        "elapsed_s": round(elapsed, 3),
+        "photos_per_s": round(updated / elapsed, 1) if elapsed else None,
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
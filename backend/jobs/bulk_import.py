@@ -0,0 +1,365 @@
+"""
+既存の写真アーカイブの一括インポート
+
+ローカルのディレクトリを走査し、写真を1枚ずつAPIに送る代わりに次の3段のパイプラインで取り込む。
+- 解析: 複数プロセスでEXIF（撮影日時・GPS）・知覚ハッシュ・プレースホルダー・CRC32を取り出す
+- アップロード: スレッドプールでS3に並列に送る（共有クライアントのコネクションプールを使う）
+- 登録: バッチごとに一時テーブルへ COPY し、INSERT ... SELECT で photos に追加する（GPSから location も設定）
+あるバッチのアップロード・登録中に次のバッチの解析を進める。
+
+写真IDとS3キーはユーザー・相対パス・サイズ・更新時刻から決まるので、途中で止まっても再実行すれば
+進捗台帳（SQLite）で登録済みのファイルを飛ばし、アップロード済みのファイルは送り直さずに続きから取り込む。
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.bulk_import --user-email user@example.com /path/to/archive
+    python -m jobs.bulk_import --user-id UUID --workers 8 --upload-concurrency 64 --ledger import.sqlite /path
+"""
+import argparse
+import csv
+import io
+import json
+import mimetypes
+import os
+import sqlite3
+import sys
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+# 写真IDの名前空間（同じファイルからは常に同じIDになる）
+IMPORT_NAMESPACE = uuid.UUID("9b0c8a52-0f3e-4d0a-9f60-1c2b7a4e5d31")
+
+_COPY_COLUMNS = (
+    "id", "user_id", "s3_key", "mime_type", "size_bytes", "title", "lat", "lng", "location",
+    "exif", "visibility", "taken_at", "phash", "blurhash", "dominant_color", "width", "height", "crc32",
+)
+
+# 列の型（visibility が列挙型かVARCHARかなど）は photos に合わせる
+STAGING_SQL = """
+CREATE TEMP TABLE photo_import_staging ON COMMIT DROP AS
+SELECT {columns} FROM photos WITH NO DATA
+"""
+
+# 再実行時に登録済みの行があれば飛ばす（パーティション化後は主キーに created_at を含むため NOT EXISTS も見る）
+INSERT_SQL = """
+INSERT INTO photos ({columns})
+SELECT {select} FROM photo_import_staging s
+WHERE NOT EXISTS (SELECT 1 FROM photos p WHERE p.id = s.id)
+ON CONFLICT DO NOTHING
+RETURNING size_bytes, lat, lng, {day} AS day
+"""
+
+
+class Ledger:
+    """進捗台帳（ファイルごとに uploaded → done / failed を記録する）"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, status TEXT,"
+            " photo_id TEXT, error TEXT)"
+        )
+        self.conn.commit()
+
+    def status(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT status, size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or (row[1], row[2]) != (size, mtime_ns):
+            return None
+        return row[0]
+
+    def mark(self, items, status: str):
+        """items は (path, size, mtime_ns, photo_id, error) の列"""
+        self.conn.executemany(
+            "INSERT INTO files (path, size, mtime_ns, status, photo_id, error) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,"
+            " status = excluded.status, photo_id = excluded.photo_id, error = excluded.error",
+            [(path, size, mtime_ns, status, photo_id, error) for path, size, mtime_ns, photo_id, error in items],
+        )
+        self.conn.commit()
+
+    def counts(self) -> dict:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status"))
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_files(root: str, extensions) -> Iterator[os.DirEntry]:
+    """ディレクトリを再帰的に走査し、対象の拡張子のファイルをパス順に返す"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file() and os.path.splitext(entry.name)[1].lower().lstrip(".") in extensions:
+                yield entry
+        stack.extend(reversed(subdirectories))
+
+
+def photo_id_for(user_id, relative_path: str, size: int, mtime_ns: int) -> uuid.UUID:
+    return uuid.uuid5(IMPORT_NAMESPACE, f"{user_id}:{relative_path}:{size}:{mtime_ns}")
+
+
+def analyze_file(path: str, max_bytes: int) -> dict:
+    """ワーカープロセスで実行: ファイルを読み、photos の列の値を返す"""
+    from PIL import Image
+
+    from services.image_analysis import analyze_image, extract_location, extract_taken_at
+
+    with open(path, "rb") as f:
+        content = f.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ValueError("ファイルサイズが大きすぎます")
+    values = analyze_image(content)
+    if values["width"] is None:
+        raise ValueError("画像をデコードできません")
+    with Image.open(io.BytesIO(content)) as image:
+        location = extract_location(image)
+        taken_at = extract_taken_at(image)
+    values.update(
+        size_bytes=len(content),
+        crc32=zlib.crc32(content),
+        lat=location[0] if location else None,
+        lng=location[1] if location else None,
+        taken_at=taken_at,
+    )
+    return values
+
+
+def _analyze(item):
+    path, max_bytes = item
+    try:
+        return analyze_file(path, max_bytes), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def copy_rows(rows: List[dict]) -> io.StringIO:
+    """COPY ... FORMAT csv 用のバッファ（NULLは空欄、locationはEWKT）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        values = dict(row)
+        if values.get("lat") is not None and values.get("lng") is not None:
+            values["location"] = f"SRID=4326;POINT({values['lng']} {values['lat']})"
+        if values.get("exif") is not None:
+            values["exif"] = json.dumps(values["exif"], ensure_ascii=False)
+        if values.get("taken_at") is not None:
+            values["taken_at"] = values["taken_at"].isoformat()
+        writer.writerow(["" if values.get(column) is None else values[column] for column in _COPY_COLUMNS])
+    buffer.seek(0)
+    return buffer
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _safe(func):
+    def wrapper(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, str(e)
+    return wrapper
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ローカルの写真アーカイブを一括で取り込む")
+    parser.add_argument("root", help="取り込むディレクトリ")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", type=uuid.UUID)
+    target.add_argument("--user-email")
+    parser.add_argument("--visibility", choices=["private", "unlisted", "public"], default="private")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="解析プロセス数")
+    parser.add_argument("--upload-concurrency", type=int, default=32, help="S3への同時アップロード数")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回のCOPYで登録する件数")
+    parser.add_argument("--ledger", default="bulk_import.sqlite", help="進捗台帳（SQLite）のパス")
+    parser.add_argument("--max-bytes", type=int, default=None, help="1ファイルの上限（省略時はアップロードと同じ）")
+    parser.add_argument("--no-quota", action="store_true", help="クォータを確認しない")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    # 同時アップロード数に合わせてS3のコネクションプールを広げる（クライアント生成前に設定）
+    pool_size = max(args.upload_concurrency, int(os.getenv("S3_MAX_POOL_CONNECTIONS", "10")))
+    os.environ["S3_MAX_POOL_CONNECTIONS"] = str(pool_size)
+
+    from sqlalchemy import text
+
+    from database import get_engine
+    from routers.photos import ALLOWED_EXTENSIONS, MAX_UPLOAD_BYTES
+    from services import photo_timeline, user_stats
+    from services.nearby_cache import nearby_cache
+    from services.s3_service import s3_service
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        if args.user_id:
+            user = conn.execute(text("SELECT id FROM users WHERE id = :id"), {"id": args.user_id}).first()
+        else:
+            user = conn.execute(text("SELECT id FROM users WHERE email = :email"), {"email": args.user_email}).first()
+    if user is None:
+        print("❌ ユーザーが見つかりません", file=sys.stderr)
+        return 1
+    user_id = user[0]
+    max_bytes = args.max_bytes or MAX_UPLOAD_BYTES
+    root = os.path.abspath(args.root)
+    ledger = Ledger(args.ledger)
+    staging_sql = text(STAGING_SQL.format(columns=", ".join(_COPY_COLUMNS)))
+    insert_sql = text(INSERT_SQL.format(
+        columns=", ".join(_COPY_COLUMNS),
+        select=", ".join("s." + column for column in _COPY_COLUMNS),
+        day=photo_timeline.DAY_SQL,
+    ))
+
+    counts = {"imported": 0, "already_present": 0, "skipped_done": 0, "failed": 0, "bytes": 0}
+    started = time.perf_counter()
+
+    def candidates():
+        for entry in iter_files(root, set(ALLOWED_EXTENSIONS)):
+            stat = entry.stat()
+            relative = os.path.relpath(entry.path, root)
+            status = ledger.status(relative, stat.st_size, stat.st_mtime_ns)
+            if status == "done":
+                counts["skipped_done"] += 1
+                continue
+            yield {
+                "path": entry.path,
+                "relative": relative,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "uploaded": status == "uploaded",
+                "photo_id": photo_id_for(user_id, relative, stat.st_size, stat.st_mtime_ns),
+            }
+
+    def upload(item):
+        key = f"photos/{item['photo_id']}{os.path.splitext(item['path'])[1].lower()}"
+        if not item["uploaded"]:
+            with open(item["path"], "rb") as body:
+                s3_service.s3_client.put_object(
+                    Bucket=s3_service.bucket_name, Key=key, Body=body, ContentType=item["mime_type"])
+        return s3_service.object_url(key)
+
+    def ledger_items(items, error=None):
+        return [(i["relative"], i["size"], i["mtime_ns"], str(i["photo_id"]), error or i.get("error"))
+                for i in items]
+
+    stopped = None
+    with ProcessPoolExecutor(max_workers=args.workers) as processes, \
+            ThreadPoolExecutor(max_workers=args.upload_concurrency) as threads:
+        batches = _chunks(candidates(), args.batch_size)
+
+        def submit(batch):
+            if batch is None:
+                return None
+            return batch, [processes.submit(_analyze, (item["path"], max_bytes)) for item in batch]
+
+        next_batch = submit(next(batches, None))
+        while next_batch is not None:
+            batch, futures = next_batch
+            # このバッチのアップロード・登録中に次のバッチの解析を進める
+            next_batch = submit(next(batches, None))
+
+            analyzed, failed = [], []
+            for item, future in zip(batch, futures):
+                values, error = future.result()
+                if values is None:
+                    item["error"] = error
+                    failed.append(item)
+                    continue
+                item["mime_type"] = mimetypes.guess_type(item["path"])[0] or "application/octet-stream"
+                item["values"] = values
+                analyzed.append(item)
+
+            uploaded = []
+            for item, result in zip(analyzed, threads.map(_safe(upload), analyzed)):
+                url, error = result
+                if url is None:
+                    item["error"] = f"アップロードに失敗しました: {error}"
+                    failed.append(item)
+                    continue
+                item["url"] = url
+                uploaded.append(item)
+            ledger.mark(ledger_items([i for i in uploaded if not i["uploaded"]]), "uploaded")
+            ledger.mark(ledger_items(failed), "failed")
+            counts["failed"] += len(failed)
+
+            rows = [{
+                **item["values"],
+                "id": item["photo_id"],
+                "user_id": user_id,
+                "s3_key": item["url"],
+                "mime_type": item["mime_type"],
+                "title": os.path.splitext(os.path.basename(item["path"]))[0][:255],
+                "visibility": args.visibility,
+            } for item in uploaded]
+            if rows:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(staging_sql)
+                        cursor = conn.connection.cursor()
+                        cursor.copy_expert(
+                            f"COPY photo_import_staging ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                            copy_rows(rows))
+                        inserted = conn.execute(insert_sql).all()
+                        user_stats.record_photos_added(
+                            conn, user_id, len(inserted), sum(row.size_bytes for row in inserted), args.visibility,
+                            enforce_quota=not args.no_quota)
+                        photo_timeline.record_photos_added(
+                            conn, user_id, args.visibility, [row.day for row in inserted])
+                except user_stats.QuotaExceededError as e:
+                    stopped = str(e)
+                    break
+                # 近くの写真検索のセルキャッシュ（RESPONSE_CACHE_BACKEND=redis ならAPIサーバーと共有）
+                for row in inserted:
+                    nearby_cache.invalidate(row.lat, row.lng)
+                counts["imported"] += len(inserted)
+                counts["already_present"] += len(rows) - len(inserted)
+                counts["bytes"] += sum(row.size_bytes for row in inserted)
+            ledger.mark(ledger_items(uploaded), "done")
+
+            elapsed = time.perf_counter() - started
+            done = counts["imported"] + counts["already_present"] + counts["failed"]
+            print(f"… {done}件 ({done / elapsed:.1f} files/s)", file=sys.stderr)
+
+        if stopped is not None:
+            for future in (next_batch[1] if next_batch else []):
+                future.cancel()
+
+    elapsed = time.perf_counter() - started
+    processed = counts["imported"] + counts["already_present"] + counts["failed"]
+    ledger_counts = ledger.counts()
+    ledger.close()
+    print(json.dumps({
+        **counts,
+        "stopped": stopped,
+        "ledger": ledger_counts,
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(processed / elapsed, 1) if elapsed else None,
+        "mb_per_s": round(counts["bytes"] / elapsed / 1024 / 1024, 2) if elapsed else None,
+    }, ensure_ascii=False))
+    return 1 if stopped else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
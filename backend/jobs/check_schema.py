@@ -0,0 +1,44 @@
+"""
+モデルとデータベースのスキーマの差分チェック
+
+適用済みのマイグレーションが head であり、models/database.py と実際のテーブル・カラム・型・
+インデックス・制約に差分がないことを確認する。デプロイ前やCIで実行する。
+終了コード: 0 一致、1 差分あり・未適用のマイグレーションあり、2 接続できない
+
+使い方（backendディレクトリで実行）:
+    alembic upgrade head
+    python -m jobs.check_schema
+"""
+import argparse
+import json
+import sys
+
+from dotenv import load_dotenv
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="モデルとデータベースのスキーマの差分チェック")
+    parser.add_argument("--database-url", default=None, help="接続先（省略時は DATABASE_URL）")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import OperationalError
+
+    from database import get_engine
+    from services import schema_drift
+
+    engine = create_engine(args.database_url) if args.database_url else get_engine()
+    try:
+        with engine.connect() as conn:
+            result = schema_drift.check(conn)
+    except OperationalError as e:
+        print(f"データベースに接続できません: {e}", file=sys.stderr)
+        return 2
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result["at_head"] and not result["drift"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
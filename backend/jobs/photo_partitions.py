@@ -0,0 +1,77 @@
+"""
+photos テーブルのパーティション管理
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.photo_partitions status
+    python -m jobs.photo_partitions ensure --months-ahead 3
+    python -m jobs.photo_partitions migrate      # 既存の photos を月次パーティションへ移行
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date
+
+from dotenv import load_dotenv
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="photos テーブルのパーティション管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="パーティション一覧")
+    ensure = sub.add_parser("ensure", help="先の月のパーティションを作成")
+    ensure.add_argument("--months-ahead", type=int, default=None)
+    migrate = sub.add_parser("migrate", help="既存テーブルを月次パーティションに移行")
+    migrate.add_argument("--months-ahead", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from database import get_engine
+    from services import photo_partitions as pp
+
+    engine = get_engine()
+    months_ahead = getattr(args, "months_ahead", None)
+    if months_ahead is None:
+        months_ahead = pp.PARTITION_MONTHS_AHEAD
+
+    if args.command == "status":
+        with engine.connect() as conn:
+            result = {
+                "partitioned": pp.is_partitioned(conn),
+                "partitions": pp.list_partitions(conn),
+            }
+    elif args.command == "ensure":
+        with engine.begin() as conn:
+            result = {"created": pp.ensure_partitions(conn, months_ahead)}
+    else:
+        with engine.connect() as conn:
+            if pp.is_partitioned(conn):
+                print("photos は既にパーティション化されています", file=sys.stderr)
+                return 1
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            prepared = pp.prepare_migration(conn, months_ahead)
+        # 月ごとに別トランザクションでコピーし、ロック時間とWALの山を抑える
+        copied = 0
+        first = date.fromisoformat(prepared["first_month"])
+        last = date.fromisoformat(prepared["last_month"])
+        for month in pp.iter_months(first, last):
+            with engine.begin() as conn:
+                rows = pp.copy_month(conn, month)
+            copied += rows
+            print(f"{month:%Y-%m}: {rows} rows", file=sys.stderr)
+        with engine.begin() as conn:
+            swapped = pp.swap_tables(conn)
+        result = {
+            "copied": copied,
+            **swapped,
+            "elapsed_s": round(time.perf_counter() - started, 2),
+            "note": f"旧テーブルは {pp.LEGACY_TABLE} として残っています。確認後に DROP してください。",
+        }
+
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+タイムライン集計（photo_timeline_days）の作り直しジョブ
+
+全ユーザー（または指定ユーザー）について写真テーブルから撮影日ごとの件数を集計し直す。
+マイグレーション 0004 の適用後に一度、その後はずれが疑われるときに実行する。
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.rebuild_timeline [--user-id UUID] [--batch-size 200]
+"""
+import argparse
+import json
+import sys
+import time
+from uuid import UUID
+
+from dotenv import load_dotenv
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="タイムラインの集計を作り直す")
+    parser.add_argument("--user-id", type=UUID, action="append", help="対象ユーザー（複数指定可、省略時は全員）")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from sqlalchemy import select
+
+    from database import SessionLocal, get_engine
+    from models.database import User
+    from services import photo_timeline
+
+    get_engine()
+    started = time.perf_counter()
+    users = 0
+    rows = 0
+
+    db = SessionLocal()
+    try:
+        if args.user_id:
+            batches = [args.user_id[i:i + args.batch_size] for i in range(0, len(args.user_id), args.batch_size)]
+        else:
+            batches = None
+
+        last_id = None
+        while True:
+            if batches is not None:
+                if not batches:
+                    break
+                user_ids = batches.pop(0)
+            else:
+                # ユーザーIDのキーセットページングで全員を処理（バッチごとにコミットしてロックを短くする）
+                query = select(User.id).order_by(User.id).limit(args.batch_size)
+                if last_id is not None:
+                    query = query.where(User.id > last_id)
+                user_ids = list(db.scalars(query))
+                if not user_ids:
+                    break
+                last_id = user_ids[-1]
+
+            rows += photo_timeline.rebuild(db, user_ids)
+            db.commit()
+            users += len(user_ids)
+    finally:
+        db.close()
+
+    print(json.dumps({
+        "users": users,
+        "rows": rows,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
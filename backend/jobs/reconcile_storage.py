@@ -0,0 +1,170 @@
+"""
+S3とphotosテーブルの孤立データ検出・削除ジョブ
+
+バケット一覧とphotosのキーをどちらもキー順にストリーミングしてマージジョインするため、
+数千万件でもメモリ使用量は一定。処理済みの位置をチェックポイントに保存し、中断しても続きから再開できる。
+アップロード中のデータを誤検出しないよう、--min-age-hours より新しいものは対象外にする。
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.reconcile_storage --output orphans.jsonl --checkpoint reconcile.json
+    python -m jobs.reconcile_storage --delete-objects --rate 2000 --checkpoint reconcile.json
+
+大量の行がある場合は、キーの式インデックスを作っておくと並べ替えが不要になる:
+    CREATE INDEX CONCURRENTLY idx_photos_storage_key ON photos ((<storage_reconcile.STORAGE_KEY_EXPR>));
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+
+def _load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def _save_checkpoint(path, state):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _is_recent(value, cutoff) -> bool:
+    if value is None:
+        return False
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value > cutoff
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="S3とphotosテーブルの孤立データを検出・削除する")
+    parser.add_argument("--prefix", default="photos/")
+    parser.add_argument("--page-size", type=int, default=1000, help="S3一覧の1ページの件数")
+    parser.add_argument("--rate", type=float, default=0, help="1秒あたりに処理するキー数の上限（0は無制限）")
+    parser.add_argument("--min-age-hours", type=float, default=24, help="これより新しいオブジェクト・行は対象外")
+    parser.add_argument("--checkpoint", help="処理位置を保存するファイル（あれば続きから再開）")
+    parser.add_argument("--checkpoint-every", type=int, default=10000)
+    parser.add_argument("--output", help="検出結果をJSON Linesで出力するファイル")
+    parser.add_argument("--delete-objects", action="store_true", help="DBに行がないオブジェクトを削除する")
+    parser.add_argument("--delete-rows", action="store_true", help="S3にオブジェクトがない行を削除する")
+    parser.add_argument("--batch-size", type=int, default=1000, help="まとめて削除する件数（S3は最大1000）")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from database import SessionLocal, get_engine
+    from models.database import Photo
+    from services import photo_sync, photo_timeline, user_stats
+    from services.s3_service import s3_service
+    from services.storage_reconcile import RateLimiter, iter_photo_keys, iter_storage_objects, merge_orphans
+
+    engine = get_engine()
+    checkpoint = _load_checkpoint(args.checkpoint) or {}
+    if checkpoint.get("completed"):
+        print("⚠️ チェックポイントは完了済みです。最初からやり直す場合はファイルを削除してください", file=sys.stderr)
+        return 0
+    after = checkpoint.get("after")
+    counts = checkpoint.get("counts") or {
+        "matched": 0, "orphan_object": 0, "missing_object": 0, "skipped_recent": 0,
+        "deleted_objects": 0, "deleted_rows": 0, "delete_errors": 0,
+    }
+
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=args.min_age_hours)
+    limiter = RateLimiter(args.rate)
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    pending_objects = []
+    pending_rows = []
+    started = time.perf_counter()
+    processed = 0
+
+    def flush():
+        if pending_objects:
+            for i in range(0, len(pending_objects), 1000):
+                batch = pending_objects[i:i + 1000]
+                response = s3_service.s3_client.delete_objects(
+                    Bucket=s3_service.bucket_name,
+                    Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+                errors = response.get("Errors", [])
+                counts["delete_errors"] += len(errors)
+                counts["deleted_objects"] += len(batch) - len(errors)
+            pending_objects.clear()
+        if pending_rows:
+            # 通常の削除と同じくカウンタと差分同期の記録も更新する
+            db = SessionLocal()
+            try:
+                for photo in db.query(Photo).filter(Photo.id.in_(pending_rows)):
+                    user_stats.record_photo_removed(db, photo)
+                    photo_timeline.record_photo_removed(db, photo)
+                    photo_sync.record_deletion(db, photo)
+                    db.delete(photo)
+                    counts["deleted_rows"] += 1
+                db.commit()
+            finally:
+                db.close()
+            pending_rows.clear()
+
+    try:
+        with engine.connect() as conn:
+            objects = iter_storage_objects(
+                s3_service.s3_client, s3_service.bucket_name, args.prefix, after, args.page_size)
+            rows = iter_photo_keys(conn, args.prefix, after)
+            for kind, key, item in merge_orphans(objects, rows):
+                limiter.wait()
+                processed += 1
+                if kind == "matched":
+                    counts["matched"] += 1
+                elif kind == "orphan_object":
+                    if _is_recent(item.last_modified, cutoff):
+                        counts["skipped_recent"] += 1
+                    else:
+                        counts["orphan_object"] += 1
+                        if output:
+                            output.write(json.dumps({"type": kind, "key": key, "size": item.size}) + "\n")
+                        if args.delete_objects:
+                            pending_objects.append(key)
+                else:
+                    if _is_recent(item.created_at, cutoff):
+                        counts["skipped_recent"] += 1
+                    else:
+                        counts["missing_object"] += 1
+                        if output:
+                            output.write(json.dumps({"type": kind, "key": key, "photo_id": str(item.photo_id)}) + "\n")
+                        if args.delete_rows:
+                            pending_rows.append(item.photo_id)
+
+                if len(pending_objects) >= args.batch_size or len(pending_rows) >= args.batch_size:
+                    flush()
+                if processed % args.checkpoint_every == 0:
+                    # 削除を反映してから位置を保存する（再開時に取りこぼさないように）
+                    flush()
+                    if output:
+                        output.flush()
+                    _save_checkpoint(args.checkpoint, {"after": key, "counts": counts})
+        flush()
+        _save_checkpoint(args.checkpoint, {"after": None, "counts": counts, "completed": True})
+    finally:
+        if output:
+            output.close()
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        **counts,
+        "processed": processed,
+        "resumed_after": after,
+        "elapsed_s": round(elapsed, 3),
+        "keys_per_s": round(processed / elapsed, 1) if elapsed else None,
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
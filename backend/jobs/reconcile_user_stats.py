@@ -0,0 +1,76 @@
+"""
+user_stats のずれ修復ジョブ
+
+全ユーザー（または指定ユーザー）について写真テーブルから件数・容量を再集計し、
+カウンタと異なる行を修復する。cron等で定期実行する想定。
+
+使い方（backendディレクトリで実行）:
+    python -m jobs.reconcile_user_stats [--user-id UUID] [--batch-size 500]
+"""
+import argparse
+import json
+import sys
+import time
+from uuid import UUID
+
+from dotenv import load_dotenv
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="user_stats のずれを修復する")
+    parser.add_argument("--user-id", type=UUID, action="append", help="対象ユーザー（複数指定可、省略時は全員）")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    from sqlalchemy import select
+
+    from database import SessionLocal, get_engine
+    from models.database import User
+    from services import user_stats
+
+    get_engine()
+    started = time.perf_counter()
+    checked = 0
+    repaired = []
+
+    db = SessionLocal()
+    try:
+        if args.user_id:
+            batches = [args.user_id[i:i + args.batch_size] for i in range(0, len(args.user_id), args.batch_size)]
+        else:
+            batches = None
+
+        last_id = None
+        while True:
+            if batches is not None:
+                if not batches:
+                    break
+                user_ids = batches.pop(0)
+            else:
+                # ユーザーIDのキーセットページングで全員を処理
+                query = select(User.id).order_by(User.id).limit(args.batch_size)
+                if last_id is not None:
+                    query = query.where(User.id > last_id)
+                user_ids = list(db.scalars(query))
+                if not user_ids:
+                    break
+                last_id = user_ids[-1]
+
+            repaired.extend(user_stats.reconcile(db, user_ids))
+            db.commit()
+            checked += len(user_ids)
+    finally:
+        db.close()
+
+    print(json.dumps({
+        "checked": checked,
+        "repaired": len(repaired),
+        "repaired_user_ids": [str(u) for u in repaired[:100]],
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,66 +1,128 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
 import os
-from dotenv import load_dotenv
 
-# ルーターのインポート
-from routers import auth, photos
 
-load_dotenv()
+def create_app() -> FastAPI:
+    """
+    アプリケーションを生成
 
-# Database setup
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/mobileapp")
+    DB接続・S3クライアント・画像ライブラリなど重いものは初回利用時まで生成しないため、
+    ワーカー起動直後からリクエストを受け付けられる。
+    uvicorn --factory main:create_app で直接起動することもできる。
+    """
+    from dotenv import load_dotenv
 
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # ルーター等が環境変数を読む前に .env を読み込む
+    load_dotenv()
 
-Base = declarative_base()
+    # ルーターのインポート
+    from routers import auth, photos, debug, live, uploads, profiles
+    import database
+    from services.metrics import MetricsMiddleware, instrument_engine, registry
+    from services import (
+        query_diagnostics, photo_partitions, photo_sync, live_updates, idempotency, resumable_uploads, profiling
+    )
+    from services.scheduler import PeriodicTasks
 
-# FastAPI app
-app = FastAPI(
-    title="Photo Sharing API", 
-    version="1.0.0",
-    description="写真共有アプリケーションのAPI",
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
+    # 定期タスク
+    tasks = PeriodicTasks()
+    if photo_partitions.PHOTOS_PARTITIONED:
+        tasks.add("photo_partitions", 6 * 3600, photo_partitions.run_ensure_partitions)
+    tasks.add("photo_tombstones", 3600, photo_sync.run_purge_tombstones, run_at_start=False)
+    tasks.add("idempotency_keys", 600, idempotency.run_purge_expired, run_at_start=False)
+    tasks.add("upload_sessions", 3600, resumable_uploads.run_collect_garbage)
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 本番環境では適切に設定してください
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    # 他のワーカーでアップロードされた写真もリアルタイム配信する（LISTEN/NOTIFY）
+    bridge = live_updates.NotifyBridge(live_updates.live_hub) if live_updates.LIVE_NOTIFY_BRIDGE else None
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        tasks.start()
+        if bridge is not None:
+            bridge.start(asyncio.get_running_loop())
+        yield
+        if bridge is not None:
+            await asyncio.to_thread(bridge.stop)
+        await tasks.stop()
 
-# ルーターの登録
-app.include_router(auth.router)
-app.include_router(photos.router)
+    app = FastAPI(
+        title="Photo Sharing API",
+        version="1.0.0",
+        description="写真共有アプリケーションのAPI",
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
 
-# Routes
-@app.get("/")
-async def root():
-    return {"message": "Photo Sharing API is running!", "version": "1.0.0"}
+    # Idempotency-Key による再送の重複排除（再生したレスポンスにもCORSヘッダーが付くよう内側に置く）
+    app.add_middleware(idempotency.IdempotencyMiddleware)
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # 本番環境では適切に設定してください
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # メトリクス（ルート別レイテンシ・SQL・S3・認証の計測）
+    app.add_middleware(MetricsMiddleware)
+    database.on_engine_created(instrument_engine)
+
+    # SQL診断モード（遅いクエリのEXPLAIN取得・N+1検出）
+    if query_diagnostics.ENABLED:
+        app.add_middleware(query_diagnostics.QueryDiagnosticsMiddleware)
+        database.on_engine_created(query_diagnostics.diagnostics.instrument_engine)
+
+    # リクエスト単位のプロファイラ（最も外側。無効時はミドルウェア自体を登録しない）
+    if profiling.PROFILING_ENABLED:
+        app.add_middleware(profiling.ProfilingMiddleware)
+
+    # ルーターの登録
+    app.include_router(auth.router)
+    app.include_router(photos.router)
+    app.include_router(live.router)
+    app.include_router(uploads.router)
+    if profiling.PROFILING_ENABLED:
+        app.include_router(profiles.router)
+    if query_diagnostics.ENABLED and os.getenv("DEBUG", "false").lower() in ("1", "true", "yes"):
+        app.include_router(debug.router)
+
+    # Routes
+    @app.get("/")
+    async def root():
+        return {"message": "Photo Sharing API is running!", "version": "1.0.0"}
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy", "timestamp": datetime.utcnow()}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus形式のメトリクス"""
+        return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # main:app は初回参照時に生成する（import main だけでは何も初期化しない）
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("main:create_app", factory=True, host="0.0.0.0", port=8000)
@@ -0,0 +1,147 @@
+"""ベースライン（init.sql で作成していたスキーマ）
+
+init.sql で作成済みの既存データベースにもそのまま適用できるよう、すべて IF NOT EXISTS で作成する。
+以前のバージョンから追加されたカラムも ADD COLUMN IF NOT EXISTS で揃える。
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-03
+"""
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS postgis",
+    'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password_hash VARCHAR(255) NOT NULL,
+        username VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        refresh_token_hash VARCHAR(255) NOT NULL,
+        user_agent TEXT,
+        device_name VARCHAR(255),
+        ip_address VARCHAR(45),
+        issued_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        revoked_at TIMESTAMP WITH TIME ZONE
+    )
+    """,
+    # 写真の作成・更新・削除の通し番号（差分同期のカーソル）
+    "CREATE SEQUENCE IF NOT EXISTS photo_change_seq",
+    """
+    CREATE TABLE IF NOT EXISTS photos (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        s3_key VARCHAR(500) NOT NULL,
+        mime_type VARCHAR(100) NOT NULL,
+        size_bytes BIGINT NOT NULL,
+        title VARCHAR(255),
+        description TEXT,
+        lat FLOAT,
+        lng FLOAT,
+        location GEOGRAPHY(POINT, 4326),
+        accuracy_m FLOAT,
+        address TEXT,
+        exif JSONB,
+        visibility VARCHAR(20) DEFAULT 'private' NOT NULL CHECK (visibility IN ('private', 'unlisted', 'public')),
+        taken_at TIMESTAMP WITH TIME ZONE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+        change_seq BIGINT DEFAULT nextval('photo_change_seq') NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT clock_timestamp() NOT NULL,
+        phash BIGINT,
+        blurhash VARCHAR(64),
+        dominant_color VARCHAR(7),
+        width INTEGER,
+        height INTEGER,
+        crc32 BIGINT
+    )
+    """,
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS phash BIGINT",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS blurhash VARCHAR(64)",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS dominant_color VARCHAR(7)",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS width INTEGER",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS height INTEGER",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS crc32 BIGINT",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS change_seq BIGINT DEFAULT nextval('photo_change_seq') NOT NULL",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT clock_timestamp() NOT NULL",
+    """
+    CREATE TABLE IF NOT EXISTS photo_tombstones (
+        photo_id UUID PRIMARY KEY,
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        change_seq BIGINT DEFAULT nextval('photo_change_seq') NOT NULL,
+        deleted_at TIMESTAMP WITH TIME ZONE DEFAULT clock_timestamp() NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        key VARCHAR(255) NOT NULL,
+        method VARCHAR(10) NOT NULL,
+        path VARCHAR(500) NOT NULL,
+        request_hash VARCHAR(64) NOT NULL,
+        status VARCHAR(20) DEFAULT 'in_progress' NOT NULL,
+        response_status INTEGER,
+        response_headers JSONB,
+        response_body BYTEA,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+        locked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+        completed_at TIMESTAMP WITH TIME ZONE,
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (user_id, key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        name VARCHAR(100) PRIMARY KEY,
+        value BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        photo_count BIGINT DEFAULT 0 NOT NULL,
+        total_bytes BIGINT DEFAULT 0 NOT NULL,
+        public_count BIGINT DEFAULT 0 NOT NULL,
+        unlisted_count BIGINT DEFAULT 0 NOT NULL,
+        private_count BIGINT DEFAULT 0 NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+    "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_revoked_at ON sessions(revoked_at)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_user_id ON photos(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_visibility ON photos(visibility)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_created_at ON photos(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_taken_at ON photos(taken_at)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_location ON photos USING GIST(location)",
+    "CREATE INDEX IF NOT EXISTS idx_photos_user_change_seq ON photos(user_id, change_seq)",
+    "CREATE INDEX IF NOT EXISTS idx_photo_tombstones_user_change_seq ON photo_tombstones(user_id, change_seq)",
+    "CREATE INDEX IF NOT EXISTS idx_photo_tombstones_deleted_at ON photo_tombstones(deleted_at)",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at)",
+]
+
+
+def upgrade():
+    for statement in STATEMENTS:
+        op.execute(statement)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS idempotency_keys, photo_tombstones, sync_state, user_stats, photos, sessions, users CASCADE")
+    op.execute("DROP SEQUENCE IF EXISTS photo_change_seq")
@@ -0,0 +1,44 @@
+"""visibility を VARCHAR + CHECK 制約に統一
+
+init.sql で作ったデータベースは VARCHAR(20) + CHECK、モデルの create_all で作ったデータベースは
+Postgresの列挙型になっていた。既存の大半に合わせて VARCHAR に統一し、モデルも非ネイティブの Enum にする。
+列挙型だった場合だけ型を変換する（テーブルの書き換えになるので、その環境ではメンテナンス時間に適用する）。
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-03
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    DO $$
+    DECLARE
+        enum_type TEXT;
+    BEGIN
+        SELECT udt_name INTO enum_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'photos'
+          AND column_name = 'visibility' AND data_type = 'USER-DEFINED';
+        IF enum_type IS NOT NULL THEN
+            ALTER TABLE photos ALTER COLUMN visibility DROP DEFAULT;
+            ALTER TABLE photos ALTER COLUMN visibility TYPE VARCHAR(20) USING visibility::text;
+            ALTER TABLE photos ALTER COLUMN visibility SET DEFAULT 'private';
+            ALTER TABLE photos ADD CONSTRAINT photos_visibility_check
+                CHECK (visibility IN ('private', 'unlisted', 'public'));
+            EXECUTE format('DROP TYPE %I', enum_type);
+        END IF;
+    END
+    $$
+    """)
+
+
+def downgrade():
+    # ベースラインも VARCHAR なので戻す必要はない
+    pass
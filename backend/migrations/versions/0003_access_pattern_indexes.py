@@ -0,0 +1,83 @@
+"""アクセスパターンに合わせたインデックス
+
+- 自分のライブラリ・エクスポート: (user_id, created_at, id)
+- 未認証の新着一覧: 公開写真だけの部分インデックス (created_at)
+- 未認証の近くの写真検索・セルキャッシュの読み込み: 公開かつ位置情報ありの部分GiST
+
+複合インデックスの先頭と重なる idx_photos_user_id、選択性のない idx_photos_visibility、
+部分インデックスに置き換える idx_photos_created_at、どのクエリも使わない idx_photos_taken_at、
+UNIQUE制約と重複する idx_users_email は削除する。
+作成・削除はすべて CONCURRENTLY（photos が分割済みならパーティションごとに作ってアタッチ）で、書き込みを止めない。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-03
+"""
+from alembic import context, op
+
+from services import photo_partitions
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# (名前, 列, 方式, 条件)
+NEW_PHOTO_INDEXES = [
+    ("idx_photos_user_created_at", "user_id, created_at, id", None, None),
+    ("idx_photos_public_created_at", "created_at", None, "visibility = 'public'"),
+    ("idx_photos_public_location", "location", "gist", "visibility = 'public' AND location IS NOT NULL"),
+]
+REDUNDANT_PHOTO_INDEXES = [
+    ("idx_photos_user_id", "user_id", None, None),
+    ("idx_photos_visibility", "visibility", None, None),
+    ("idx_photos_created_at", "created_at", None, None),
+    ("idx_photos_taken_at", "taken_at", None, None),
+]
+REDUNDANT_USER_INDEXES = [
+    ("idx_users_email", "email", None, None),
+]
+
+
+def _partitions():
+    """photos が分割テーブルならパーティション名の一覧（SQL出力モードでは確認できないので None）"""
+    if context.is_offline_mode():
+        return None
+    conn = op.get_bind()
+    if not photo_partitions.is_partitioned(conn):
+        return None
+    return [p["name"] for p in photo_partitions.list_partitions(conn)]
+
+
+def _create(indexes, partitions, table=photo_partitions.PARENT_TABLE):
+    names = [index[0] for index in indexes]
+    if partitions:
+        names += [f"{name}_{partition}" for name in names for partition in partitions]
+    if not context.is_offline_mode():
+        # 前回の CONCURRENTLY が失敗して無効なまま残っていれば作り直す
+        for name in photo_partitions.invalid_indexes(op.get_bind(), names):
+            op.execute(photo_partitions.drop_index_ddl(name))
+    for name, columns, using, where in indexes:
+        for statement in photo_partitions.concurrent_index_ddl(name, columns, using, where, partitions, table):
+            op.execute(statement)
+
+
+def _drop(indexes, partitioned=False):
+    for name, *_ in indexes:
+        op.execute(photo_partitions.drop_index_ddl(name, partitioned))
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        partitions = _partitions()
+        _create(NEW_PHOTO_INDEXES, partitions)
+        _drop(REDUNDANT_PHOTO_INDEXES, partitions is not None)
+        _drop(REDUNDANT_USER_INDEXES)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        partitions = _partitions()
+        _create(REDUNDANT_PHOTO_INDEXES, partitions)
+        _create(REDUNDANT_USER_INDEXES, None, table="users")
+        _drop(NEW_PHOTO_INDEXES, partitions is not None)
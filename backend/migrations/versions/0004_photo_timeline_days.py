@@ -0,0 +1,40 @@
+"""タイムラインの集計テーブル photo_timeline_days
+
+(ユーザー, 公開範囲, 撮影日) ごとの写真数。作成時に既存の写真から一度だけ集計する。
+このリビジョンの適用後、新しいバージョンのAPIに切り替わるまでに古いバージョンが書き込んだ写真は
+反映されないので、切り替え後に python -m jobs.rebuild_timeline を実行する。
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-10
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS photo_timeline_days (
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        visibility VARCHAR(20) NOT NULL,
+        day DATE NOT NULL,
+        photo_count BIGINT DEFAULT 0 NOT NULL,
+        PRIMARY KEY (user_id, visibility, day)
+    )
+    """)
+    # 日付の決め方は services/photo_timeline.py の DAY_SQL と同じ
+    op.execute("""
+    INSERT INTO photo_timeline_days (user_id, visibility, day, photo_count)
+    SELECT user_id, visibility::text, (COALESCE(taken_at, created_at) AT TIME ZONE 'UTC')::date, COUNT(*)
+    FROM photos
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, visibility, day) DO UPDATE SET photo_count = EXCLUDED.photo_count
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS photo_timeline_days")
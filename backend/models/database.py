@@ -1,7 +1,7 @@
-from sqlalchemy import Column, String, DateTime, Text, Float, BigInteger, Enum as SQLEnum, ForeignKey, Index
+from sqlalchemy import Column, String, DateTime, Date, Text, Float, BigInteger, Integer, LargeBinary, Enum as SQLEnum, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from geoalchemy2 import Geography
 import uuid
 import enum
@@ -14,12 +14,16 @@ class VisibilityEnum(enum.Enum):
     public = "public"
 
 
+# スキーマは migrations/ のリビジョンで管理する（変更したら alembic revision を追加し、
+# python -m jobs.check_schema で実際のデータベースとの差分がないことを確認する）
+
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(UUID(as_uuid=True), primary_key=True,
-                default=uuid.uuid4, index=True)
-    email = Column(String(255), unique=True, index=True, nullable=False)
+                default=uuid.uuid4)
+    email = Column(String(255), unique=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
     username = Column(String(100), nullable=False)
     created_at = Column(DateTime(timezone=True),
@@ -30,10 +34,11 @@ class User(Base):
         "Session", back_populates="user", cascade="all, delete-orphan")
     photos = relationship("Photo", back_populates="user",
                           cascade="all, delete-orphan")
+    stats = relationship("UserStats", back_populates="user", uselist=False,
+                         cascade="all, delete-orphan")
 
     # Indexes
     __table_args__ = (
-        Index('idx_users_email', 'email'),
         Index('idx_users_created_at', 'created_at'),
     )
 
@@ -42,7 +47,7 @@ class Session(Base):
     __tablename__ = "sessions"
 
     id = Column(UUID(as_uuid=True), primary_key=True,
-                default=uuid.uuid4, index=True)
+                default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey(
         "users.id", ondelete="CASCADE"), nullable=False)
     refresh_token_hash = Column(String(255), nullable=False)
@@ -69,7 +74,7 @@ class Photo(Base):
     __tablename__ = "photos"
 
     id = Column(UUID(as_uuid=True), primary_key=True,
-                default=uuid.uuid4, index=True)
+                default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey(
         "users.id", ondelete="CASCADE"), nullable=False)
     s3_key = Column(String(500), nullable=False)
@@ -79,26 +84,127 @@ class Photo(Base):
     description = Column(Text)
     lat = Column(Float)
     lng = Column(Float)
-    location = Column(Geography('POINT', srid=4326))  # PostGIS Point
+    # PostGIS Point（GiSTインデックスは __table_args__ で定義する）
+    location = Column(Geography('POINT', srid=4326, spatial_index=False))
     accuracy_m = Column(Float)
     address = Column(Text)
     exif = Column(JSONB)
- 
-    visibility = Column(SQLEnum(VisibilityEnum),
-                        default=VisibilityEnum.private, nullable=False)
+    # VARCHAR(20) + CHECK 制約（Postgresの列挙型は使わない）
+    visibility = Column(SQLEnum(VisibilityEnum, native_enum=False, length=20, create_constraint=True,
+                                name="photos_visibility_check"),
+                        default=VisibilityEnum.private, server_default="private", nullable=False)
 
     taken_at = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True),
                         server_default=func.now(), nullable=False)
+    # 差分同期用: 作成・更新のたびに photo_change_seq から採番し直す
+    change_seq = Column(BigInteger, server_default=text("nextval('photo_change_seq')"),
+                        onupdate=func.nextval('photo_change_seq'), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.clock_timestamp(),
+                        onupdate=func.clock_timestamp(), nullable=False)
+    phash = Column(BigInteger)  # 知覚ハッシュ（dHash、類似写真の検出用）
+    # 一覧表示用のプレースホルダー（画像のダウンロード前にグリッドを描画する）
+    blurhash = Column(String(64))
+    dominant_color = Column(String(7))  # #rrggbb
+    width = Column(Integer)
+    height = Column(Integer)
+    crc32 = Column(BigInteger)  # 元ファイルのCRC32（ZIPエクスポートのレイアウトを事前に決めるため）
 
     # Relationships
     user = relationship("User", back_populates="photos")
 
     # Indexes
     __table_args__ = (
-        Index('idx_photos_user_id', 'user_id'),
-        Index('idx_photos_visibility', 'visibility'),
-        Index('idx_photos_created_at', 'created_at'),
-        Index('idx_photos_taken_at', 'taken_at'),
+        # 自分のライブラリ・エクスポート（created_at, id 順）
+        Index('idx_photos_user_created_at', 'user_id', 'created_at', 'id'),
+        # 未認証の新着一覧
+        Index('idx_photos_public_created_at', 'created_at',
+              postgresql_where=text("visibility = 'public'")),
         Index('idx_photos_location', 'location', postgresql_using='gist'),
+        # 未認証の近くの写真検索
+        Index('idx_photos_public_location', 'location', postgresql_using='gist',
+              postgresql_where=text("visibility = 'public' AND location IS NOT NULL")),
+        Index('idx_photos_user_change_seq', 'user_id', 'change_seq'),
     )
+
+
+class PhotoTombstone(Base):
+    """削除された写真の記録（差分同期で削除を伝えるため、保持期間を過ぎたら消す）"""
+    __tablename__ = "photo_tombstones"
+
+    photo_id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey(
+        "users.id", ondelete="CASCADE"), nullable=False)
+    change_seq = Column(BigInteger, server_default=text("nextval('photo_change_seq')"), nullable=False)
+    deleted_at = Column(DateTime(timezone=True),
+                        server_default=func.clock_timestamp(), nullable=False)
+
+    # Indexes
+    __table_args__ = (
+        Index('idx_photo_tombstones_user_change_seq', 'user_id', 'change_seq'),
+        Index('idx_photo_tombstones_deleted_at', 'deleted_at'),
+    )
+
+
+class IdempotencyKey(Base):
+    """Idempotency-Key ごとの処理結果（期限を過ぎたら定期タスクで削除）"""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    method = Column(String(10), nullable=False)
+    path = Column(String(500), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), default="in_progress", server_default="in_progress", nullable=False)
+    response_status = Column(Integer)
+    response_headers = Column(JSONB)
+    response_body = Column(LargeBinary)
+    created_at = Column(DateTime(timezone=True),
+                        server_default=func.now(), nullable=False)
+    locked_at = Column(DateTime(timezone=True),
+                       server_default=func.now(), nullable=False)
+    completed_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    # Indexes
+    __table_args__ = (
+        Index('idx_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+
+class SyncState(Base):
+    """同期処理の状態（トンボストーンを削除済みの change_seq など）"""
+    __tablename__ = "sync_state"
+
+    name = Column(String(100), primary_key=True)
+    value = Column(BigInteger, nullable=False)
+
+
+class UserStats(Base):
+    """ユーザーごとの写真数・容量（写真の追加・削除と同じトランザクションで更新）"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True)
+    photo_count = Column(BigInteger, default=0, server_default="0", nullable=False)
+    total_bytes = Column(BigInteger, default=0, server_default="0", nullable=False)
+    public_count = Column(BigInteger, default=0, server_default="0", nullable=False)
+    unlisted_count = Column(BigInteger, default=0, server_default="0", nullable=False)
+    private_count = Column(BigInteger, default=0, server_default="0", nullable=False)
+    updated_at = Column(DateTime(timezone=True),
+                        server_default=func.now(), nullable=False)
+
+    # Relationships
+    user = relationship("User", back_populates="stats")
+
+
+class PhotoTimelineDay(Base):
+    """ユーザー・公開範囲・撮影日ごとの写真数（写真の追加・削除と同じトランザクションで更新）"""
+    __tablename__ = "photo_timeline_days"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True)
+    visibility = Column(String(20), primary_key=True)
+    day = Column(Date, primary_key=True)
+    photo_count = Column(BigInteger, default=0, server_default="0", nullable=False)
@@ -7,11 +7,13 @@ from datetime import datetime, timedelta
 from database import get_db
 from models.database import User, Session as DBSession
 from schemas.schemas import (
-    UserCreate, UserResponse, UserUpdate, UserLogin,
+    UserCreate, UserResponse, UserUpdate, UserLogin, UserStatsResponse,
     TokenResponse, RefreshTokenRequest, SessionResponse, SessionCreate,
     PaginationParams, PaginatedResponse
 )
 from auth.auth_service import AuthService, get_current_user
+from services import user_stats
+from services.db_routing import replica_router
 
 router = APIRouter(prefix="/auth", tags=["認証"])
 
@@ -38,6 +40,8 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    # Bearerトークンのないリクエストなので、直後のGETが作成前のレプリカを読まないよう明示的に固定する
+    replica_router.mark_write(str(db_user.id))
     
     return db_user
 
@@ -71,6 +75,7 @@ async def login(
         ip_address=None  # フロントエンドから送信
     )
     AuthService.create_session(db, user.id, refresh_token, session_data)
+    replica_router.mark_write(str(user.id))
     
     return TokenResponse(
         access_token=access_token,
@@ -91,6 +96,7 @@ async def refresh_token(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="無効なリフレッシュトークンです"
         )
+    replica_router.mark_write(str(session.user_id))
     
     # 新しいアクセストークン作成
     access_token_expires = timedelta(minutes=30)
@@ -114,6 +120,7 @@ async def logout(
     session = AuthService.verify_refresh_token(db, refresh_request.refresh_token)
     if session:
         AuthService.revoke_session(db, session.id)
+        replica_router.mark_write(str(session.user_id))
     
     return {"message": "ログアウトしました"}
 
@@ -124,6 +131,19 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+@router.get("/me/stats", response_model=UserStatsResponse)
+async def get_current_user_stats(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """現在のユーザーの写真数・使用容量を取得"""
+    stats = user_stats.get_stats(db, current_user.id)
+    response = UserStatsResponse.model_validate(stats) if stats else UserStatsResponse()
+    response.quota_max_photos = user_stats.QUOTA_MAX_PHOTOS or None
+    response.quota_max_bytes = user_stats.QUOTA_MAX_BYTES or None
+    return response
+
+
 @router.put("/me", response_model=UserResponse)
 async def update_current_user(
     user_update: UserUpdate,
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+
+from services.query_diagnostics import diagnostics
+
+# 開発環境専用（main.pyでDEBUGかつQUERY_DIAGNOSTICS有効時のみ登録）
+router = APIRouter(prefix="/debug", tags=["開発用"])
+
+
+@router.get("/queries")
+async def get_query_diagnostics():
+    """遅いクエリ（EXPLAIN付き）とN+1の検出結果を取得"""
+    return diagnostics.snapshot()
+
+
+@router.delete("/queries")
+async def clear_query_diagnostics():
+    """記録済みの診断結果を消去"""
+    diagnostics.slow_queries.clear()
+    diagnostics.n_plus_one.clear()
+    return {"message": "診断結果を消去しました"}
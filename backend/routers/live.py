@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from services.live_updates import Subscriber, live_hub
+
+router = APIRouter(prefix="/photos", tags=["写真"])
+
+
+async def _receive_commands(websocket: WebSocket, subscriber: Subscriber):
+    """購読の変更を受け付ける"""
+    while True:
+        try:
+            message = json.loads(await websocket.receive_text())
+            if not isinstance(message, dict) or message.get("type") != "subscribe":
+                raise ValueError("type は subscribe を指定してください")
+            if "cells" in message:
+                cells = [str(c) for c in message["cells"]]
+            else:
+                cells = live_hub.cells_for_radius(
+                    float(message["lat"]), float(message["lng"]), float(message.get("radius_km", 5)))
+            live_hub.set_cells(subscriber, cells)
+        except (ValueError, KeyError, TypeError) as e:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            continue
+        await websocket.send_json({"type": "subscribed", "cells": sorted(subscriber.cells)})
+
+
+async def _send_events(websocket: WebSocket, subscriber: Subscriber):
+    while True:
+        message = await subscriber.queue.get()
+        if message is None:
+            # 受信が追いつかない接続は切断する（クライアントは再接続して取り直す）
+            await websocket.close(code=1013, reason="slow consumer")
+            return
+        await websocket.send_text(message)
+
+
+@router.websocket("/live")
+async def live_photos(websocket: WebSocket):
+    """
+    近くの公開写真をリアルタイムに受け取る
+
+    送信: {"type": "subscribe", "cells": ["xn76u", ...]} または
+          {"type": "subscribe", "lat": 35.68, "lng": 139.76, "radius_km": 5}
+    受信: {"type": "photo", "photo": {...}}
+    """
+    await websocket.accept()
+    subscriber = Subscriber()
+    live_hub.register(subscriber)
+    tasks = [
+        asyncio.create_task(_receive_commands(websocket, subscriber)),
+        asyncio.create_task(_send_events(websocket, subscriber)),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        live_hub.unregister(subscriber)
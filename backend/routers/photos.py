@@ -1,44 +1,68 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Response, Header
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_, func, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from geoalchemy2.elements import WKTElement
+from botocore.exceptions import ClientError
 from typing import List, Optional
 from uuid import UUID
+from functools import partial
 from datetime import datetime
-import boto3
-import os
-from PIL import Image
-import json
+import zlib
 
-from database import get_db
+from database import SessionLocal, get_db, get_engine, get_primary_db, get_read_db
 from models.database import Photo, User
 from schemas.schemas import (
     PhotoCreate, PhotoResponse, PhotoUpdate,
-    PaginationParams, PaginatedResponse, VisibilityEnum
+    PaginationParams, PaginatedResponse, VisibilityEnum,
+    SimilarPhotoResponse, DuplicateGroupResponse, PhotoChangesResponse,
+    PhotoBatchGetRequest, PhotoBatchGetResponse, TimelineBucket, TimelineGranularity
 )
-from auth.auth_service import get_current_user, get_current_user_optional
+from auth.auth_service import get_current_user, get_current_user_optional, get_current_user_optional_read
 from services.s3_service import s3_service
+from services import user_stats, photo_sync, photo_export, photo_timeline
+from services.user_stats import QuotaExceededError
+from services.response_cache import feed_cache, invalidate_public_photo
+from services.nearby_cache import nearby_cache, render_photos
+from services.image_analysis import analyze_image
+from services.similarity import similarity_index
+from services.live_updates import live_hub, photo_event
+from services.zip_export import parse_range
+from services.content_cache import (
+    FileRangeResponse, cache_control, content_bytes, content_cache, content_requests, etag_for, etag_matches
+)
 
 router = APIRouter(prefix="/photos", tags=["写真"])
 
-# S3設定
-S3_BUCKET = os.getenv("S3_BUCKET", "your-bucket-name")
-S3_REGION = os.getenv("S3_REGION", "ap-northeast-1")
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+_photo_list_adapter = TypeAdapter(List[PhotoResponse])
+
+
+def _json_response(body: bytes, cache_status: str) -> Response:
+    return Response(body, media_type="application/json", headers={"X-Cache": cache_status})
+
+
+def _visibility_value(visibility) -> str:
+    # DBモデルのEnumとスキーマのEnumは別クラスなので値で比較する
+    return getattr(visibility, "value", visibility)
 
-s3_client = boto3.client(
-    's3',
-    region_name=S3_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-) if AWS_ACCESS_KEY_ID else None
+
+def can_view_photo(photo: Photo, current_user: Optional[User]) -> bool:
+    """写真を閲覧できるか（非公開は所有者のみ、限定公開・公開は誰でも）"""
+    if _visibility_value(photo.visibility) == VisibilityEnum.private.value:
+        return current_user is not None and photo.user_id == current_user.id
+    return True
 
 
 class PhotoService:
     @staticmethod
     def upload_to_s3(file: UploadFile, user_id: UUID) -> tuple[str, str, int]:
         """ファイルをS3にアップロード"""
-        if not s3_client:
+        try:
+            bucket_name = s3_service.bucket_name
+        except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="S3設定が正しくありません"
@@ -62,8 +86,8 @@ class PhotoService:
 
         # S3にアップロード
         try:
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
+            s3_service.s3_client.put_object(
+                Bucket=bucket_name,
                 Key=s3_key,
                 Body=file_content,
                 ContentType=file.content_type
@@ -76,31 +100,32 @@ class PhotoService:
 
         return s3_key, file.content_type, file_size
 
-    @staticmethod
-    def extract_exif_data(file: UploadFile) -> Optional[dict]:
-        """EXIFデータを抽出"""
-        try:
-            image = Image.open(file.file)
-            exif_data = image._getexif()
 
-            if not exif_data:
-                return None
+ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024  # 5MB
 
-            # EXIFタグを読み取り
-            exif_dict = {}
-            for tag_id, value in exif_data.items():
-                tag = image.getexif().get(tag_id)
-                if tag:
-                    exif_dict[str(tag_id)] = str(value)
 
-            return exif_dict
-        except Exception:
-            return None
+def validate_upload(filename: str, size: Optional[int] = None):
+    """ファイル形式とサイズのチェック"""
+    file_extension = (filename or '').split('.')[-1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="サポートされていないファイル形式です"
+        )
+    if size is not None and size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ファイルサイズが大きすぎます（最大5MB）"
+        )
 
 
-@router.post("/upload", response_model=PhotoResponse, status_code=status.HTTP_201_CREATED)
-async def upload_photo(
-    file: UploadFile = File(...),
+async def create_photo(
+    db: Session,
+    current_user: User,
+    file_content: bytes,
+    filename: str,
+    content_type: Optional[str],
     title: Optional[str] = None,
     description: Optional[str] = None,
     lat: Optional[float] = None,
@@ -108,80 +133,151 @@ async def upload_photo(
     accuracy_m: Optional[float] = None,
     address: Optional[str] = None,
     visibility: VisibilityEnum = VisibilityEnum.private,
-    taken_at: Optional[datetime] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """写真をアップロード"""
-    # ファイル形式チェック
-    file_extension = file.filename.split('.')[-1].lower()
-    if file_extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
+    taken_at: Optional[datetime] = None
+) -> Photo:
+    """
+    アップロードされた画像から写真を作成
+
+    通常のアップロードと再開可能アップロードの完了処理で共通に使う。
+    """
+    # クォータチェック（user_statsのカウンタを参照するだけなのでO(1)）
+    try:
+        user_stats.check_quota(db, current_user.id, len(file_content))
+    except QuotaExceededError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="サポートされていないファイル形式です"
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
         )
 
-    # ファイルサイズチェック（5MB制限）
-    file_content = await file.read()
-    if len(file_content) > 5 * 1024 * 1024:  # 5MB
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="ファイルサイズが大きすぎます（最大5MB）"
-        )
+    content_type = content_type or s3_service.get_content_type(filename)
 
     # S3にアップロード
     try:
-        image_url = await s3_service.upload_image(
-            file_content,
-            file.filename,
-            file.content_type or s3_service.get_content_type(file.filename)
-        )
+        image_url = await s3_service.upload_image(file_content, filename, content_type)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"ファイルのアップロードに失敗しました: {str(e)}"
         )
 
-    # EXIFデータを抽出
-    exif_data = PhotoService.extract_exif_data(file)
+    # EXIF・知覚ハッシュ・プレースホルダー・サイズを抽出（デコードはイベントループの外で行う）
+    features = await run_in_threadpool(analyze_image, file_content)
 
     # データベースに保存
     photo = Photo(
         user_id=current_user.id,  # 実際のユーザーID
         s3_key=image_url,  # URLを直接保存
-        mime_type=file.content_type or s3_service.get_content_type(
-            file.filename),
+        mime_type=content_type,
         size_bytes=len(file_content),
         title=title,
         description=description,
         lat=lat,
         lng=lng,
+        location=WKTElement(f"POINT({lng} {lat})", srid=4326) if lat is not None and lng is not None else None,
         accuracy_m=accuracy_m,
         address=address,
-        exif=exif_data,
         visibility=visibility,
-        taken_at=taken_at
+        taken_at=taken_at,
+        crc32=zlib.crc32(file_content),
+        **features
     )
 
     db.add(photo)
+    try:
+        user_stats.record_photo_added(db, photo)
+        photo_timeline.record_photo_added(db, photo)
+    except QuotaExceededError as e:
+        # 同時アップロードで上限を超えた場合はアップロード済みのファイルも消す
+        db.rollback()
+        await s3_service.delete_image(image_url)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
     db.commit()
     db.refresh(photo)
+    invalidate_public_photo(photo.visibility)
+    nearby_cache.invalidate(photo.lat, photo.lng)
+    similarity_index.add(photo.user_id, photo.id, photo.phash)
+    if _visibility_value(photo.visibility) == VisibilityEnum.public.value:
+        await live_hub.publish(photo_event(photo))
 
     return photo
 
 
+@router.post("/upload", response_model=PhotoResponse, status_code=status.HTTP_201_CREATED)
+async def upload_photo(
+    file: UploadFile = File(...),
+    title: Optional[str] = None,
+    description: Optional[str] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    accuracy_m: Optional[float] = None,
+    address: Optional[str] = None,
+    visibility: VisibilityEnum = VisibilityEnum.private,
+    taken_at: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """写真をアップロード"""
+    # ファイル形式チェック
+    validate_upload(file.filename)
+
+    # ファイルサイズチェック（5MB制限）
+    file_content = await file.read()
+    validate_upload(file.filename, len(file_content))
+
+    return await create_photo(
+        db, current_user, file_content, file.filename, file.content_type,
+        title=title, description=description, lat=lat, lng=lng, accuracy_m=accuracy_m,
+        address=address, visibility=visibility, taken_at=taken_at
+    )
+
+
 @router.get("/", response_model=PaginatedResponse)
 async def get_photos(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     visibility: Optional[VisibilityEnum] = None,
     user_id: Optional[UUID] = None,
+    created_after: Optional[datetime] = Query(None, description="この日時以降に登録された写真のみ"),
+    created_before: Optional[datetime] = Query(None, description="この日時より前に登録された写真のみ"),
     current_user: Optional[User] = Depends(get_current_user_optional),
     db: Session = Depends(get_db)
 ):
     """写真一覧を取得"""
+    if current_user is None:
+        # 未認証ユーザーの結果はパラメータだけで決まるため共有キャッシュを使う
+        async def render() -> bytes:
+            return _list_photos(db, skip, limit, visibility, user_id, None,
+                                created_after, created_before).model_dump_json().encode()
+
+        body, cache_status = await feed_cache.get_or_compute(
+            {"skip": skip, "limit": limit, "visibility": visibility, "user_id": user_id,
+             "created_after": created_after, "created_before": created_before}, render)
+        return _json_response(body, cache_status)
+
+    return _list_photos(db, skip, limit, visibility, user_id, current_user,
+                        created_after, created_before)
+
+
+def photo_list_query(
+    db: Session,
+    visibility: Optional[VisibilityEnum],
+    user_id: Optional[UUID],
+    current_user: Optional[User],
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    """写真一覧の絞り込み（並び順・ページングは呼び出し側。クエリプランのテストでも使う）"""
     query = db.query(Photo)
 
+    # 登録日時の範囲（photosがパーティション化されている場合は対象の月だけを走査する）
+    if created_after:
+        query = query.filter(Photo.created_at >= created_after)
+    if created_before:
+        query = query.filter(Photo.created_at < created_before)
+
     # ユーザーIDによるフィルタリング
     if user_id:
         # 特定のユーザーの写真を取得
@@ -209,6 +305,21 @@ async def get_photos(
             if visibility:
                 query = query.filter(Photo.visibility == visibility)
 
+    return query
+
+
+def _list_photos(
+    db: Session,
+    skip: int,
+    limit: int,
+    visibility: Optional[VisibilityEnum],
+    user_id: Optional[UUID],
+    current_user: Optional[User],
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+) -> PaginatedResponse:
+    query = photo_list_query(db, visibility, user_id, current_user, created_after, created_before)
+
     # 総数を取得
     total = query.count()
 
@@ -230,6 +341,158 @@ async def get_photos(
     )
 
 
+def batch_get_query(db: Session, ids: List[UUID]):
+    """IDの配列を1つのパラメータで渡し、件数によらず同じ形のSQLにする"""
+    ids_param = bindparam("ids", ids, type_=ARRAY(PG_UUID(as_uuid=True)))
+    return db.query(Photo).filter(Photo.id == any_(ids_param))
+
+
+@router.post("/batch-get", response_model=PhotoBatchGetResponse)
+async def batch_get_photos(
+    batch: PhotoBatchGetRequest,
+    current_user: Optional[User] = Depends(get_current_user_optional_read),
+    db: Session = Depends(get_read_db)
+):
+    """複数の写真をIDでまとめて取得（結果はリクエストと同じ順序、取得できないIDはerrorを返す）"""
+    unique_ids = list(dict.fromkeys(batch.ids))
+    photos = {photo.id: photo for photo in batch_get_query(db, unique_ids)}
+
+    # 閲覧できる写真だけを一度ずつ署名付きURLに変換
+    visible = {photo_id for photo_id, photo in photos.items() if can_view_photo(photo, current_user)}
+    for photo_id in visible:
+        photo = photos[photo_id]
+        if photo.s3_key:
+            photo.s3_key = s3_service.get_presigned_url(photo.s3_key)
+
+    items = []
+    for photo_id in batch.ids:
+        if photo_id not in photos:
+            items.append({"id": photo_id, "error": "not_found"})
+        elif photo_id not in visible:
+            items.append({"id": photo_id, "error": "forbidden"})
+        else:
+            items.append({"id": photo_id, "photo": photos[photo_id]})
+    return {"items": items}
+
+
+@router.get("/changes", response_model=PhotoChangesResponse)
+async def get_photo_changes(
+    cursor: Optional[int] = Query(None, ge=0, description="前回のレスポンスの next_cursor（省略時は全件）"),
+    limit: int = Query(500, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    # レプリカの遅延で変更を取りこぼさないよう常にプライマリを読む
+    db: Session = Depends(get_primary_db)
+):
+    """前回の同期以降に作成・更新・削除された自分の写真を取得"""
+    try:
+        result = photo_sync.get_changes(db, current_user.id, cursor, limit)
+    except photo_sync.CursorExpiredError as e:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=str(e)
+        )
+
+    for photo in result["changes"]:
+        if photo.s3_key:
+            photo.s3_key = s3_service.get_presigned_url(photo.s3_key)
+    return result
+
+
+@router.get("/duplicates", response_model=List[DuplicateGroupResponse])
+async def get_duplicate_photos(
+    max_distance: int = Query(4, ge=0, le=16, description="同じグループとみなすハミング距離"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """ライブラリ内の重複・ほぼ重複している写真のグループを取得"""
+    groups = similarity_index.duplicates(db, current_user.id, max_distance)
+    photo_ids = [photo_id for group in groups for photo_id in group]
+    if not photo_ids:
+        return []
+
+    photos = {
+        photo.id: photo
+        for photo in db.query(Photo).filter(Photo.id.in_(photo_ids), Photo.user_id == current_user.id)
+    }
+    result = []
+    for group in groups:
+        members = [photos[photo_id] for photo_id in group if photo_id in photos]
+        if len(members) > 1:
+            result.append({"photos": members})
+    return result
+
+
+@router.get("/timeline", response_model=List[TimelineBucket])
+async def get_photo_timeline(
+    granularity: TimelineGranularity = Query(TimelineGranularity.month, description="集計の単位"),
+    visibility: Optional[VisibilityEnum] = Query(None, description="指定した公開範囲の写真だけを数える"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    自分のライブラリの撮影日ごとの写真数（タイムラインのスクラバー用、古い順・写真のない期間は含まない）
+
+    集計テーブルを読むだけなので、ライブラリの写真数によらず期間の数に比例した時間で返る。
+    """
+    return photo_timeline.histogram(db, current_user.id, granularity.value, visibility)
+
+
+@router.get("/export")
+async def export_photos(
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    自分のライブラリ全体をZIPでダウンロード（写真は無圧縮、メタデータは manifest.json）
+
+    レイアウトはライブラリの内容だけで決まるので、ETagが同じ間は Range で途中から再開できる。
+    CRC32が未保存の写真（バックフィル前の古い写真）が残っている間は Range に応じず全体を返す。
+    """
+    # 送信が終わるまで同じスナップショットを読むため、専用のセッションを使う
+    get_engine()
+    db = SessionLocal()
+    try:
+        export, etag = await run_in_threadpool(photo_export.build_export, db, current_user.id)
+        byte_range = None
+        if not export.missing_crc and (if_range is None or if_range == etag):
+            byte_range = parse_range(range_header, export.size)
+    except ValueError:
+        db.close()
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Range が範囲外です",
+            headers={"Content-Range": f"bytes */{export.size}"}
+        )
+    except Exception:
+        db.close()
+        raise
+
+    start, end = byte_range or (0, export.size)
+    headers = {
+        "Accept-Ranges": "none" if export.missing_crc else "bytes",
+        "ETag": etag,
+        "Content-Length": str(end - start),
+        "Content-Disposition": 'attachment; filename="photos.zip"',
+        "Cache-Control": "private, no-store",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{export.size}"
+
+    def body():
+        try:
+            yield from export.iter_bytes(start, end)
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        body(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="application/zip",
+        headers=headers
+    )
+
+
 @router.get("/{photo_id}", response_model=PhotoResponse)
 async def get_photo(
     photo_id: UUID,
@@ -245,14 +508,123 @@ async def get_photo(
         )
 
     # アクセス権限チェック
-    if photo.visibility == VisibilityEnum.private:
-        if not current_user or photo.user_id != current_user.id:
+    if not can_view_photo(photo, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="この写真にアクセスする権限がありません"
+        )
+
+    return photo
+
+
+@router.get("/{photo_id}/content")
+async def get_photo_content(
+    photo_id: UUID,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """
+    写真本体をAPIサーバー経由で取得（ディスクキャッシュから配信し、Range で部分取得できる）
+
+    S3キーは写真ごとに一意で内容が変わらないため、ETagが一致すれば 304 を返す。
+    """
+    photo = db.query(Photo).filter(Photo.id == photo_id).first()
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="写真が見つかりません"
+        )
+    if not can_view_photo(photo, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="この写真にアクセスする権限がありません"
+        )
+
+    etag = etag_for(photo.s3_key)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": cache_control(_visibility_value(photo.visibility)),
+    }
+    if etag_matches(if_none_match, etag):
+        content_requests.inc(result="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    s3_key, mime_type = photo.s3_key, photo.mime_type
+    try:
+        file, size, result = await run_in_threadpool(
+            content_cache.open, s3_key, partial(s3_service.download_object, s3_key))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
             raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="この写真にアクセスする権限がありません"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="写真のファイルが見つかりません"
             )
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="ストレージから写真を取得できませんでした"
+        )
+
+    try:
+        byte_range = None
+        if if_range is None or if_range == etag:
+            byte_range = parse_range(range_header, size)
+    except ValueError:
+        file.close()
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Range が範囲外です",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    start, end = byte_range or (0, size)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    content_requests.inc(result=result)
+    content_bytes.inc(end - start, source="origin" if result == "miss" else "cache")
+
+    return FileRangeResponse(
+        file, start, end - start,
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=mime_type,
+        headers=headers
+    )
 
-    return photo
+
+@router.get("/{photo_id}/similar", response_model=List[SimilarPhotoResponse])
+async def get_similar_photos(
+    photo_id: UUID,
+    max_distance: int = Query(10, ge=0, le=32, description="ハミング距離の上限"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """自分のライブラリから見た目が似ている写真を取得"""
+    photo = db.query(Photo).filter(
+        Photo.id == photo_id,
+        Photo.user_id == current_user.id
+    ).first()
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="写真が見つかりません"
+        )
+
+    matches = similarity_index.similar(db, current_user.id, photo_id, max_distance)[:limit]
+    if not matches:
+        return []
+
+    photos = {
+        p.id: p
+        for p in db.query(Photo).filter(Photo.id.in_([i for _, i in matches]), Photo.user_id == current_user.id)
+    }
+    return [
+        {"distance": distance, "photo": photos[i]}
+        for distance, i in matches if i in photos
+    ]
 
 
 @router.put("/{photo_id}", response_model=PhotoResponse)
@@ -263,10 +635,11 @@ async def update_photo(
     db: Session = Depends(get_db)
 ):
     """写真情報を更新"""
+    # 公開範囲の変更はカウンタに差分で反映するため、同時の更新で同じ変更前の値を読まないよう行をロックする
     photo = db.query(Photo).filter(
         Photo.id == photo_id,
         Photo.user_id == current_user.id
-    ).first()
+    ).with_for_update().first()
 
     if not photo:
         raise HTTPException(
@@ -275,17 +648,23 @@ async def update_photo(
         )
 
     # 更新
+    old_visibility = photo.visibility
     if photo_update.title is not None:
         photo.title = photo_update.title
     if photo_update.description is not None:
         photo.description = photo_update.description
     if photo_update.visibility is not None:
+        user_stats.record_visibility_changed(
+            db, photo.user_id, photo.visibility, photo_update.visibility)
+        photo_timeline.record_visibility_changed(db, photo, photo.visibility, photo_update.visibility)
         photo.visibility = photo_update.visibility
     if photo_update.address is not None:
         photo.address = photo_update.address
 
     db.commit()
     db.refresh(photo)
+    invalidate_public_photo(old_visibility, photo.visibility)
+    nearby_cache.invalidate(photo.lat, photo.lng)
 
     return photo
 
@@ -315,8 +694,16 @@ async def delete_photo(
         pass  # S3削除に失敗してもDBからは削除する
 
     # データベースから削除
+    visibility, lat, lng, s3_key = photo.visibility, photo.lat, photo.lng, photo.s3_key
+    user_stats.record_photo_removed(db, photo)
+    photo_timeline.record_photo_removed(db, photo)
+    photo_sync.record_deletion(db, photo)
     db.delete(photo)
     db.commit()
+    invalidate_public_photo(visibility)
+    nearby_cache.invalidate(lat, lng)
+    content_cache.discard(s3_key)
+    similarity_index.remove(current_user.id, photo_id)
 
     return {"message": "写真を削除しました"}
 
@@ -331,6 +718,36 @@ async def get_nearby_photos(
     db: Session = Depends(get_db)
 ):
     """指定した位置の近くの写真を取得"""
+    # 半径に応じたGeohashセルごとの候補をキャッシュし、距離の判定と並べ替えはメモリ上で行う
+    cached = nearby_cache.lookup(db, lat, lng, radius_km, limit, current_user.id if current_user else None)
+    if cached is None:
+        return _json_response(_photo_list_adapter.dump_json(
+            _find_nearby_photos(db, lat, lng, radius_km, limit, current_user)), "BYPASS")
+    photos, cache_status = cached
+    return _json_response(render_photos(photos), cache_status)
+
+
+def _find_nearby_photos(
+    db: Session,
+    lat: float,
+    lng: float,
+    radius_km: float,
+    limit: int,
+    current_user: Optional[User]
+) -> List[PhotoResponse]:
+    photos = nearby_photos_query(db, lat, lng, radius_km, limit, current_user).all()
+    return [PhotoResponse.model_validate(photo) for photo in photos]
+
+
+def nearby_photos_query(
+    db: Session,
+    lat: float,
+    lng: float,
+    radius_km: float,
+    limit: int,
+    current_user: Optional[User]
+):
+    """近くの写真の検索クエリ（クエリプランのテストでも使う）"""
     # PostGISを使用して近くの写真を検索
     query = db.query(Photo).filter(
         Photo.location.isnot(None)
@@ -360,6 +777,4 @@ async def get_nearby_photos(
         )
     )
 
-    photos = query.order_by(Photo.created_at.desc()).limit(limit).all()
-
-    return photos
+    return query.order_by(Photo.created_at.desc()).limit(limit)
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+
+from auth.auth_service import get_admin_user
+from services.profiling import store
+
+# PROFILING_ENABLED のときだけ main.py で登録する
+router = APIRouter(prefix="/admin/profiles", tags=["運用"], dependencies=[Depends(get_admin_user)])
+
+
+@router.get("")
+async def list_profiles():
+    """保存済みのリクエストのプロファイル（新しい順）"""
+    return store.list()
+
+
+@router.get("/{profile_id}")
+async def download_profile(profile_id: str):
+    """プロファイルを折りたたみスタック形式でダウンロード（flamegraph.pl・speedscope で開ける）"""
+    path = store.folded_path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="プロファイルが見つかりません"
+        )
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=f"{profile_id}.folded")
@@ -0,0 +1,186 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+
+from database import get_db
+from models.database import Photo, User
+from schemas.schemas import PhotoResponse, UploadSessionCreate, UploadSessionResponse
+from auth.auth_service import get_current_user
+from routers.photos import create_photo, validate_upload
+from services.resumable_uploads import UploadError, parse_checksum, spool
+
+router = APIRouter(prefix="/photos/uploads", tags=["写真"])
+
+TUS_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def _http_error(e: UploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+async def _read_chunk(request: Request, limit: int) -> bytes:
+    """リクエスト本文を読む（limit バイトを超えた時点で読むのをやめて413にする）"""
+    too_large = UploadError(413, "宣言したサイズを超えています")
+    try:
+        content_length = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        content_length = None
+    if content_length is not None and content_length > limit:
+        raise too_large
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > limit:
+            raise too_large
+    return bytes(data)
+
+
+def _session_response(meta: dict) -> dict:
+    return {
+        "upload_id": meta["upload_id"],
+        "offset": meta["offset"],
+        "length": meta["length"],
+        "expires_at": datetime.fromtimestamp(spool.expires_at(meta), tz=timezone.utc),
+        "photo_id": meta["photo_id"],
+    }
+
+
+@router.post("", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload: UploadSessionCreate,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """再開可能なアップロードを開始"""
+    validate_upload(upload.filename, upload.length)
+    meta = await run_in_threadpool(
+        spool.create, str(current_user.id), upload.length, upload.filename, upload.content_type,
+        upload.model_dump(mode="json", exclude={"length", "filename", "content_type"})
+    )
+    response.headers["Location"] = f"/photos/uploads/{meta['upload_id']}"
+    response.headers["Upload-Offset"] = "0"
+    return _session_response(meta)
+
+
+@router.head("/{upload_id}")
+async def get_upload_offset(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """受信済みのオフセットを確認（再開時はここから送り直す）"""
+    try:
+        meta = await run_in_threadpool(spool.get, upload_id, str(current_user.id))
+    except UploadError as e:
+        raise _http_error(e)
+    return Response(status_code=status.HTTP_200_OK, headers={
+        "Upload-Offset": str(meta["offset"]),
+        "Upload-Length": str(meta["length"]),
+        "Cache-Control": "no-store",
+    })
+
+
+@router.get("/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """アップロードの状態を取得"""
+    try:
+        meta = await run_in_threadpool(spool.get, upload_id, str(current_user.id))
+    except UploadError as e:
+        raise _http_error(e)
+    return _session_response(meta)
+
+
+@router.patch("/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def append_upload_chunk(
+    upload_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    チャンクを送信
+
+    ヘッダー: Content-Type: application/offset+octet-stream, Upload-Offset: 受信済みオフセット,
+    Upload-Checksum: sha256 <base64>（任意）
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != TUS_CONTENT_TYPE:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type は {TUS_CONTENT_TYPE} を指定してください"
+        )
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload-Offset ヘッダーが必要です"
+        )
+
+    try:
+        checksum = parse_checksum(request.headers.get("upload-checksum"))
+        meta = await run_in_threadpool(spool.get, upload_id, str(current_user.id))
+        # 残りのサイズより大きい本文はメモリに溜めずに断る
+        data = await _read_chunk(request, meta["length"] - meta["offset"])
+        meta = await run_in_threadpool(spool.append, upload_id, str(current_user.id), offset, data, checksum)
+    except UploadError as e:
+        raise _http_error(e)
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={"Upload-Offset": str(meta["offset"])})
+
+
+@router.post("/{upload_id}/finalize", response_model=PhotoResponse, status_code=status.HTTP_201_CREATED)
+async def finalize_upload(
+    upload_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """アップロードを完了して写真を作成（再送された場合は作成済みの写真を返す）"""
+    user_id = str(current_user.id)
+    try:
+        meta, content = await run_in_threadpool(spool.begin_finalize, upload_id, user_id)
+    except UploadError as e:
+        raise _http_error(e)
+
+    if content is None:
+        photo = db.query(Photo).filter(
+            Photo.id == meta["photo_id"],
+            Photo.user_id == current_user.id
+        ).first()
+        if not photo:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="写真が見つかりません"
+            )
+        response.status_code = status.HTTP_200_OK
+        return photo
+
+    params = UploadSessionCreate.model_validate(
+        dict(meta["photo"], length=meta["length"], filename=meta["filename"]))
+    try:
+        photo = await create_photo(
+            db, current_user, content, meta["filename"], meta["content_type"],
+            title=params.title, description=params.description, lat=params.lat, lng=params.lng,
+            accuracy_m=params.accuracy_m, address=params.address, visibility=params.visibility,
+            taken_at=params.taken_at
+        )
+    except BaseException:
+        await run_in_threadpool(spool.abort_finalize, upload_id, user_id)
+        raise
+
+    await run_in_threadpool(spool.mark_finalized, upload_id, user_id, str(photo.id))
+    return photo
+
+
+@router.delete("/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """アップロードを中止"""
+    try:
+        await run_in_threadpool(spool.delete, upload_id, str(current_user.id))
+    except UploadError as e:
+        raise _http_error(e)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
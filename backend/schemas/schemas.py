@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, validator
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
 from enum import Enum
 
@@ -39,6 +39,20 @@ class UserUpdate(BaseModel):
     email: Optional[EmailStr] = None
 
 
+class UserStatsResponse(BaseModel):
+    photo_count: int = 0
+    total_bytes: int = 0
+    public_count: int = 0
+    unlisted_count: int = 0
+    private_count: int = 0
+    quota_max_photos: Optional[int] = None
+    quota_max_bytes: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 # Session Schemas
 class SessionCreate(BaseModel):
     user_agent: Optional[str] = None
@@ -93,11 +107,80 @@ class PhotoResponse(PhotoBase):
     size_bytes: int
     exif: Optional[Dict[str, Any]]
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    # 画像のダウンロード前に表示するプレースホルダー
+    blurhash: Optional[str] = None
+    dominant_color: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
 
     class Config:
         from_attributes = True
 
 
+class UploadSessionCreate(BaseModel):
+    length: int = Field(..., gt=0, le=5 * 1024 * 1024)  # 通常のアップロードと同じ5MB制限
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: Optional[str] = Field(None, max_length=100)
+    title: Optional[str] = Field(None, max_length=255)
+    description: Optional[str] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lng: Optional[float] = Field(None, ge=-180, le=180)
+    accuracy_m: Optional[float] = None
+    address: Optional[str] = None
+    visibility: VisibilityEnum = VisibilityEnum.private
+    taken_at: Optional[datetime] = None
+
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    offset: int  # 受信済みのバイト数（次のPATCHの Upload-Offset）
+    length: int
+    expires_at: datetime
+    photo_id: Optional[UUID] = None  # 完了後に作成された写真
+
+
+class PhotoBatchGetRequest(BaseModel):
+    ids: List[UUID] = Field(..., min_length=1, max_length=500)
+
+
+class PhotoBatchGetItem(BaseModel):
+    id: UUID
+    photo: Optional[PhotoResponse] = None
+    error: Optional[str] = None  # "not_found" または "forbidden"
+
+
+class PhotoBatchGetResponse(BaseModel):
+    items: List[PhotoBatchGetItem]  # リクエストのIDと同じ順序
+
+
+class PhotoChangesResponse(BaseModel):
+    changes: List[PhotoResponse]  # カーソル以降に作成・更新された写真
+    deleted: List[UUID]  # カーソル以降に削除された写真のID
+    next_cursor: int
+    has_more: bool
+
+
+class SimilarPhotoResponse(BaseModel):
+    distance: int  # dHashのハミング距離（0〜64、小さいほど似ている）
+    photo: PhotoResponse
+
+
+class DuplicateGroupResponse(BaseModel):
+    photos: List[PhotoResponse]
+
+
+class TimelineGranularity(str, Enum):
+    day = "day"
+    month = "month"
+    year = "year"
+
+
+class TimelineBucket(BaseModel):
+    period: date  # 期間の初日（月なら1日、年なら1月1日）
+    count: int
+
+
 # Auth Schemas
 class TokenResponse(BaseModel):
     access_token: str
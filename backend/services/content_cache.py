@@ -0,0 +1,223 @@
+"""
+写真本体のプロキシ配信用ディスクキャッシュ
+
+GET /photos/{photo_id}/content はS3の署名付きURLの代わりにAPIサーバーから画像を返す。
+- キャッシュ: CONTENT_CACHE_DIR にオブジェクトごとのファイルを置き、合計 CONTENT_CACHE_MAX_MB を超えたら
+  最近使われていないものから削除する（上限はワーカープロセスごと）
+- 同時ミス: 同じキーの取得は1回だけ行い、他のリクエストは書き込みの完了を待つ
+- 送信: サーバーが ASGI の zerocopysend 拡張に対応していればゼロコピー、なければ pread で分割して送る
+- 写真のS3キーはアップロードごとに一意で内容が変わらないため、ETagはキーから決まる
+- 公開範囲は後から変えられるので、共有キャッシュに置くのは公開写真を CONTENT_PUBLIC_MAX_AGE 秒まで、
+  それ以外は端末のキャッシュでも毎回再検証させる（非公開にした後は 304 ではなく 403/404 になる）
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import BinaryIO, Callable, Dict, Mapping, Optional, Tuple
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+
+from services.metrics import registry
+
+CONTENT_CACHE_DIR = os.getenv("CONTENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "photo-content"))
+CONTENT_CACHE_MAX_BYTES = int(float(os.getenv("CONTENT_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+CONTENT_PUBLIC_MAX_AGE = int(os.getenv("CONTENT_PUBLIC_MAX_AGE", "300"))
+CHUNK_SIZE = 256 * 1024
+
+content_requests = registry.counter(
+    "content_cache_requests_total", "写真本体の配信（hit/miss/coalesced/not_modified）", ["result"])
+content_bytes = registry.counter(
+    "content_cache_bytes_total", "写真本体の送信バイト数（cache はS3からの転送を節約した分）", ["source"])
+content_cache_size = registry.gauge("content_cache_size_bytes", "ディスクキャッシュの合計サイズ")
+
+
+def etag_for(s3_key: str) -> str:
+    return '"' + hashlib.sha1(s3_key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def cache_control(visibility: str) -> str:
+    # 非公開に変更されたら取り消せるよう、共有キャッシュの保持は短くし期限後は必ず再検証させる
+    if visibility == "public":
+        return f"public, max-age={CONTENT_PUBLIC_MAX_AGE}, must-revalidate"
+    return "private, no-cache"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class DiskCache:
+    """キー→ファイルのLRU（インデックスはメモリに持ち、起動時にディレクトリから復元する）"""
+
+    def __init__(self, root: str = CONTENT_CACHE_DIR, max_bytes: int = CONTENT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # 書き込み途中で止まったファイル
+                os.unlink(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total += size
+        self._loaded = True
+        self._evict()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._total > self.max_bytes and len(self._entries) > (1 if keep else 0):
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                self._entries.move_to_end(name)
+                continue
+            del self._entries[name]
+            self._total -= size
+            try:
+                # 送信中のファイルは開いたままなので最後まで読める
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+        content_cache_size.set(self._total)
+
+    def _open_cached(self, name: str) -> Optional[Tuple[BinaryIO, int]]:
+        size = self._entries.get(name)
+        if size is None:
+            return None
+        try:
+            file = open(self._path(name), "rb")
+        except FileNotFoundError:
+            # 同じディレクトリを使う別のワーカーが削除した
+            del self._entries[name]
+            self._total -= size
+            return None
+        self._entries.move_to_end(name)
+        return file, size
+
+    def open(self, key: str, fetch: Callable[[BinaryIO], object]) -> Tuple[BinaryIO, int, str]:
+        """
+        キャッシュ済みのファイルを開く（なければ fetch(file) でオリジンから書き込む）
+
+        戻り値は (開いたファイル, サイズ, hit/miss/coalesced)。ファイルは呼び出し側で閉じる。
+        """
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        result = "hit"
+        while True:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                cached = self._open_cached(name)
+                if cached is not None:
+                    return (*cached, result)
+                future = self._inflight.get(name)
+                if future is None:
+                    future = self._inflight[name] = Future()
+                    break
+            # 同じキーを取得中のリクエストがあれば完了を待って読み直す
+            future.result()
+            result = "coalesced"
+
+        tmp_path = self._path(f"{name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as out:
+                fetch(out)
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, self._path(name))
+                previous = self._entries.pop(name, 0)
+                self._entries[name] = size
+                self._total += size - previous
+                self._evict(keep=name)
+                file = open(self._path(name), "rb")
+            future.set_result(None)
+            return file, size, "miss"
+        except BaseException as e:
+            future.set_exception(e)
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(name, None)
+
+    def discard(self, key: str):
+        """写真の削除時にキャッシュからも消す"""
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is None:
+                return
+            self._total -= size
+            content_cache_size.set(self._total)
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+
+class FileRangeResponse(Response):
+    """開いたファイルの [offset, offset + count) を送るレスポンス（送信後にファイルを閉じる）"""
+
+    def __init__(self, file: BinaryIO, offset: int, count: int, status_code: int = 200,
+                 headers: Optional[Mapping[str, str]] = None, media_type: Optional[str] = None,
+                 background: Optional[BackgroundTask] = None):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        headers = dict(headers or {}, **{"Content-Length": str(count)})
+        super().__init__(None, status_code=status_code, headers=headers, media_type=media_type,
+                         background=background)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.file,
+                            "offset": self.offset, "count": self.count})
+            else:
+                fd = self.file.fileno()
+                position, remaining = self.offset, self.count
+                while True:
+                    chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, remaining), position)
+                    position += len(chunk)
+                    remaining -= len(chunk)
+                    more = remaining > 0 and bool(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more})
+                    if not more:
+                        break
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+
+content_cache = DiskCache()
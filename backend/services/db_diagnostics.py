@@ -0,0 +1,326 @@
+"""
+データベースの性能診断
+
+テーブル・インデックスのサイズと肥大化の推定、未使用・重複インデックス、
+pg_stat_statements の上位のSQL、キャッシュヒット率、autovacuum の遅れを集め、
+しきい値を超えたものを警告にする。check_rds_records.py から使う（DB-APIのカーソルのみに依存）。
+"""
+from typing import Dict, List, Optional
+
+DEFAULT_TABLES = ["users", "sessions", "photos"]
+
+THRESHOLDS = {
+    "bloat_ratio": 0.3,  # 推定肥大化率
+    "bloat_min_bytes": 10 * 1024 * 1024,  # これより小さいテーブル・インデックスの肥大化は無視
+    "unused_index_min_bytes": 1024 * 1024,
+    "cache_hit_ratio": 0.99,
+    "dead_tuple_ratio": 0.2,
+    "autovacuum_lag_ratio": 2.0,  # 不要タプルがautovacuumの発動しきい値の何倍たまっているか
+    "xid_age_ratio": 0.75,  # autovacuum_freeze_max_age に対する relfrozenxid の経過
+    "statement_mean_ms": 100.0,
+}
+
+TABLE_SIZES_SQL = """
+SELECT c.relname AS table,
+       pg_total_relation_size(c.oid) AS total_bytes,
+       pg_relation_size(c.oid) AS table_bytes,
+       pg_indexes_size(c.oid) AS index_bytes,
+       COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0) AS toast_bytes,
+       c.reltuples::bigint AS estimated_rows
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema() AND c.relname = ANY(%(tables)s) AND c.relkind IN ('r', 'p')
+ORDER BY c.relname
+"""
+
+# 統計情報の平均幅から理想的なページ数を求め、実際のサイズと比べる（pgstattuple なしの推定）
+TABLE_BLOAT_SQL = """
+WITH widths AS (
+    SELECT c.relname, c.reltuples, c.relpages,
+           current_setting('block_size')::int AS block_size,
+           COALESCE(SUM(s.avg_width), 0) AS row_width
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname
+    WHERE n.nspname = current_schema() AND c.relname = ANY(%(tables)s) AND c.relkind = 'r'
+    GROUP BY c.relname, c.reltuples, c.relpages
+)
+SELECT relname AS table,
+       relpages::bigint * block_size AS actual_bytes,
+       (CEIL(GREATEST(reltuples, 0) * (row_width + 28) / (block_size - 24)) * block_size)::bigint AS expected_bytes
+FROM widths
+"""
+
+# btreeインデックスについて、キー列の平均幅から理想的なサイズを推定する（式インデックスは対象外）
+INDEX_BLOAT_SQL = """
+WITH keys AS (
+    SELECT i.indexrelid, i.indrelid, ic.relname AS index_name, tc.relname AS table_name,
+           ic.relpages, ic.reltuples, current_setting('block_size')::int AS block_size,
+           SUM(s.avg_width) AS key_width, COUNT(s.avg_width) = i.indnatts AS complete
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    JOIN pg_class tc ON tc.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = tc.relnamespace
+    JOIN pg_am am ON am.oid = ic.relam AND am.amname = 'btree'
+    CROSS JOIN LATERAL unnest(i.indkey) AS k(attnum)
+    LEFT JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+    LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = tc.relname AND s.attname = a.attname
+    WHERE n.nspname = current_schema() AND tc.relname = ANY(%(tables)s)
+    GROUP BY i.indexrelid, i.indrelid, ic.relname, tc.relname, ic.relpages, ic.reltuples, i.indnatts
+)
+SELECT table_name AS table, index_name AS index,
+       relpages::bigint * block_size AS actual_bytes,
+       (CEIL(GREATEST(reltuples, 0) * (key_width + 16) / (block_size * 0.9)) * block_size)::bigint AS expected_bytes
+FROM keys
+WHERE complete
+"""
+
+INDEXES_SQL = """
+SELECT tc.relname AS table, ic.relname AS index, am.amname AS method,
+       i.indkey::text AS columns, i.indclass::text AS opclasses,
+       COALESCE(pg_get_expr(i.indexprs, i.indrelid), '') AS expressions,
+       COALESCE(pg_get_expr(i.indpred, i.indrelid), '') AS predicate,
+       i.indisunique AS is_unique, i.indisprimary AS is_primary,
+       EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid) AS backs_constraint,
+       pg_relation_size(i.indexrelid) AS bytes,
+       COALESCE(st.idx_scan, 0) AS scans
+FROM pg_index i
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_class tc ON tc.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = tc.relnamespace
+JOIN pg_am am ON am.oid = ic.relam
+LEFT JOIN pg_stat_user_indexes st ON st.indexrelid = i.indexrelid
+WHERE n.nspname = current_schema() AND tc.relname = ANY(%(tables)s)
+ORDER BY tc.relname, ic.relname
+"""
+
+CACHE_HIT_SQL = """
+SELECT relname AS table,
+       heap_blks_hit, heap_blks_read, COALESCE(idx_blks_hit, 0) AS idx_blks_hit, COALESCE(idx_blks_read, 0) AS idx_blks_read
+FROM pg_statio_user_tables
+WHERE schemaname = current_schema() AND relname = ANY(%(tables)s)
+ORDER BY relname
+"""
+
+DATABASE_CACHE_HIT_SQL = """
+SELECT blks_hit, blks_read FROM pg_stat_database WHERE datname = current_database()
+"""
+
+VACUUM_SQL = """
+SELECT st.relname AS table, st.n_live_tup, st.n_dead_tup, st.n_mod_since_analyze,
+       st.last_vacuum, st.last_autovacuum, st.last_analyze, st.last_autoanalyze,
+       st.autovacuum_count, st.autoanalyze_count,
+       current_setting('autovacuum_vacuum_threshold')::float
+           + current_setting('autovacuum_vacuum_scale_factor')::float * GREATEST(c.reltuples, 0) AS vacuum_threshold,
+       age(c.relfrozenxid) AS xid_age,
+       current_setting('autovacuum_freeze_max_age')::bigint AS freeze_max_age,
+       EXTRACT(EPOCH FROM now() - GREATEST(st.last_autovacuum, st.last_vacuum))::float AS seconds_since_vacuum
+FROM pg_stat_user_tables st
+JOIN pg_class c ON c.oid = st.relid
+WHERE st.schemaname = current_schema() AND st.relname = ANY(%(tables)s)
+ORDER BY st.relname
+"""
+
+STATEMENTS_SQL = """
+SELECT queryid::text AS queryid, calls, {total} AS total_ms, {mean} AS mean_ms, rows,
+       shared_blks_hit, shared_blks_read, LEFT(query, 500) AS query
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+ORDER BY {total} DESC
+LIMIT %(limit)s
+"""
+
+
+def _ratio(hit, read) -> Optional[float]:
+    total = (hit or 0) + (read or 0)
+    return round(hit / total, 4) if total else None
+
+
+def _bloat(actual, expected) -> float:
+    if not actual:
+        return 0.0
+    return round(max(0.0, 1 - (expected or 0) / actual), 3)
+
+
+def find_duplicate_indexes(indexes: List[dict]) -> List[dict]:
+    """
+    同じ列・演算子クラス・式・条件を持つインデックスの組（duplicate）と、
+    別のbtreeインデックスの先頭の列と一致していて不要なもの（redundant_prefix）を返す
+    """
+    findings = []
+    groups: Dict[tuple, List[dict]] = {}
+    for index in indexes:
+        key = (index["table"], index["method"], index["columns"], index["opclasses"],
+               index["expressions"], index["predicate"])
+        groups.setdefault(key, []).append(index)
+    for members in groups.values():
+        if len(members) > 1:
+            # 制約（主キー・一意制約）を支えているものを残し、それ以外を削除候補にする
+            keep = sorted(members, key=lambda i: (not i["backs_constraint"], not i["is_unique"], i["index"]))[0]
+            findings.append({
+                "type": "duplicate",
+                "table": keep["table"],
+                "keep": keep["index"],
+                "drop": [i["index"] for i in members if i is not keep],
+                "columns": keep["columns"],
+            })
+
+    for index in indexes:
+        if index["method"] != "btree" or index["is_unique"] or index["expressions"] or index["predicate"]:
+            continue
+        columns = index["columns"].split()
+        opclasses = index["opclasses"].split()
+        for other in indexes:
+            other_columns = other["columns"].split()
+            if (other is index or other["table"] != index["table"] or other["method"] != "btree"
+                    or other["expressions"] or other["predicate"] or len(other_columns) <= len(columns)):
+                continue
+            if other_columns[:len(columns)] == columns and other["opclasses"].split()[:len(opclasses)] == opclasses:
+                findings.append({
+                    "type": "redundant_prefix",
+                    "table": index["table"],
+                    "keep": other["index"],
+                    "drop": [index["index"]],
+                    "columns": index["columns"],
+                })
+                break
+    return findings
+
+
+def _rows(cursor, sql: str, params: dict) -> List[dict]:
+    cursor.execute(sql, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def _statements(cursor, limit: int) -> dict:
+    cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    row = cursor.fetchone()
+    if row is None:
+        return {"available": False, "reason": "pg_stat_statements が有効になっていません"}
+    # PostgreSQL 13 で total_time が total_exec_time に変わった
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'pg_stat_statements' AND column_name = 'total_exec_time'")
+    if cursor.fetchone():
+        sql = STATEMENTS_SQL.format(total="total_exec_time", mean="mean_exec_time")
+    else:
+        sql = STATEMENTS_SQL.format(total="total_time", mean="mean_time")
+    return {"available": True, "top": _rows(cursor, sql, {"limit": limit})}
+
+
+def collect(cursor, tables: List[str] = DEFAULT_TABLES, top_statements: int = 10) -> dict:
+    """診断情報を集める（カーソルは辞書で行を返すもの。autocommitの接続を想定）"""
+    params = {"tables": list(tables)}
+    report: dict = {"tables": list(tables)}
+
+    def section(name, func):
+        try:
+            report[name] = func()
+        except Exception as e:
+            report[name] = {"error": str(e).strip()}
+            # 失敗した文でトランザクションが中断していても後続の項目を集める
+            try:
+                cursor.connection.rollback()
+            except Exception:
+                pass
+
+    section("table_sizes", lambda: _rows(cursor, TABLE_SIZES_SQL, params))
+
+    def bloat():
+        tables_ = [{**row, "bloat_ratio": _bloat(row["actual_bytes"], row["expected_bytes"])}
+                   for row in _rows(cursor, TABLE_BLOAT_SQL, params)]
+        indexes = [{**row, "bloat_ratio": _bloat(row["actual_bytes"], row["expected_bytes"])}
+                   for row in _rows(cursor, INDEX_BLOAT_SQL, params)]
+        return {"method": "estimate", "tables": tables_, "indexes": indexes}
+
+    section("bloat", bloat)
+
+    def indexes():
+        rows = _rows(cursor, INDEXES_SQL, params)
+        unused = [
+            {"table": r["table"], "index": r["index"], "bytes": r["bytes"]}
+            for r in rows if r["scans"] == 0 and not r["backs_constraint"]
+        ]
+        return {"all": rows, "unused": unused, "duplicates": find_duplicate_indexes(rows)}
+
+    section("indexes", indexes)
+
+    def cache():
+        per_table = [{
+            "table": r["table"],
+            "heap_hit_ratio": _ratio(r["heap_blks_hit"], r["heap_blks_read"]),
+            "index_hit_ratio": _ratio(r["idx_blks_hit"], r["idx_blks_read"]),
+        } for r in _rows(cursor, CACHE_HIT_SQL, params)]
+        database = _rows(cursor, DATABASE_CACHE_HIT_SQL, {})
+        overall = _ratio(database[0]["blks_hit"], database[0]["blks_read"]) if database else None
+        return {"database_hit_ratio": overall, "tables": per_table}
+
+    section("cache", cache)
+
+    def vacuum():
+        rows = []
+        for r in _rows(cursor, VACUUM_SQL, params):
+            live, dead = r["n_live_tup"] or 0, r["n_dead_tup"] or 0
+            rows.append({
+                **{k: (v.isoformat() if hasattr(v, "isoformat") else v) for k, v in r.items()},
+                "dead_tuple_ratio": round(dead / (live + dead), 4) if live + dead else 0.0,
+                "autovacuum_lag_ratio": round(dead / r["vacuum_threshold"], 3) if r["vacuum_threshold"] else 0.0,
+                "xid_age_ratio": round(r["xid_age"] / r["freeze_max_age"], 4) if r["freeze_max_age"] else 0.0,
+            })
+        return rows
+
+    section("vacuum", vacuum)
+    section("statements", lambda: _statements(cursor, top_statements))
+    return report
+
+
+def evaluate(report: dict, thresholds: dict = THRESHOLDS) -> List[dict]:
+    """しきい値を超えた項目を警告として返す"""
+    warnings = []
+
+    def warn(kind, target, message, value):
+        warnings.append({"type": kind, "target": target, "message": message, "value": value})
+
+    bloat = report.get("bloat") or {}
+    for kind in ("tables", "indexes"):
+        for row in bloat.get(kind, []) if isinstance(bloat, dict) else []:
+            if row["bloat_ratio"] > thresholds["bloat_ratio"] and (row["actual_bytes"] or 0) >= thresholds["bloat_min_bytes"]:
+                target = row.get("index") or row["table"]
+                warn("bloat", target, f"{target} の推定肥大化率が高い（VACUUM FULL / REINDEX CONCURRENTLY を検討）",
+                     row["bloat_ratio"])
+
+    indexes = report.get("indexes") or {}
+    if isinstance(indexes, dict):
+        for row in indexes.get("unused", []):
+            if row["bytes"] >= thresholds["unused_index_min_bytes"]:
+                warn("unused_index", row["index"], f"{row['index']} は統計リセット以降一度も使われていません", row["bytes"])
+        for row in indexes.get("duplicates", []):
+            for name in row["drop"]:
+                warn(row["type"], name, f"{name} は {row['keep']} と重複しています", row["columns"])
+
+    cache = report.get("cache") or {}
+    if isinstance(cache, dict):
+        ratio = cache.get("database_hit_ratio")
+        if ratio is not None and ratio < thresholds["cache_hit_ratio"]:
+            warn("cache_hit", "database", "キャッシュヒット率が低い（shared_buffers・作業セットを確認）", ratio)
+        for row in cache.get("tables", []):
+            ratio = row["heap_hit_ratio"]
+            if ratio is not None and ratio < thresholds["cache_hit_ratio"]:
+                warn("cache_hit", row["table"], f"{row['table']} のキャッシュヒット率が低い", ratio)
+
+    vacuum = report.get("vacuum")
+    for row in vacuum if isinstance(vacuum, list) else []:
+        if row["dead_tuple_ratio"] > thresholds["dead_tuple_ratio"]:
+            warn("dead_tuples", row["table"], f"{row['table']} の不要タプルの割合が高い", row["dead_tuple_ratio"])
+        if row["autovacuum_lag_ratio"] > thresholds["autovacuum_lag_ratio"]:
+            warn("autovacuum_lag", row["table"], f"{row['table']} のautovacuumが追いついていない", row["autovacuum_lag_ratio"])
+        if row["xid_age_ratio"] > thresholds["xid_age_ratio"]:
+            warn("xid_wraparound", row["table"], f"{row['table']} のトランザクションID周回が近い", row["xid_age_ratio"])
+
+    statements = report.get("statements") or {}
+    for row in statements.get("top", []) if isinstance(statements, dict) else []:
+        if row["mean_ms"] is not None and row["mean_ms"] > thresholds["statement_mean_ms"]:
+            warn("slow_statement", row["queryid"], "平均実行時間が長いSQL", round(row["mean_ms"], 2))
+
+    for name, value in report.items():
+        if isinstance(value, dict) and "error" in value:
+            warn("collection_error", name, f"{name} を取得できませんでした", value["error"])
+    return warnings
@@ -0,0 +1,135 @@
+"""
+読み取りレプリカへの振り分け
+
+DATABASE_REPLICA_URL が設定されている場合、GET/HEADリクエストをレプリカに振り分ける。
+以下の場合はプライマリを使う。
+- 更新系リクエスト（POST/PUT/PATCH/DELETE）
+- そのユーザーが直近 REPLICA_STICKY_SECONDS 秒以内に更新している（自分の書き込みを読めるように）
+- X-Consistency: strong ヘッダーが付いている（別ワーカーで書き込んだ直後など）
+- レプリカの遅延が REPLICA_MAX_LAG_SECONDS を超えている、または接続できない
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from services.metrics import registry
+
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "5"))
+
+READ_METHODS = ("GET", "HEAD")
+
+# 受信済みWALをすべて適用済みなら遅延0（更新がないと replay_timestamp が古く見えるため）
+LAG_SQL = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+db_routing = registry.counter("db_routing_total", "DBセッションの振り分け先", ["target", "reason"])
+replica_lag = registry.gauge("db_replica_lag_seconds", "レプリカの遅延（秒、-1は接続不可）")
+
+
+class ReplicaRouter:
+    def __init__(self, sticky_seconds: float = REPLICA_STICKY_SECONDS,
+                 max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS,
+                 check_interval: float = REPLICA_LAG_CHECK_INTERVAL):
+        self.sticky_seconds = sticky_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self._sticky_until: Dict[str, float] = {}
+        self._healthy = False
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    # --- 書き込み後の固定 ---
+
+    def mark_write(self, user_key: Optional[str]):
+        if not user_key:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._sticky_until[user_key] = now + self.sticky_seconds
+            if len(self._sticky_until) > 10000:
+                self._sticky_until = {k: v for k, v in self._sticky_until.items() if v > now}
+
+    def is_sticky(self, user_key: Optional[str]) -> bool:
+        if not user_key:
+            return False
+        until = self._sticky_until.get(user_key)
+        return until is not None and until > time.monotonic()
+
+    # --- レプリカの状態 ---
+
+    def mark_unhealthy(self):
+        self._healthy = False
+        self._checked_at = time.monotonic()
+        replica_lag.set(-1)
+
+    def check_replica(self, engine) -> Tuple[bool, Optional[float]]:
+        """レプリカの遅延を測定して状態を更新"""
+        try:
+            with engine.connect() as conn:
+                lag = float(conn.execute(LAG_SQL).scalar() or 0)
+        except Exception:
+            self.mark_unhealthy()
+            return False, None
+        self._healthy = lag <= self.max_lag_seconds
+        self._checked_at = time.monotonic()
+        replica_lag.set(lag)
+        return self._healthy, lag
+
+    def replica_available(self, engine) -> bool:
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at > self.check_interval:
+            # 測定は1スレッドだけが行い、他は前回の結果を使う
+            if self._check_lock.acquire(blocking=checked_at is None):
+                try:
+                    self.check_replica(engine)
+                finally:
+                    self._check_lock.release()
+        return self._healthy
+
+    # --- 振り分け ---
+
+    def choose(self, method: str, user_key: Optional[str], consistency: Optional[str], engine) -> str:
+        """'replica' または 'primary' を返す"""
+        if engine is None:
+            return "primary"
+        if method not in READ_METHODS:
+            self.mark_write(user_key)
+            reason = "write"
+        elif consistency == "strong":
+            reason = "strong_consistency"
+        elif self.is_sticky(user_key):
+            reason = "read_your_writes"
+        elif not self.replica_available(engine):
+            reason = "replica_unavailable"
+        else:
+            db_routing.inc(target="replica", reason="read")
+            return "replica"
+        db_routing.inc(target="primary", reason=reason)
+        return "primary"
+
+
+def user_key_from_authorization(authorization: Optional[str]) -> Optional[str]:
+    """Authorizationヘッダーからユーザーを識別（DBは参照しない）"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    from fastapi import HTTPException
+    from auth.auth_service import AuthService
+
+    try:
+        return AuthService.verify_access_token(authorization[7:]).get("sub")
+    except HTTPException:
+        return None
+
+
+replica_router = ReplicaRouter()
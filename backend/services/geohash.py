@@ -0,0 +1,98 @@
+"""
+Geohash（緯度経度を文字列のセルに変換）
+
+同じ接頭辞を持つ地点は近くにあるため、地図の表示範囲をセル単位で扱う処理
+（リアルタイム配信の購読など）に使う。精度ごとのセルの大きさの目安:
+4桁 ≈ 39km × 20km, 5桁 ≈ 4.9km × 4.9km, 6桁 ≈ 1.2km × 0.6km
+"""
+import math
+from typing import List, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+
+def encode(lat: float, lng: float, precision: int = 6) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def is_valid(cell: str) -> bool:
+    return bool(cell) and all(c in _DECODE for c in cell)
+
+
+def bbox(cell: str) -> Tuple[float, float, float, float]:
+    """セルの範囲 (min_lat, min_lng, max_lat, max_lng)"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for c in cell:
+        value = _DECODE[c]
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """指定精度のセルの (緯度方向, 経度方向) の大きさ（度）"""
+    lng_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cells_in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                  precision: int, max_cells: int = 1000) -> List[str]:
+    """範囲と重なるセルの一覧（max_cellsを超える場合はValueError）"""
+    lat_step, lng_step = cell_size(precision)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0 - 1e-9)
+    # 範囲の端を含むセルの左下の角にそろえる
+    lat0 = math.floor((min_lat + 90.0) / lat_step) * lat_step - 90.0
+    lng0 = math.floor((min_lng + 180.0) / lng_step) * lng_step - 180.0
+    rows = int(math.floor((max_lat - lat0) / lat_step)) + 1
+    cols = int(math.floor((max_lng - lng0) / lng_step)) + 1
+    if rows * cols > max_cells:
+        raise ValueError(f"セル数が多すぎます（{rows * cols} > {max_cells}）")
+
+    cells = []
+    for row in range(rows):
+        lat = lat0 + (row + 0.5) * lat_step
+        for col in range(cols):
+            lng = lng0 + (col + 0.5) * lng_step
+            # 日付変更線をまたぐ場合は経度を正規化
+            lng = (lng + 180.0) % 360.0 - 180.0
+            cells.append(encode(lat, lng, precision))
+    return list(dict.fromkeys(cells))
+
+
+def cells_for_radius(lat: float, lng: float, radius_km: float, precision: int,
+                     max_cells: int = 1000) -> List[str]:
+    """中心と半径（km）の円を覆うセルの一覧"""
+    dlat = radius_km / 111.32
+    dlng = radius_km / (111.32 * max(math.cos(math.radians(lat)), 1e-6))
+    return cells_in_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng, precision, max_cells)
@@ -0,0 +1,291 @@
+"""
+Idempotency-Key による更新系リクエストの重複排除
+
+アップロード・更新・削除に Idempotency-Key ヘッダーが付いている場合、
+最初のリクエストの結果（ステータス・ヘッダー・本文）をDBに保存し、同じキーでの再送には
+処理をやり直さずに保存済みの結果を返す（Idempotent-Replayed: true を付与）。
+- キーはユーザーごとに区別する（JWTの sub）
+- 同じキーのリクエストが処理中の場合は、完了を待ってから結果を返す
+- 同じキーで内容の異なるリクエストには422を返す
+- 5xxの結果は保存しない（再送で処理をやり直せるように）
+- 結果は IDEMPOTENCY_TTL_HOURS 時間保持し、定期タスクで削除する
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from services.metrics import registry
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# 処理中のまま残ったキー（ワーカーの異常終了など）を引き継ぐまでの秒数
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+# 処理中の同じキーの完了を待つ最大秒数（超えたら409）
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+MAX_KEY_LENGTH = 255
+MAX_BODY_BYTES = 6 * 1024 * 1024
+
+IDEMPOTENT_ROUTES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("POST", re.compile(r"^/photos/upload$")),
+    ("PUT", re.compile(r"^/photos/[^/]+$")),
+    ("DELETE", re.compile(r"^/photos/[^/]+$")),
+]
+
+# 保存・再生しないレスポンスヘッダー
+_SKIP_HEADERS = {b"date", b"server", b"server-timing"}
+
+idempotency_requests = registry.counter(
+    "idempotency_requests_total", "Idempotency-Key付きリクエストの処理結果", ["outcome"])
+
+CLAIM_SQL = text("""
+INSERT INTO idempotency_keys (user_id, key, method, path, request_hash, expires_at)
+VALUES (:user_id, :key, :method, :path, :request_hash, now() + make_interval(secs => :ttl))
+ON CONFLICT (user_id, key) DO NOTHING
+RETURNING 1
+""")
+
+TAKEOVER_SQL = text("""
+UPDATE idempotency_keys
+SET locked_at = now(), request_hash = :request_hash, method = :method, path = :path
+WHERE user_id = :user_id AND key = :key AND status = 'in_progress'
+  AND locked_at < now() - make_interval(secs => :lock_timeout)
+RETURNING 1
+""")
+
+SELECT_SQL = text("""
+SELECT status, request_hash, response_status, response_headers, response_body
+FROM idempotency_keys
+WHERE user_id = :user_id AND key = :key
+""")
+
+COMPLETE_SQL = text("""
+UPDATE idempotency_keys
+SET status = 'completed', response_status = :status, response_headers = CAST(:headers AS JSONB),
+    response_body = :body, completed_at = now()
+WHERE user_id = :user_id AND key = :key
+""")
+
+RELEASE_SQL = text("DELETE FROM idempotency_keys WHERE user_id = :user_id AND key = :key AND status = 'in_progress'")
+
+PURGE_SQL = text("""
+DELETE FROM idempotency_keys
+WHERE ctid IN (SELECT ctid FROM idempotency_keys WHERE expires_at < now() LIMIT :batch_size)
+""")
+
+
+def is_idempotent_route(method: str, path: str) -> bool:
+    return any(method == m and pattern.match(path) for m, pattern in IDEMPOTENT_ROUTES)
+
+
+def request_fingerprint(method: str, path: str, query: bytes, content_type: str, body: bytes) -> str:
+    """
+    リクエスト内容のハッシュ
+
+    multipartの境界文字列は再送のたびに変わるため、固定の文字列に置き換えてから計算する。
+    """
+    match = re.search(r"boundary=\"?([^\";]+)\"?", content_type or "")
+    if match and content_type.startswith("multipart/"):
+        body = body.replace(match.group(1).encode("latin-1"), b"BOUNDARY")
+        content_type = content_type[:match.start()] + "boundary=BOUNDARY"
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query, (content_type or "").encode("latin-1")):
+        digest.update(part + b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """idempotency_keys テーブルの操作（同期関数なのでスレッドで呼ぶ）"""
+
+    def _engine(self):
+        from database import get_engine
+        return get_engine()
+
+    def claim(self, user_id: str, key: str, method: str, path: str, request_hash: str) -> Optional[dict]:
+        """キーを確保できたらNone、既にあれば保存済みの行を返す"""
+        params = {"user_id": user_id, "key": key, "method": method, "path": path,
+                  "request_hash": request_hash, "ttl": IDEMPOTENCY_TTL_HOURS * 3600,
+                  "lock_timeout": IDEMPOTENCY_LOCK_TIMEOUT}
+        with self._engine().begin() as conn:
+            if conn.execute(CLAIM_SQL, params).first():
+                return None
+            if conn.execute(TAKEOVER_SQL, params).first():
+                return None
+            row = conn.execute(SELECT_SQL, params).mappings().first()
+            # 確認の間に削除された場合は次の試行で確保する
+            return dict(row) if row else {"status": "in_progress", "request_hash": request_hash}
+
+    def get(self, user_id: str, key: str) -> Optional[dict]:
+        with self._engine().connect() as conn:
+            row = conn.execute(SELECT_SQL, {"user_id": user_id, "key": key}).mappings().first()
+            return dict(row) if row else None
+
+    def complete(self, user_id: str, key: str, status: int, headers: list, body: bytes):
+        with self._engine().begin() as conn:
+            conn.execute(COMPLETE_SQL, {"user_id": user_id, "key": key, "status": status,
+                                        "headers": json.dumps(headers), "body": body})
+
+    def release(self, user_id: str, key: str):
+        with self._engine().begin() as conn:
+            conn.execute(RELEASE_SQL, {"user_id": user_id, "key": key})
+
+    def purge_expired(self, batch_size: int = 1000) -> int:
+        total = 0
+        while True:
+            with self._engine().begin() as conn:
+                deleted = conn.execute(PURGE_SQL, {"batch_size": batch_size}).rowcount
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+
+store = IdempotencyStore()
+
+
+def run_purge_expired() -> Optional[str]:
+    """定期タスク用"""
+    deleted = store.purge_expired()
+    return f"期限切れのIdempotency-Keyを{deleted}件削除しました" if deleted else None
+
+
+async def _send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _replay(send, row: dict):
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in row["response_headers"] or []]
+    headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": row["response_status"], "headers": headers})
+    await send({"type": "http.response.body", "body": bytes(row["response_body"] or b"")})
+
+
+class IdempotencyMiddleware:
+    """Idempotency-Key ヘッダー付きの対象リクエストを重複排除するASGIミドルウェア"""
+
+    def __init__(self, app, store: IdempotencyStore = store):
+        self.app = app
+        self.store = store
+        # このワーカーで処理中のキー（同じワーカーへの再送はDBをポーリングせずに待つ）
+        self._inflight: Dict[Tuple[str, str], asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_idempotent_route(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        key = headers.get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Keyは{MAX_KEY_LENGTH}文字以内で指定してください")
+            return
+
+        from services.db_routing import user_key_from_authorization
+
+        user_id = user_key_from_authorization(headers.get("authorization"))
+        if not user_id:
+            # 認証エラーはエンドポイント側で返す
+            await self.app(scope, receive, send)
+            return
+
+        # 本文を読み込んでハッシュを計算し、アプリには同じ本文を渡し直す
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                await self.app(scope, receive, send)
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > MAX_BODY_BYTES:
+                await _send_json(send, 413, "リクエストが大きすぎます")
+                return
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        request_hash = request_fingerprint(
+            scope["method"], scope["path"], scope.get("query_string", b""), headers.get("content-type", ""), body)
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        inflight_key = (user_id, key)
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+        while True:
+            row = await asyncio.to_thread(
+                self.store.claim, user_id, key, scope["method"], scope["path"], request_hash)
+            if row is None:
+                break
+            if row["request_hash"] != request_hash:
+                idempotency_requests.inc(outcome="mismatch")
+                await _send_json(send, 422, "同じIdempotency-Keyで異なる内容のリクエストが送信されました")
+                return
+            if row["status"] == "completed":
+                idempotency_requests.inc(outcome="coalesced" if waited else "replayed")
+                await _replay(send, row)
+                return
+
+            # 処理中: 完了を待ってから再確認する
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                idempotency_requests.inc(outcome="conflict")
+                await _send_json(send, 409, "同じIdempotency-Keyのリクエストを処理中です")
+                return
+            event = self._inflight.get(inflight_key)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                else:
+                    await asyncio.sleep(min(0.2, remaining))
+            except asyncio.TimeoutError:
+                pass
+            waited = True
+
+        event = asyncio.Event()
+        self._inflight[inflight_key] = event
+        response_status = 500
+        response_headers: list = []
+        response_body = []
+
+        async def capture_send(message):
+            nonlocal response_status, response_headers
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                response_headers = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", []) if name.lower() not in _SKIP_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            try:
+                if response_status < 500:
+                    await asyncio.to_thread(
+                        self.store.complete, user_id, key, response_status, response_headers, b"".join(response_body))
+                else:
+                    await asyncio.to_thread(self.store.release, user_id, key)
+            finally:
+                self._inflight.pop(inflight_key, None)
+                event.set()
+            idempotency_requests.inc(outcome="executed")
@@ -0,0 +1,108 @@
+"""
+アップロード画像の解析
+
+画像を一度だけ（JPEGは縮小して）デコードし、EXIF・知覚ハッシュ・プレースホルダー・
+表示サイズをまとめて取り出す。アップロード処理とバックフィルジョブで共通に使う。
+"""
+import io
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from services.image_hash import dhash, to_db
+from services.placeholder import compute_placeholder
+
+# EXIFの向き（5〜8は90度回転なので幅と高さが入れ替わる）
+_ORIENTATION_TAG = 0x0112
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_DATETIME_ORIGINAL = 0x9003
+_OFFSET_TIME_ORIGINAL = 0x9011
+
+
+def extract_exif_data(image) -> Optional[dict]:
+    """EXIFデータを抽出"""
+    try:
+        exif_data = image._getexif()
+
+        if not exif_data:
+            return None
+
+        # EXIFタグを読み取り
+        exif_dict = {}
+        for tag_id, value in exif_data.items():
+            tag = image.getexif().get(tag_id)
+            if tag:
+                exif_dict[str(tag_id)] = str(value)
+
+        return exif_dict
+    except Exception:
+        return None
+
+
+def _degrees(value, ref) -> float:
+    degrees, minutes, seconds = (float(v) for v in value)
+    result = degrees + minutes / 60 + seconds / 3600
+    return -result if ref in ("S", "W") else result
+
+
+def extract_location(image) -> Optional[Tuple[float, float]]:
+    """EXIFのGPS情報から (緯度, 経度) を取り出す（ない・不正ならNone）"""
+    try:
+        gps = image.getexif().get_ifd(_GPS_IFD)
+        lat = _degrees(gps[2], gps.get(1, "N"))
+        lng = _degrees(gps[4], gps.get(3, "E"))
+    except Exception:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None
+    return lat, lng
+
+
+def extract_taken_at(image) -> Optional[datetime]:
+    """EXIFの撮影日時（オフセットがなければUTCとみなす）"""
+    try:
+        exif = image.getexif().get_ifd(_EXIF_IFD)
+        taken_at = datetime.strptime(exif[_DATETIME_ORIGINAL].strip(), "%Y:%m:%d %H:%M:%S")
+    except Exception:
+        return None
+    try:
+        offset = datetime.strptime(exif[_OFFSET_TIME_ORIGINAL].strip(), "%z").tzinfo
+    except Exception:
+        offset = timezone.utc
+    return taken_at.replace(tzinfo=offset)
+
+
+def analyze_image(content: bytes) -> Dict[str, Any]:
+    """
+    Photoのカラムに対応する値を返す
+    （exif, phash, blurhash, dominant_color, width, height、取れないものはNone）
+    """
+    from PIL import Image, ImageOps
+
+    features: Dict[str, Any] = {
+        "exif": None, "phash": None, "blurhash": None,
+        "dominant_color": None, "width": None, "height": None,
+    }
+    try:
+        image = Image.open(io.BytesIO(content))
+    except Exception:
+        return features
+
+    features["exif"] = extract_exif_data(image)
+    width, height = image.size
+    try:
+        if image.getexif().get(_ORIENTATION_TAG) in (5, 6, 7, 8):
+            width, height = height, width
+    except Exception:
+        pass
+    features["width"], features["height"] = width, height
+
+    try:
+        # 以降は縮小画像で十分なので、JPEGはデコード時に縮小する
+        image.draft("RGB", (64, 64))
+        oriented = ImageOps.exif_transpose(image)
+        features["phash"] = to_db(dhash(oriented))
+        features["blurhash"], features["dominant_color"] = compute_placeholder(oriented)
+    except Exception:
+        pass
+    return features
@@ -0,0 +1,42 @@
+"""
+知覚ハッシュ（dHash）
+
+連写や編集後のコピーのようにバイト列は異なるが見た目が近い画像を検出するための64bitハッシュ。
+縮小したグレースケール画像の隣接画素の明暗だけを見るため、再圧縮・リサイズ・軽い色調補正に強い。
+"""
+from typing import Optional
+
+HASH_BITS = 64
+_MASK = (1 << HASH_BITS) - 1
+
+
+def dhash(image) -> int:
+    """PIL画像から64bitのdHashを計算（符号なし整数）"""
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    small = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_db(value: Optional[int]) -> Optional[int]:
+    """BIGINT（符号付き）に格納できる形に変換"""
+    if value is None:
+        return None
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_db(value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return None
+    return value & _MASK
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
@@ -0,0 +1,207 @@
+"""
+近くの公開写真のリアルタイム配信
+
+クライアントはWebSocketでGeohashのセルを購読し、公開写真がアップロードされると
+そのセルの購読者にだけイベントを送る。
+- セル→購読者のインデックスはワーカーのメモリ上に持つ
+- 購読者ごとのキューは LIVE_QUEUE_SIZE 件までで、溢れた（受信が追いつかない）接続は切断する
+- LIVE_NOTIFY_BRIDGE=true の場合は Postgres の LISTEN/NOTIFY で全ワーカーに配る
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from services import geohash
+from services.metrics import registry
+
+LIVE_CELL_PRECISION = int(os.getenv("LIVE_CELL_PRECISION", "5"))
+LIVE_MAX_CELLS = int(os.getenv("LIVE_MAX_CELLS", "64"))
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "32"))
+LIVE_NOTIFY_BRIDGE = os.getenv("LIVE_NOTIFY_BRIDGE", "false").lower() in ("1", "true", "yes")
+NOTIFY_CHANNEL = "photo_live"
+
+logger = logging.getLogger("live_updates")
+
+live_subscribers = registry.gauge("live_subscribers", "リアルタイム配信の接続数")
+live_events = registry.counter("live_events_total", "配信した写真イベント", ["source"])
+live_deliveries = registry.counter("live_deliveries_total", "購読者へのイベント送信数")
+live_dropped = registry.counter("live_dropped_total", "受信が追いつかず切断した購読者数")
+
+
+class Subscriber:
+    """1接続分の購読状態と送信キュー"""
+
+    def __init__(self, queue_size: int = LIVE_QUEUE_SIZE):
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=queue_size)
+        self.cells: Set[str] = set()
+        self.dropped = False
+
+    def offer(self, message: str) -> bool:
+        """キューに積む（満杯ならFalse）"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop(self):
+        """キューを空にして終了の合図（None）を積む"""
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class LiveHub:
+    """セル→購読者のインデックス（イベントループのスレッドからだけ操作する）"""
+
+    def __init__(self, precision: int = LIVE_CELL_PRECISION, max_cells: int = LIVE_MAX_CELLS):
+        self.precision = precision
+        self.max_cells = max_cells
+        self._cells: Dict[str, Set[Subscriber]] = {}
+        self._subscribers: Set[Subscriber] = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def register(self, subscriber: Subscriber):
+        self._subscribers.add(subscriber)
+        live_subscribers.set(len(self._subscribers))
+
+    def unregister(self, subscriber: Subscriber):
+        self.set_cells(subscriber, [])
+        self._subscribers.discard(subscriber)
+        live_subscribers.set(len(self._subscribers))
+
+    def set_cells(self, subscriber: Subscriber, cells: Iterable[str]):
+        """購読するセルを置き換える"""
+        cells = set(cells)
+        if len(cells) > self.max_cells:
+            raise ValueError(f"購読できるセルは{self.max_cells}個までです")
+        for cell in cells:
+            if len(cell) != self.precision or not geohash.is_valid(cell):
+                raise ValueError(f"セルは{self.precision}桁のGeohashで指定してください: {cell}")
+
+        for cell in subscriber.cells - cells:
+            members = self._cells.get(cell)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self._cells[cell]
+        for cell in cells - subscriber.cells:
+            self._cells.setdefault(cell, set()).add(subscriber)
+        subscriber.cells = cells
+
+    def cells_for_radius(self, lat: float, lng: float, radius_km: float) -> List[str]:
+        return geohash.cells_for_radius(lat, lng, radius_km, self.precision, self.max_cells)
+
+    def publish_local(self, event: dict, source: str = "local") -> int:
+        """このワーカーの購読者に配信し、送信した数を返す"""
+        lat, lng = event.get("lat"), event.get("lng")
+        if lat is None or lng is None:
+            return 0
+        members = self._cells.get(geohash.encode(lat, lng, self.precision))
+        live_events.inc(source=source)
+        if not members:
+            return 0
+
+        # シリアライズは1回だけ
+        message = json.dumps({"type": "photo", "photo": event}, ensure_ascii=False, default=str)
+        delivered = 0
+        for subscriber in list(members):
+            if subscriber.offer(message):
+                delivered += 1
+            else:
+                live_dropped.inc()
+                self.set_cells(subscriber, [])
+                subscriber.drop()
+        live_deliveries.inc(delivered)
+        return delivered
+
+    async def publish(self, event: dict):
+        """写真イベントを配信（ブリッジ有効時は全ワーカーへ、無効時はこのワーカーだけ）"""
+        if LIVE_NOTIFY_BRIDGE:
+            await asyncio.to_thread(notify, event)
+        else:
+            self.publish_local(event)
+
+
+def photo_event(photo) -> dict:
+    """配信用の最小限の写真情報（NOTIFYの8000バイト制限に収まるようにする）"""
+    return {
+        "id": str(photo.id),
+        "user_id": str(photo.user_id),
+        "lat": photo.lat,
+        "lng": photo.lng,
+        "title": (photo.title or "")[:200] or None,
+        "blurhash": photo.blurhash,
+        "dominant_color": photo.dominant_color,
+        "width": photo.width,
+        "height": photo.height,
+        "created_at": photo.created_at.isoformat() if photo.created_at else None,
+    }
+
+
+def notify(event: dict):
+    """pg_notify で全ワーカーに送る（コミット後に呼ぶ）"""
+    from sqlalchemy import text
+    from database import get_engine
+
+    with get_engine().begin() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                     {"channel": NOTIFY_CHANNEL, "payload": json.dumps(event, default=str)})
+
+
+class NotifyBridge:
+    """LISTEN用の専用接続をスレッドで待ち受け、受け取ったイベントをイベントループで配信する"""
+
+    def __init__(self, hub: LiveHub):
+        self.hub = hub
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._thread = threading.Thread(target=self._run, args=(loop,), name="live-notify", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self, loop: asyncio.AbstractEventLoop):
+        from database import get_engine
+
+        while not self._stop.is_set():
+            try:
+                raw = get_engine().raw_connection()
+                try:
+                    connection = raw.driver_connection
+                    connection.autocommit = True
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    while not self._stop.is_set():
+                        if select.select([connection], [], [], 1.0) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            payload = connection.notifies.pop(0).payload
+                            loop.call_soon_threadsafe(self._dispatch, payload)
+                finally:
+                    raw.invalidate()
+            except Exception:
+                logger.exception("LISTEN接続が切れました。再接続します")
+                self._stop.wait(5)
+
+    def _dispatch(self, payload: str):
+        try:
+            self.hub.publish_local(json.loads(payload), source="notify")
+        except ValueError:
+            logger.warning("不正なイベントを受信しました: %s", payload[:200])
+
+
+live_hub = LiveHub()
@@ -0,0 +1,299 @@
+"""
+リクエスト単位の計測とPrometheus形式のメトリクス
+
+- MetricsMiddleware: ルートごとのレイテンシを記録し、Server-Timingヘッダーを付与
+- instrument_engine: SQLAlchemyエンジンのクエリ数・時間を記録
+- track: ストレージ・認証など任意の区間を計測
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRIC_PREFIX = "photoapi_"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# Server-Timingに出力する区間（renderは残り時間: アプリ処理+シリアライズ）
+TIMING_SEGMENTS = ("db", "storage", "auth")
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [bucketごとの件数..., 合計値, 件数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        state = self._values.get(key)
+        return int(state[-1]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                labels = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {int(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTPリクエストの処理時間", ["method", "route", "status"])
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries", "1リクエストあたりのSQL発行数", ["route"], QUERY_COUNT_BUCKETS)
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "SQL1文あたりの実行時間")
+segment_duration = registry.histogram(
+    "operation_duration_seconds", "ストレージ・認証などの処理時間", ["segment", "operation"])
+operation_errors = registry.counter(
+    "operation_errors_total", "ストレージ・認証などの処理で発生した例外数", ["segment", "operation"])
+
+
+@dataclass
+class RequestTimings:
+    started: float = field(default_factory=time.perf_counter)
+    segments: Dict[str, float] = field(default_factory=dict)
+    db_queries: int = 0
+
+    def add(self, segment: str, seconds: float):
+        self.segments[segment] = self.segments.get(segment, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timingヘッダーの値を作成（ミリ秒）"""
+        parts = []
+        accounted = 0.0
+        for segment in TIMING_SEGMENTS:
+            seconds = self.segments.get(segment, 0.0)
+            accounted += seconds
+            entry = f"{segment};dur={seconds * 1000:.2f}"
+            if segment == "db":
+                entry += f';desc="{self.db_queries} queries"'
+            parts.append(entry)
+        parts.append(f"render;dur={max(total - accounted, 0.0) * 1000:.2f}")
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """処理中リクエストの計測値（リクエスト外ではNone）"""
+    return _current.get()
+
+
+@contextmanager
+def track(segment: str, operation: str):
+    """区間の処理時間を計測し、リクエストの該当セグメントに加算する"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        operation_errors.inc(segment=segment, operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        segment_duration.observe(elapsed, segment=segment, operation=operation)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(segment, elapsed)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    db_query_duration.observe(elapsed)
+    timings = _current.get()
+    if timings is not None:
+        timings.add("db", elapsed)
+        timings.db_queries += 1
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("metrics_query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Engine):
+    """エンジンにクエリ計測用のイベントフックを登録"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """ルートごとのレイテンシ計測とServer-Timingヘッダーの付与を行うASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Dict[object, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            # 未定義パスのスキャン等でラベルが増え続けないようまとめる
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                total = time.perf_counter() - timings.started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing(total).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - timings.started
+            route = self._route_label(scope)
+            http_request_duration.observe(elapsed, method=scope["method"], route=route, status=status_code)
+            http_request_db_queries.observe(timings.db_queries, route=route)
+            _current.reset(token)
@@ -0,0 +1,185 @@
+"""
+近くの写真検索のセル単位キャッシュ
+
+検索の座標は毎回少しずつ違うため、レスポンスをそのままキャッシュしても当たらない。
+そこで半径に応じた精度のGeohashセルごとに候補（そのセルにある写真）をキャッシュし、
+検索円を覆うセルの候補を合わせてメモリ上で距離の判定と並べ替えを行う。
+
+- 精度: セルの縦横が半径以上になる最も細かい精度（円を覆うセルはおおむね3×3以内）
+- 候補: セル×公開範囲（public / unlisted / 本人の private）ごとに新しい順で NEARBY_CELL_MAX_PHOTOS 件まで
+- 上限で切れたセルがあり、切れた時刻より新しい結果だけで limit 件に届かない場合はDBに直接問い合わせる
+- 無効化: 写真が作成・更新・削除されたら、その地点を含む全精度のセルの世代番号を進める
+- バックエンド: response_cache と同じ（RESPONSE_CACHE_BACKEND=redis なら全ワーカーで共有）
+"""
+import json
+import math
+import os
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from uuid import UUID
+
+from services import geohash
+from services.metrics import registry
+from services.response_cache import RESPONSE_CACHE_BACKEND, InProcessBackend, RedisBackend
+
+NEARBY_CACHE_TTL = float(os.getenv("NEARBY_CACHE_TTL", "60"))
+NEARBY_CACHE_MAX_ENTRIES = int(os.getenv("NEARBY_CACHE_MAX_ENTRIES", "5000"))
+NEARBY_CELL_MAX_PHOTOS = int(os.getenv("NEARBY_CELL_MAX_PHOTOS", "500"))
+NEARBY_MAX_CELLS = int(os.getenv("NEARBY_MAX_CELLS", "16"))
+
+MAX_PRECISION = 7  # 約150m四方（半径の下限0.1kmを覆える）
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0088
+
+nearby_cells = registry.counter(
+    "nearby_cache_cells_total", "近くの写真検索で参照したセル候補（hit/miss）", ["result"])
+nearby_fallbacks = registry.counter(
+    "nearby_cache_fallbacks_total", "セルの候補では足りずDBに直接問い合わせた回数", ["reason"])
+
+
+def precision_for_radius(lat: float, radius_km: float) -> int:
+    """セルの縦横が半径以上になる最も細かい精度"""
+    lng_scale = KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_step, lng_step = geohash.cell_size(precision)
+        if lat_step * KM_PER_DEGREE >= radius_km and lng_step * lng_scale >= radius_km:
+            return precision
+    return 1
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """大円距離（haversine）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def scopes_for(user_id: Optional[UUID]) -> List[str]:
+    """検索者から見える公開範囲（private は本人の分だけ）"""
+    if user_id is None:
+        return ["public"]
+    return ["public", "unlisted", f"private:{user_id}"]
+
+
+def cell_photos_query(db, cell: str, scope: str, limit: int):
+    """セル内の写真を新しい順に取得するクエリ（境界上の写真を含むので呼び出し側でセルを判定する）"""
+    from sqlalchemy import func
+
+    from models.database import Photo, VisibilityEnum
+
+    min_lat, min_lng, max_lat, max_lng = geohash.bbox(cell)
+    # GiSTインデックスを使うための外接矩形（測地線の膨らみ分だけ広げる）
+    margin = (max_lat - min_lat) / 8
+    envelope = func.geography(func.ST_MakeEnvelope(
+        min_lng - margin, min_lat - margin, max_lng + margin, max_lat + margin, 4326))
+    query = db.query(Photo).filter(
+        Photo.location.isnot(None),
+        Photo.location.op("&&")(envelope),
+        Photo.lat.between(min_lat, max_lat),
+        Photo.lng.between(min_lng, max_lng),
+    )
+    if scope.startswith("private:"):
+        query = query.filter(Photo.visibility == VisibilityEnum.private,
+                             Photo.user_id == UUID(scope.split(":", 1)[1]))
+    else:
+        query = query.filter(Photo.visibility == VisibilityEnum(scope))
+    return query.order_by(Photo.created_at.desc()).limit(limit)
+
+
+def load_cell(db, cell: str, scope: str, limit: int) -> List[dict]:
+    """セル内の写真をレスポンスと同じ形（JSON）で返す"""
+    from schemas.schemas import PhotoResponse
+
+    return [
+        PhotoResponse.model_validate(photo).model_dump(mode="json")
+        for photo in cell_photos_query(db, cell, scope, limit)
+    ]
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+class NearbyCache:
+    def __init__(self, backend=None, ttl: float = NEARBY_CACHE_TTL, max_photos: int = NEARBY_CELL_MAX_PHOTOS,
+                 max_cells: int = NEARBY_MAX_CELLS, load: Callable[..., List[dict]] = load_cell):
+        self.ttl = ttl
+        self.max_photos = max_photos
+        self.max_cells = max_cells
+        self._load = load
+        self._backend = backend
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = RedisBackend() if RESPONSE_CACHE_BACKEND == "redis" else InProcessBackend(NEARBY_CACHE_MAX_ENTRIES)
+        return self._backend
+
+    def _cell(self, db, cell: str, scope: str) -> Tuple[dict, bool]:
+        """セル×公開範囲の候補（{"cutoff": 上限で切れた時刻 or None, "rows": [[時刻, 緯度, 経度, 写真], ...]}）"""
+        namespace = f"nearby:{cell}"
+        # 読み込み前の世代で保存するので、読み込み中に無効化された結果は参照されない
+        key = f"{namespace}:{self.backend.generation(namespace)}:{scope}"
+        value = self.backend.get(key)
+        if value is not None:
+            nearby_cells.inc(result="hit")
+            return json.loads(value), True
+
+        nearby_cells.inc(result="miss")
+        photos = self._load(db, cell, scope, self.max_photos + 1)
+        entry = {
+            # 上限で切れた場合はこの時刻以前の写真が欠けている
+            "cutoff": _timestamp(photos[self.max_photos - 1]["created_at"]) if len(photos) > self.max_photos else None,
+            "rows": [
+                [_timestamp(photo["created_at"]), photo["lat"], photo["lng"], photo]
+                for photo in photos[:self.max_photos]
+                if photo["lat"] is not None and photo["lng"] is not None
+                and geohash.encode(photo["lat"], photo["lng"], len(cell)) == cell
+            ],
+        }
+        self.backend.set(key, json.dumps(entry, ensure_ascii=False).encode("utf-8"), self.ttl, namespace=namespace)
+        return entry, False
+
+    def lookup(self, db, lat: float, lng: float, radius_km: float, limit: int,
+               user_id: Optional[UUID] = None) -> Optional[Tuple[List[dict], str]]:
+        """半径内の写真を新しい順に limit 件（キャッシュで答えられない場合はNone）"""
+        precision = precision_for_radius(lat, radius_km)
+        try:
+            cells = geohash.cells_for_radius(lat, lng, radius_km, precision, self.max_cells)
+        except ValueError:
+            # 極付近など経度方向のセルが細かすぎる場合
+            nearby_fallbacks.inc(reason="cells")
+            return None
+
+        rows = []
+        cutoff = None
+        all_hit = True
+        for cell in cells:
+            for scope in scopes_for(user_id):
+                entry, hit = self._cell(db, cell, scope)
+                all_hit = all_hit and hit
+                if entry["cutoff"] is not None:
+                    cutoff = entry["cutoff"] if cutoff is None else max(cutoff, entry["cutoff"])
+                rows.extend(row for row in entry["rows"] if distance_km(lat, lng, row[1], row[2]) <= radius_km)
+
+        rows.sort(key=lambda row: row[0], reverse=True)
+        if cutoff is not None and sum(1 for row in rows[:limit] if row[0] > cutoff) < limit:
+            nearby_fallbacks.inc(reason="truncated")
+            return None
+        return [row[3] for row in rows[:limit]], "HIT" if all_hit else "MISS"
+
+    def invalidate(self, lat: Optional[float], lng: Optional[float]):
+        """地点を含む全精度のセルを無効化する"""
+        if lat is None or lng is None:
+            return
+        for precision in range(1, MAX_PRECISION + 1):
+            self.backend.bump_generation(f"nearby:{geohash.encode(lat, lng, precision)}")
+
+
+def render_photos(photos: List[dict]) -> bytes:
+    return json.dumps(photos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+nearby_cache = NearbyCache()
@@ -0,0 +1,115 @@
+"""
+ユーザーのライブラリのエクスポート
+
+写真を created_at, id 順にキーセットページングで読み、ZIPのエントリとマニフェストを組み立てる。
+レイアウト計算・本体・セントラルディレクトリで同じ列を何度か読むため、
+REPEATABLE READ のセッションで同じスナップショットを見る。
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Iterator, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+
+from models.database import Photo, PhotoTombstone
+from services.s3_service import s3_service
+from services.zip_export import ExportEntry, ZipExport
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+_ENTRY_COLUMNS = (Photo.id, Photo.s3_key, Photo.size_bytes, Photo.crc32, Photo.created_at)
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def archive_name(photo_id: UUID, s3_key: str, created_at: datetime) -> str:
+    """アーカイブ内のパス（作成月ごとのフォルダ）"""
+    extension = os.path.splitext(s3_key)[1].lower()
+    return f"photos/{_utc(created_at):%Y/%m}/{photo_id}{extension}"
+
+
+def _pages(db: Session, user_id: UUID, columns) -> Iterator:
+    last = None
+    while True:
+        query = db.query(*columns).filter(Photo.user_id == user_id)
+        if last is not None:
+            query = query.filter(tuple_(Photo.created_at, Photo.id) > last)
+        rows = query.order_by(Photo.created_at, Photo.id).limit(EXPORT_PAGE_SIZE).all()
+        yield from rows
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        last = (rows[-1].created_at, rows[-1].id)
+
+
+def _entries(db: Session, user_id: UUID) -> Iterator[ExportEntry]:
+    for photo_id, s3_key, size_bytes, crc32, created_at in _pages(db, user_id, _ENTRY_COLUMNS):
+        yield ExportEntry(
+            archive_name(photo_id, s3_key, created_at), s3_service.key_from_url(s3_key),
+            size_bytes, crc32, _utc(created_at),
+        )
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _manifest(db: Session, user_id: UUID) -> Iterator[bytes]:
+    """写真のメタデータのJSON配列（1件ずつ書き出す）"""
+    first = True
+    yield b"["
+    for (photo,) in _pages(db, user_id, (Photo,)):
+        item = {
+            "id": str(photo.id),
+            "file": archive_name(photo.id, photo.s3_key, photo.created_at),
+            "title": photo.title,
+            "description": photo.description,
+            "visibility": getattr(photo.visibility, "value", photo.visibility),
+            "lat": photo.lat,
+            "lng": photo.lng,
+            "accuracy_m": photo.accuracy_m,
+            "address": photo.address,
+            "taken_at": _iso(photo.taken_at),
+            "created_at": _iso(photo.created_at),
+            "updated_at": _iso(photo.updated_at),
+            "mime_type": photo.mime_type,
+            "size_bytes": photo.size_bytes,
+            "width": photo.width,
+            "height": photo.height,
+            "exif": photo.exif,
+        }
+        yield (b"\n" if first else b",\n") + json.dumps(item, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        first = False
+    yield b"\n]\n"
+
+
+def library_version(db: Session, user_id: UUID) -> Tuple[int, str]:
+    """写真の件数と、作成・更新・削除があれば変わるETag"""
+    count, photo_seq = db.query(
+        func.count(Photo.id), func.coalesce(func.max(Photo.change_seq), 0)
+    ).filter(Photo.user_id == user_id).one()
+    tombstone_seq = db.query(func.coalesce(func.max(PhotoTombstone.change_seq), 0)).filter(
+        PhotoTombstone.user_id == user_id).scalar()
+    digest = hashlib.sha1(f"{user_id}:{count}:{photo_seq}:{tombstone_seq}".encode()).hexdigest()[:20]
+    return count, f'"export-{digest}"'
+
+
+def build_export(db: Session, user_id: UUID) -> Tuple[ZipExport, str]:
+    """エクスポートアーカイブとETagを返す（db は送信が終わるまで開いておく）"""
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    _, etag = library_version(db, user_id)
+    newest = db.query(func.max(Photo.updated_at)).filter(Photo.user_id == user_id).scalar()
+    export = ZipExport(
+        entries=lambda: _entries(db, user_id),
+        manifest=lambda: _manifest(db, user_id),
+        fetch=s3_service.get_object_range,
+        modified=_utc(newest) if newest else datetime(1980, 1, 1),
+    )
+    return export, etag
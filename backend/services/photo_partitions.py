@@ -0,0 +1,267 @@
+"""
+photos テーブルの月次レンジパーティショニング（任意機能）
+
+PHOTOS_PARTITIONED=true の環境では photos を created_at の月単位でパーティション分割し、
+- 先の月のパーティションを定期的に自動作成する（ensure_partitions）
+- インデックス（位置情報のGiSTを含む）は各パーティションにローカルに作成される
+既存の非分割テーブルからは migrate() でオンライン移行できる。
+"""
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+PHOTOS_PARTITIONED = os.getenv("PHOTOS_PARTITIONED", "false").lower() in ("1", "true", "yes")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PHOTOS_PARTITION_MONTHS_AHEAD", "3"))
+
+PARENT_TABLE = "photos"
+NEW_TABLE = "photos_p"
+LEGACY_TABLE = "photos_legacy"
+DEFAULT_PARTITION = "photos_pdefault"
+SYNC_TRIGGER = "photos_partition_sync"
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def iter_months(start: date, end: date) -> Iterator[date]:
+    """start〜endの月初を順に返す（両端を含む）"""
+    current = month_start(start)
+    while current <= end:
+        yield current
+        current = add_months(current, 1)
+
+
+def partition_name(month: date, parent: str = PARENT_TABLE) -> str:
+    return f"{parent}_p{month.year:04d}{month.month:02d}"
+
+
+def partition_ddl(month: date, parent: str = PARENT_TABLE) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month, parent)} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def is_partitioned(conn: Connection, table: str = PARENT_TABLE) -> bool:
+    return bool(conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": table},
+    ).scalar())
+
+
+def list_partitions(conn: Connection, parent: str = PARENT_TABLE) -> List[dict]:
+    rows = conn.execute(text("""
+        SELECT c.relname AS name,
+               pg_get_expr(c.relpartbound, c.oid) AS bound,
+               c.reltuples::bigint AS estimated_rows,
+               pg_total_relation_size(c.oid) AS total_bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:parent)
+        ORDER BY c.relname
+    """), {"parent": parent})
+    return [dict(row._mapping) for row in rows]
+
+
+def ensure_partitions(conn: Connection, months_ahead: int = PARTITION_MONTHS_AHEAD,
+                      today: Optional[date] = None, parent: str = PARENT_TABLE) -> List[str]:
+    """今月から months_ahead ヶ月先までのパーティションを作成（作成したものを返す）"""
+    if not is_partitioned(conn, parent):
+        return []
+    today = today or datetime.now(timezone.utc).date()
+    existing = {p["name"] for p in list_partitions(conn, parent)}
+    created = []
+    for month in iter_months(today, add_months(month_start(today), months_ahead)):
+        name = partition_name(month, parent)
+        if name not in existing:
+            conn.execute(text(partition_ddl(month, parent)))
+            created.append(name)
+    return created
+
+
+def run_ensure_partitions() -> List[str]:
+    """定期タスク用: 共有エンジンで ensure_partitions を実行"""
+    from database import get_engine
+
+    with get_engine().begin() as conn:
+        return ensure_partitions(conn)
+
+
+# --- 既存テーブルからの移行 ---
+
+def _index_definitions(conn: Connection, table: str) -> List[tuple]:
+    """主キー以外のインデックス名と定義"""
+    rows = conn.execute(text("""
+        SELECT ic.relname, pg_get_indexdef(ix.indexrelid)
+        FROM pg_index ix
+        JOIN pg_class ic ON ic.oid = ix.indexrelid
+        WHERE ix.indrelid = to_regclass(:table) AND NOT ix.indisprimary
+        ORDER BY ic.relname
+    """), {"table": table})
+    return [(name, definition) for name, definition in rows]
+
+
+def _foreign_keys(conn: Connection, table: str) -> List[tuple]:
+    rows = conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = to_regclass(:table) AND contype = 'f'
+    """), {"table": table})
+    return [(name, definition) for name, definition in rows]
+
+
+def _retarget_index(definition: str, old_name: str, new_name: str, table: str) -> str:
+    definition = definition.replace(f"INDEX {old_name} ON", f"INDEX {new_name} ON", 1)
+    return re.sub(r" ON (ONLY )?(public\.)?photos ", f" ON {table} ", definition, count=1)
+
+
+def prepare_migration(conn: Connection, months_ahead: int = PARTITION_MONTHS_AHEAD) -> dict:
+    """
+    移行ステップ1: 分割テーブル photos_p を作成し、photos への変更を同期するトリガーを張る
+
+    既存データの範囲と今後 months_ahead ヶ月分のパーティション、範囲外を受けるDEFAULTパーティションを作る。
+    """
+    conn.execute(text(f"""
+        CREATE TABLE {NEW_TABLE} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at)
+    """))
+    # パーティションキーを含めないと主キーにできない
+    conn.execute(text(f"ALTER TABLE {NEW_TABLE} ADD PRIMARY KEY (id, created_at)"))
+    for name, definition in _foreign_keys(conn, PARENT_TABLE):
+        conn.execute(text(f"ALTER TABLE {NEW_TABLE} ADD CONSTRAINT {name} {definition}"))
+
+    bounds = conn.execute(text(f"SELECT MIN(created_at), MAX(created_at) FROM {PARENT_TABLE}")).one()
+    today = datetime.now(timezone.utc).date()
+    first = month_start(bounds[0]) if bounds[0] else month_start(today)
+    last = add_months(month_start(today), months_ahead)
+    for month in iter_months(first, last):
+        conn.execute(text(partition_ddl(month, NEW_TABLE)))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {NEW_TABLE} DEFAULT"))
+
+    # 親に作ったインデックスは各パーティションのローカルインデックスになる
+    for name, definition in _index_definitions(conn, PARENT_TABLE):
+        conn.execute(text(_retarget_index(definition, name, f"{name}_p", NEW_TABLE)))
+
+    # 移行中の変更を photos_p に反映するトリガー
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {SYNC_TRIGGER}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {NEW_TABLE} WHERE id = OLD.id AND created_at = OLD.created_at;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {NEW_TABLE} SELECT (NEW).*;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER {SYNC_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON {PARENT_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION {SYNC_TRIGGER}()
+    """))
+    return {"first_month": first.isoformat(), "last_month": last.isoformat()}
+
+
+def copy_month(conn: Connection, month: date) -> int:
+    """移行ステップ2: 1ヶ月分の既存行を photos_p へコピー（トリガーで反映済みの行はスキップ）"""
+    result = conn.execute(text(f"""
+        INSERT INTO {NEW_TABLE}
+        SELECT * FROM {PARENT_TABLE}
+        WHERE created_at >= :start AND created_at < :end
+        ON CONFLICT DO NOTHING
+    """), {"start": month, "end": add_months(month, 1)})
+    return result.rowcount
+
+
+def swap_tables(conn: Connection) -> dict:
+    """
+    移行ステップ3: photos をロックして差分を整え、photos_p を photos に差し替える
+
+    旧テーブルは photos_legacy として残す（確認後に手動で削除する）。
+    """
+    conn.execute(text(f"LOCK TABLE {PARENT_TABLE} IN ACCESS EXCLUSIVE MODE"))
+    # コピー範囲外（DEFAULTパーティション行き）の行などを取りこぼさないよう補完
+    conn.execute(text(f"""
+        INSERT INTO {NEW_TABLE}
+        SELECT * FROM {PARENT_TABLE} p
+        WHERE NOT EXISTS (SELECT 1 FROM {NEW_TABLE} n WHERE n.id = p.id)
+    """))
+    # コピーとトリガーの競合で残った、既に削除済みの行を消す
+    removed = conn.execute(text(f"""
+        DELETE FROM {NEW_TABLE} n
+        WHERE NOT EXISTS (SELECT 1 FROM {PARENT_TABLE} p WHERE p.id = n.id)
+    """)).rowcount
+    counts = conn.execute(text(
+        f"SELECT (SELECT COUNT(*) FROM {PARENT_TABLE}), (SELECT COUNT(*) FROM {NEW_TABLE})"
+    )).one()
+    if counts[0] != counts[1]:
+        raise RuntimeError(f"行数が一致しません: {PARENT_TABLE}={counts[0]}, {NEW_TABLE}={counts[1]}")
+
+    conn.execute(text(f"DROP TRIGGER {SYNC_TRIGGER} ON {PARENT_TABLE}"))
+    conn.execute(text(f"DROP FUNCTION {SYNC_TRIGGER}()"))
+
+    legacy_indexes = [name for name, _ in _index_definitions(conn, PARENT_TABLE)]
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_TABLE}"))
+    conn.execute(text(f"ALTER INDEX IF EXISTS {PARENT_TABLE}_pkey RENAME TO {LEGACY_TABLE}_pkey"))
+    for name in legacy_indexes:
+        conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_legacy"))
+    conn.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO {PARENT_TABLE}"))
+    conn.execute(text(f"ALTER INDEX IF EXISTS {NEW_TABLE}_pkey RENAME TO {PARENT_TABLE}_pkey"))
+    for name in legacy_indexes:
+        conn.execute(text(f"ALTER INDEX IF EXISTS {name}_p RENAME TO {name}"))
+
+    # パーティション名も photos_pYYYYMM に揃える
+    for partition in list_partitions(conn, PARENT_TABLE):
+        new_name = partition["name"].replace(f"{NEW_TABLE}_p", f"{PARENT_TABLE}_p", 1)
+        if new_name != partition["name"]:
+            conn.execute(text(f"ALTER TABLE {partition['name']} RENAME TO {new_name}"))
+    return {"rows": counts[0], "removed_stale_rows": removed}
+
+
+# --- インデックスの作成・削除（マイグレーション用） ---
+
+def concurrent_index_ddl(name: str, columns: str, using: Optional[str] = None, where: Optional[str] = None,
+                         partitions: Optional[List[str]] = None, table: str = PARENT_TABLE) -> List[str]:
+    """
+    書き込みを止めずにインデックスを作るSQL（トランザクションの外で順に実行する）
+
+    分割テーブルの親には CONCURRENTLY が使えないため、親には ON ONLY で空のインデックスを作り、
+    各パーティションに CONCURRENTLY で作ってからアタッチする（全パーティションが揃うと有効になる）。
+    """
+    method = f" USING {using}" if using else ""
+    predicate = f" WHERE {where}" if where else ""
+    if partitions is None:
+        return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{method} ({columns}){predicate}"]
+    statements = [f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table}{method} ({columns}){predicate}"]
+    for partition in partitions:
+        child = f"{name}_{partition}"
+        statements.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition}{method} ({columns}){predicate}")
+        statements.append(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+    return statements
+
+
+def drop_index_ddl(name: str, partitioned: bool = False) -> str:
+    # 分割テーブルのインデックスは CONCURRENTLY で削除できない（パーティションのインデックスも一緒に消える）
+    if partitioned:
+        return f"DROP INDEX IF EXISTS {name}"
+    return f"DROP INDEX CONCURRENTLY IF EXISTS {name}"
+
+
+def invalid_indexes(conn: Connection, names: List[str]) -> List[str]:
+    """CONCURRENTLY の作成が途中で失敗して無効のまま残ったインデックス（分割テーブルの親は除く）"""
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relkind = 'i' AND c.relname = ANY(:names)
+    """), {"names": list(names)})
+    return [row[0] for row in rows]
@@ -0,0 +1,130 @@
+"""
+モバイルクライアント向けの差分同期
+
+写真の作成・更新は photos.change_seq、削除は photo_tombstones.change_seq に
+同じシーケンス（photo_change_seq）から採番するため、カーソル以降の変更だけを順に返せる。
+
+シーケンスは採番順にコミットされるとは限らないため、採番から SYNC_SETTLE_SECONDS 秒
+経過した変更だけを返す（それより長いトランザクションがない前提で取りこぼしを防ぐ）。
+トンボストーンは PHOTO_TOMBSTONE_RETENTION_DAYS 日で削除し、それより古いカーソルは
+410を返して全件再取得させる。
+"""
+import os
+from datetime import timedelta
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from models.database import Photo, PhotoTombstone, SyncState
+
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "5"))
+PHOTO_TOMBSTONE_RETENTION_DAYS = int(os.getenv("PHOTO_TOMBSTONE_RETENTION_DAYS", "30"))
+
+PURGED_THROUGH_KEY = "photo_tombstones_purged_through"
+
+PURGE_SQL = text("""
+WITH purged AS (
+    DELETE FROM photo_tombstones
+    WHERE deleted_at < now() - make_interval(days => :days)
+    RETURNING change_seq
+)
+INSERT INTO sync_state (name, value)
+SELECT :key, max(change_seq) FROM purged HAVING count(*) > 0
+ON CONFLICT (name) DO UPDATE SET value = GREATEST(sync_state.value, EXCLUDED.value)
+RETURNING value
+""")
+
+
+class CursorExpiredError(Exception):
+    """カーソルがトンボストーンの保持期間より古い"""
+
+
+def record_deletion(db: Session, photo: Photo):
+    """写真の削除を記録（削除と同じトランザクションで呼ぶ）"""
+    db.merge(PhotoTombstone(photo_id=photo.id, user_id=photo.user_id))
+
+
+def purged_through(db: Session) -> int:
+    value = db.query(SyncState.value).filter(SyncState.name == PURGED_THROUGH_KEY).scalar()
+    return value or 0
+
+
+def _settled():
+    return func.clock_timestamp() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+
+
+def changed_photos_query(db: Session, user_id: UUID, after: int, limit: int):
+    return db.query(Photo).filter(
+        Photo.user_id == user_id,
+        Photo.change_seq > after,
+        Photo.updated_at < _settled()
+    ).order_by(Photo.change_seq).limit(limit)
+
+
+def tombstones_query(db: Session, user_id: UUID, after: int, limit: int):
+    return db.query(PhotoTombstone.change_seq, PhotoTombstone.photo_id).filter(
+        PhotoTombstone.user_id == user_id,
+        PhotoTombstone.change_seq > after,
+        PhotoTombstone.deleted_at < _settled()
+    ).order_by(PhotoTombstone.change_seq).limit(limit)
+
+
+def get_changes(db: Session, user_id: UUID, cursor: Optional[int], limit: int) -> dict:
+    """
+    カーソル以降に作成・更新・削除されたユーザーの写真を change_seq 順に返す
+
+    cursor が None の場合は全件を先頭から返す（初回同期）。
+    """
+    if cursor is not None and cursor < purged_through(db):
+        raise CursorExpiredError("カーソルの有効期限が切れています。全件を再取得してください")
+
+    after = cursor or 0
+    photos = changed_photos_query(db, user_id, after, limit + 1).all()
+    tombstones = tombstones_query(db, user_id, after, limit + 1).all()
+
+    return merge_changes(
+        [(photo.change_seq, photo) for photo in photos],
+        [tuple(row) for row in tombstones],
+        after,
+        limit
+    )
+
+
+def merge_changes(photos: List[Tuple[int, object]], tombstones: List[Tuple[int, UUID]],
+                  after: int, limit: int) -> dict:
+    """作成・更新と削除の2つの変更列を change_seq 順にマージして limit 件で切る"""
+    events = sorted(
+        [(seq, photo, None) for seq, photo in photos]
+        + [(seq, None, photo_id) for seq, photo_id in tombstones],
+        key=lambda event: event[0]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    return {
+        "changes": [photo for _, photo, _ in events if photo is not None],
+        "deleted": [photo_id for _, _, photo_id in events if photo_id is not None],
+        "next_cursor": events[-1][0] if events else after,
+        "has_more": has_more,
+    }
+
+
+def purge_tombstones(db: Session, retention_days: int = PHOTO_TOMBSTONE_RETENTION_DAYS) -> Optional[int]:
+    """保持期間を過ぎたトンボストーンを削除し、削除済みの change_seq の上限を返す"""
+    return db.execute(PURGE_SQL, {"days": retention_days, "key": PURGED_THROUGH_KEY}).scalar()
+
+
+def run_purge_tombstones() -> Optional[str]:
+    """定期タスク用（専用のセッションで実行）"""
+    from database import SessionLocal, get_engine
+
+    get_engine()
+    db = SessionLocal()
+    try:
+        value = purge_tombstones(db)
+        db.commit()
+    finally:
+        db.close()
+    return f"トンボストーンを change_seq {value} まで削除しました" if value is not None else None
@@ -0,0 +1,136 @@
+"""
+タイムライン（撮影日ごとの写真数）の集計テーブル
+
+写真の追加・削除・公開範囲変更のたびに、同じトランザクション内で photo_timeline_days の
+(ユーザー, 公開範囲, 日) の件数を差分更新する。GET /photos/timeline はこの表を日・月・年にまとめるだけなので、
+ライブラリの写真数ではなく日数に比例する。日付は撮影日時（なければ作成日時）のUTCの日。
+ずれが生じた場合は rebuild で写真テーブルから作り直す（python -m jobs.rebuild_timeline）。
+"""
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import bindparam, func, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PGUUID, insert
+from sqlalchemy.orm import Session
+
+from models.database import PhotoTimelineDay
+from services import user_stats
+
+GRANULARITIES = ("day", "month", "year")
+
+# rebuild と同じ日付の決め方（Python側の photo_day と一致させる）
+DAY_SQL = "(COALESCE(taken_at, created_at) AT TIME ZONE 'UTC')::date"
+
+
+def _visibility_value(visibility) -> str:
+    return getattr(visibility, "value", visibility)
+
+
+def photo_day(taken_at: Optional[datetime], created_at: Optional[datetime] = None) -> date:
+    """写真を集計する日（撮影日時、なければ作成日時のUTCの日）"""
+    moment = taken_at or created_at
+    if moment is None:
+        # INSERT前で created_at がまだ決まっていない
+        return datetime.now(timezone.utc).date()
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.date()
+
+
+def _apply_deltas(db: Session, user_id: UUID, deltas: Dict[Tuple[str, date], int]):
+    table = PhotoTimelineDay.__table__
+    added = [
+        {"user_id": user_id, "visibility": visibility, "day": day, "photo_count": delta}
+        for (visibility, day), delta in sorted(deltas.items()) if delta > 0
+    ]
+    if added:
+        stmt = insert(PhotoTimelineDay).values(added)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.visibility, table.c.day],
+            set_={"photo_count": table.c.photo_count + stmt.excluded.photo_count}))
+    for (visibility, day), delta in sorted(deltas.items()):
+        if delta < 0:
+            # 行がなければ何もしない（0未満にはしない）
+            db.execute(
+                update(PhotoTimelineDay)
+                .where(table.c.user_id == user_id, table.c.visibility == visibility, table.c.day == day)
+                .values(photo_count=func.greatest(table.c.photo_count + delta, 0)))
+
+
+def record_photo_added(db: Session, photo):
+    """写真の追加を反映（コミット前に呼ぶ）"""
+    day = photo_day(photo.taken_at, photo.created_at)
+    _apply_deltas(db, photo.user_id, {(_visibility_value(photo.visibility), day): 1})
+
+
+def record_photos_added(db: Session, user_id: UUID, visibility, days: Iterable[date]):
+    """同じ公開範囲の写真をまとめて追加したことを反映（一括インポート用、コミット前に呼ぶ）"""
+    visibility = _visibility_value(visibility)
+    _apply_deltas(db, user_id, {(visibility, day): n for day, n in Counter(days).items()})
+
+
+def record_photo_removed(db: Session, photo):
+    """写真の削除を反映（コミット前に呼ぶ）"""
+    day = photo_day(photo.taken_at, photo.created_at)
+    _apply_deltas(db, photo.user_id, {(_visibility_value(photo.visibility), day): -1})
+
+
+def record_visibility_changed(db: Session, photo, old_visibility, new_visibility):
+    """公開範囲の変更を反映（コミット前に呼ぶ）"""
+    old_value, new_value = _visibility_value(old_visibility), _visibility_value(new_visibility)
+    if old_value == new_value:
+        return
+    day = photo_day(photo.taken_at, photo.created_at)
+    _apply_deltas(db, photo.user_id, {(old_value, day): -1, (new_value, day): 1})
+
+
+HISTOGRAM_SQL = text("""
+SELECT date_trunc(:granularity, day::timestamp)::date AS period, SUM(photo_count)::bigint AS count
+FROM photo_timeline_days
+WHERE user_id = :user_id AND photo_count > 0
+  AND (CAST(:visibility AS VARCHAR) IS NULL OR visibility = :visibility)
+GROUP BY 1
+ORDER BY 1
+""")
+
+
+def histogram(db: Session, user_id: UUID, granularity: str = "day", visibility=None) -> List[dict]:
+    """期間ごとの写真数（古い順、写真のない期間は含まない）"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity は {', '.join(GRANULARITIES)} のいずれかです")
+    rows = db.execute(HISTOGRAM_SQL, {
+        "granularity": granularity,
+        "user_id": user_id,
+        "visibility": _visibility_value(visibility) if visibility is not None else None,
+    })
+    return [{"period": row.period, "count": row.count} for row in rows]
+
+
+REBUILD_DELETE_SQL = text(
+    "DELETE FROM photo_timeline_days WHERE user_id = ANY(:user_ids)"
+).bindparams(bindparam("user_ids", type_=ARRAY(PGUUID(as_uuid=True))))
+
+REBUILD_INSERT_SQL = text(f"""
+INSERT INTO photo_timeline_days (user_id, visibility, day, photo_count)
+SELECT user_id, visibility::text, {DAY_SQL}, COUNT(*)
+FROM photos
+WHERE user_id = ANY(:user_ids)
+GROUP BY 1, 2, 3
+""").bindparams(bindparam("user_ids", type_=ARRAY(PGUUID(as_uuid=True))))
+
+
+def rebuild(db: Session, user_ids: Iterable[UUID]) -> int:
+    """
+    指定ユーザーの集計を写真テーブルから作り直し、行数を返す（コミットは呼び出し側）
+
+    写真の追加・削除は先に user_stats の行を更新するので、その行をロックしておけば
+    作り直している間の差分更新は待たされ、取りこぼしや二重計上にならない。
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    db.execute(user_stats.LOCK_SQL, {"user_ids": user_ids})
+    db.execute(REBUILD_DELETE_SQL, {"user_ids": user_ids})
+    return db.execute(REBUILD_INSERT_SQL, {"user_ids": user_ids}).rowcount
@@ -0,0 +1,101 @@
+"""
+一覧表示用のプレースホルダー
+
+画像本体のダウンロード前にグリッドを描画できるよう、アップロード時に
+BlurHash文字列（https://blurha.sh 互換）と代表色を計算する。
+"""
+import math
+from typing import List, Sequence, Tuple
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+# BlurHashの計算に使う縮小画像の長辺（成分数が少ないので32pxで十分）
+PLACEHOLDER_SIZE = 32
+
+
+def _encode83(value: int, length: int) -> str:
+    result = ""
+    for i in range(1, length + 1):
+        digit = (value // 83 ** (length - i)) % 83
+        result += _BASE83[digit]
+    return result
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash_encode(pixels: Sequence[Tuple[int, int, int]], width: int, height: int,
+                    components_x: int = 4, components_y: int = 3) -> str:
+    """RGB画素列（行優先）からBlurHash文字列を計算"""
+    if not 1 <= components_x <= 9 or not 1 <= components_y <= 9:
+        raise ValueError("BlurHashの成分数は1〜9です")
+
+    linear = [(_srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)) for r, g, b in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(components_x)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(components_y)]
+
+    factors: List[Tuple[float, float, float]] = []
+    for j in range(components_y):
+        for i in range(components_x):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                cy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((components_x - 1) + (components_y - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        result += _encode83(0, 1)
+
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        quant = [max(0, min(18, int(math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5)))) for v in factor]
+        result += _encode83(quant[0] * 19 * 19 + quant[1] * 19 + quant[2], 2)
+    return result
+
+
+def dominant_color(image) -> str:
+    """縮小画像の最頻色（減色後）を #rrggbb で返す"""
+    from PIL import Image
+
+    quantized = image.convert("RGB").quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    r, g, b = palette[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def compute_placeholder(image) -> Tuple[str, str]:
+    """表示向きに補正済みのPIL画像から (BlurHash, 代表色) を計算"""
+    small = image.convert("RGB")
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    width, height = small.size
+    return blurhash_encode(list(small.getdata()), width, height), dominant_color(small)
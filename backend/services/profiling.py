@@ -0,0 +1,374 @@
+"""
+リクエスト単位のサンプリングプロファイラ（本番での調査用）
+
+PROFILING_ENABLED=true のときだけミドルウェアを登録する（無効時は何も追加されずオーバーヘッドはない）。
+次のリクエストを PROFILING_INTERVAL_MS ごとにサンプリングし、呼び出しツリーを PROFILING_DIR に保存する。
+- ADMIN_USER_IDS のユーザーが `X-Profile: 1` を付けたリクエスト
+- PROFILING_SAMPLE_RATE の割合で選ばれたリクエスト
+
+サンプルはウォールクロック時間で、そのリクエストの処理がどこにいたかを記録する。
+- イベントループ上で実行中: そのスレッドのスタック
+- スレッドプールで実行中（同期ルート・run_in_threadpool）: ワーカースレッドのスタック（[thread] の下）
+- await で待機中: コルーチンの await の連鎖（末尾が [await]）
+
+保存形式は折りたたみスタック（flamegraph.pl・speedscope でそのまま開ける）。
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextvars import Context, ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import anyio
+
+from services.metrics import registry
+
+logger = logging.getLogger("profiling")
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "photo-profiles"))
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "200"))
+PROFILE_HEADER = b"x-profile"
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+profiles_recorded = registry.counter("profiles_total", "保存したリクエストのプロファイル", ["trigger"])
+
+_active: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+
+def _worker_run_code():
+    # anyio のワーカースレッドは context.run(func) で処理を実行するので、
+    # そのフレームの context からどのリクエストの処理かを判別できる
+    try:
+        from anyio._backends._asyncio import WorkerThread
+        return WorkerThread.run.__code__
+    except (ImportError, AttributeError):
+        return None
+
+
+_WORKER_RUN_CODE = _worker_run_code()
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_BASE_DIR + os.sep):
+        filename = os.path.relpath(filename, _BASE_DIR)
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    name = getattr(code, "co_qualname", code.co_name)
+    # 折りたたみ形式の区切り文字は使えない
+    return f"{name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _thread_stack(frame) -> list:
+    """フレームから外側に向かってたどり、外側→内側の順にする"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro) -> list:
+    """待機中のコルーチンの await の連鎖（外側→内側）"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def _from_root(frames: list, root) -> Optional[list]:
+    for i, frame in enumerate(frames):
+        if frame is root:
+            return frames[i + 1:]
+    return None
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, trigger: str, root_frame, task, loop_thread: int):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.root_frame = root_frame
+        self.task = task
+        self.loop_thread = loop_thread
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        # サンプラースレッドが stacks を更新している間に保存しないよう、読み書きはこのロックの下で行う
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def _add(self, labels: List[str]):
+        if not labels:
+            return
+        stack = ";".join(labels)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def sample(self, thread_frames: dict, workers: Dict[int, Context]):
+        """1回分のサンプル（サンプラースレッドから呼ばれる）"""
+        with self._lock:
+            if not self._finished:
+                self._sample(thread_frames, workers)
+
+    def finish(self, duration_ms: float):
+        """計測を終える（実行中のサンプルの完了を待ち、以降のサンプルは捨てる）"""
+        with self._lock:
+            self._finished = True
+            self.duration_ms = duration_ms
+
+    def _sample(self, thread_frames: dict, workers: Dict[int, Context]):
+        self.samples += 1
+        loop_frame = thread_frames.get(self.loop_thread)
+        if loop_frame is not None:
+            running = _from_root(_thread_stack(loop_frame), self.root_frame)
+            if running is not None:
+                self._add([frame_label(f) for f in running])
+                return
+
+        awaiting = _from_root(_await_chain(self.task.get_coro()), self.root_frame) or []
+        prefix = [frame_label(f) for f in awaiting]
+        in_thread = False
+        for thread_id, context in workers.items():
+            if context.get(_active) is not self:
+                continue
+            frames = _thread_stack(thread_frames[thread_id])
+            for i, frame in enumerate(frames):
+                if frame.f_code is _WORKER_RUN_CODE:
+                    self._add(prefix + ["[thread]"] + [frame_label(f) for f in frames[i + 1:]])
+                    in_thread = True
+                    break
+        if not in_thread:
+            self._add(prefix + ["[await]"])
+
+    def folded(self) -> str:
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples = self.samples
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "samples": samples,
+            "interval_ms": PROFILING_INTERVAL_MS,
+        }
+
+
+def _find_workers(thread_frames: dict) -> Dict[int, Context]:
+    """処理を実行中のanyioワーカースレッドと、その処理のコンテキスト"""
+    workers = {}
+    if _WORKER_RUN_CODE is None:
+        return workers
+    for thread_id, frame in thread_frames.items():
+        while frame is not None:
+            if frame.f_code is _WORKER_RUN_CODE:
+                context = frame.f_locals.get("context")
+                if isinstance(context, Context):
+                    workers[thread_id] = context
+                break
+            frame = frame.f_back
+    return workers
+
+
+class Sampler:
+    """プロファイル中のリクエストがある間だけ動くサンプリングスレッド"""
+
+    def __init__(self, interval_ms: float = PROFILING_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wake.clear()
+            if not profiles:
+                self._wake.wait()
+                continue
+            thread_frames = sys._current_frames()
+            thread_frames.pop(me, None)
+            workers = _find_workers(thread_frames)
+            for profile in profiles:
+                try:
+                    profile.sample(thread_frames, workers)
+                except Exception:
+                    # 他スレッドのフレームは実行中に変わるので、まれに読めないサンプルは捨てる
+                    pass
+            del thread_frames, workers
+            time.sleep(self.interval)
+
+
+class ProfileStore:
+    """プロファイルのファイル（{id}.folded とメタデータの {id}.json）"""
+
+    def __init__(self, root: str = PROFILING_DIR, max_profiles: int = PROFILING_MAX_PROFILES):
+        self.root = root
+        self.max_profiles = max_profiles
+
+    def save(self, profile: RequestProfile):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, f"{profile.id}.folded"), "w", encoding="utf-8") as f:
+            f.write(profile.folded())
+        with open(os.path.join(self.root, f"{profile.id}.json"), "w", encoding="utf-8") as f:
+            json.dump(profile.summary(), f, ensure_ascii=False)
+        self._prune()
+
+    def _prune(self):
+        summaries = self.list()
+        for summary in summaries[self.max_profiles:]:
+            self.delete(summary["id"])
+
+    def list(self) -> List[dict]:
+        """新しい順"""
+        summaries = []
+        if not os.path.isdir(self.root):
+            return summaries
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name), encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        summaries.sort(key=lambda s: s["started_at"], reverse=True)
+        return summaries
+
+    def folded_path(self, profile_id: str) -> Optional[str]:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.root, f"{profile_id}.folded")
+        return path if os.path.exists(path) else None
+
+    def delete(self, profile_id: str):
+        for suffix in (".folded", ".json"):
+            try:
+                os.unlink(os.path.join(self.root, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def admin_requested(scope) -> bool:
+    """X-Profile ヘッダーがあり、Bearerトークンが管理者のものか"""
+    headers = dict(scope.get("headers", []))
+    if headers.get(PROFILE_HEADER, b"").strip() not in (b"1", b"true"):
+        return False
+    from auth.auth_service import AuthService, is_admin
+
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = AuthService.verify_access_token(token.strip())
+    except Exception:
+        return False
+    return is_admin(payload.get("sub"))
+
+
+sampler = Sampler()
+store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """対象のリクエストだけサンプリングし、終了後に保存するASGIミドルウェア"""
+
+    def __init__(self, app, sample_rate: float = PROFILING_SAMPLE_RATE, sampler: Sampler = sampler,
+                 store: ProfileStore = store):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.sampler = sampler
+        self.store = store
+
+    def _trigger(self, scope) -> Optional[str]:
+        if admin_requested(scope):
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger, sys._getframe(),
+                                 asyncio.current_task(), threading.get_ident())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = _active.set(profile)
+        self.sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.sampler.remove(profile)
+            _active.reset(token)
+            # サンプラーがリストを取り出した後の周回で sample() 中のことがあるので、終わるのを待ってから保存する
+            profile.finish(round((time.perf_counter() - profile.started) * 1000, 2))
+            profiles_recorded.inc(trigger=trigger)
+            try:
+                await anyio.to_thread.run_sync(self.store.save, profile)
+            except OSError as e:
+                logger.warning("プロファイルを保存できませんでした: %s", e)
@@ -0,0 +1,254 @@
+"""
+開発用のSQL診断モード
+
+QUERY_DIAGNOSTICS=true のとき有効になり、以下を行う。
+- SLOW_QUERY_MS を超えたSQLをバインドパラメータ付きで構造化ログに出力
+- そのSQLの EXPLAIN (ANALYZE, BUFFERS) を別スレッド・別接続で取得（Seq Scanを検出）
+- 1リクエスト内で同じ形のSQLが N_PLUS_ONE_THRESHOLD 回を超えたらN+1として記録
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("query_diagnostics")
+
+ENABLED = os.getenv("QUERY_DIAGNOSTICS", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+EXPLAIN_ENABLED = os.getenv("QUERY_DIAGNOSTICS_EXPLAIN", "true").lower() in ("1", "true", "yes")
+# 同じ形のSQLのEXPLAINはこの秒数に1回まで
+EXPLAIN_INTERVAL_S = float(os.getenv("QUERY_DIAGNOSTICS_EXPLAIN_INTERVAL", "60"))
+EXPLAIN_TIMEOUT_MS = int(os.getenv("QUERY_DIAGNOSTICS_EXPLAIN_TIMEOUT_MS", "10000"))
+HISTORY_SIZE = 200
+MAX_PARAM_LENGTH = 200
+
+# EXPLAIN用の接続自体は計測対象にしない
+SKIP_OPTION = "query_diagnostics_skip"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*(?:[^()]|\([^()]*\))*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """リテラルやINリストの要素数の違いを無視したSQLの「形」"""
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def _is_explainable(statement: str) -> bool:
+    head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return head in ("SELECT", "WITH")
+
+
+def _safe_params(parameters) -> object:
+    """ログ出力用にパラメータを短い文字列へ変換"""
+    def shorten(value):
+        text = repr(value)
+        return text if len(text) <= MAX_PARAM_LENGTH else text[:MAX_PARAM_LENGTH] + "..."
+
+    if isinstance(parameters, dict):
+        return {str(k): shorten(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [shorten(v) for v in parameters]
+    return shorten(parameters)
+
+
+def find_seq_scans(plan: dict) -> List[str]:
+    """EXPLAIN (FORMAT JSON) のプランからSeq Scanしているテーブル名を列挙"""
+    found = []
+    node = plan.get("Plan", plan)
+    if node.get("Node Type") == "Seq Scan":
+        found.append(node.get("Relation Name", "?"))
+    for child in node.get("Plans", []):
+        found.extend(find_seq_scans(child))
+    return found
+
+
+class _RequestState:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.shapes: Counter = Counter()
+        self.samples: Dict[str, str] = {}
+
+
+_request: ContextVar[Optional[_RequestState]] = ContextVar("query_diagnostics_request", default=None)
+
+
+class QueryDiagnostics:
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD,
+                 explain: bool = EXPLAIN_ENABLED):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.explain = explain
+        self.slow_queries: Deque[dict] = deque(maxlen=HISTORY_SIZE)
+        self.n_plus_one: Deque[dict] = deque(maxlen=HISTORY_SIZE)
+        self._explained_at: Dict[str, float] = {}
+        self._explain_queue: "queue.Queue" = queue.Queue(maxsize=100)
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # --- SQLAlchemyフック ---
+
+    def instrument_engine(self, engine: Engine):
+        if event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            return
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("diagnostics_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("diagnostics_query_start")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        if context is not None and context.execution_options.get(SKIP_OPTION):
+            return
+
+        shape = normalize_statement(statement)
+        state = _request.get()
+        if state is not None:
+            state.shapes[shape] += 1
+            state.samples.setdefault(shape, statement)
+
+        if elapsed_ms >= self.slow_query_ms:
+            self._record_slow_query(conn.engine, statement, parameters, shape, elapsed_ms, state)
+
+    # --- 遅いクエリ ---
+
+    def _record_slow_query(self, engine, statement, parameters, shape, elapsed_ms, state):
+        record = {
+            "event": "slow_query",
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(elapsed_ms, 2),
+            "route": f"{state.method} {state.path}" if state else None,
+            "statement": statement,
+            "parameters": _safe_params(parameters),
+            "explain": None,
+            "seq_scans": None,
+        }
+        self.slow_queries.append(record)
+        logger.warning(json.dumps(record, ensure_ascii=False, default=str))
+
+        if self.explain and _is_explainable(statement) and self._should_explain(shape):
+            try:
+                self._explain_queue.put_nowait((engine, statement, parameters, record))
+                self._ensure_worker()
+            except queue.Full:
+                pass
+
+    def _should_explain(self, shape: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained_at.get(shape)
+            if last is not None and now - last < EXPLAIN_INTERVAL_S:
+                return False
+            self._explained_at[shape] = now
+            return True
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._explain_loop, name="query-explain", daemon=True)
+                self._worker.start()
+
+    def _explain_loop(self):
+        while True:
+            engine, statement, parameters, record = self._explain_queue.get()
+            try:
+                plan = self.run_explain(engine, statement, parameters)
+                record["explain"] = plan
+                record["seq_scans"] = find_seq_scans(plan)
+                logger.warning(json.dumps({
+                    "event": "slow_query_explain",
+                    "statement": statement,
+                    "seq_scans": record["seq_scans"],
+                    "total_cost": plan.get("Plan", {}).get("Total Cost"),
+                    "execution_time_ms": plan.get("Execution Time"),
+                }, ensure_ascii=False, default=str))
+            except Exception as e:
+                record["explain"] = {"error": str(e)}
+            finally:
+                self._explain_queue.task_done()
+
+    @staticmethod
+    def run_explain(engine: Engine, statement: str, parameters) -> dict:
+        """別接続でEXPLAIN (ANALYZE, BUFFERS)を実行（結果はロールバック）"""
+        with engine.connect().execution_options(**{SKIP_OPTION: True}) as conn:
+            try:
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                result = conn.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+                ).scalar()
+            finally:
+                conn.rollback()
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]
+
+    # --- N+1検出 ---
+
+    def finish_request(self, state: _RequestState):
+        for shape, count in state.shapes.items():
+            if count > self.n_plus_one_threshold:
+                record = {
+                    "event": "n_plus_one",
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "route": f"{state.method} {state.path}",
+                    "count": count,
+                    "statement": state.samples[shape],
+                }
+                self.n_plus_one.append(record)
+                logger.warning(json.dumps(record, ensure_ascii=False))
+
+    def snapshot(self) -> dict:
+        return {
+            "config": {
+                "slow_query_ms": self.slow_query_ms,
+                "n_plus_one_threshold": self.n_plus_one_threshold,
+                "explain": self.explain,
+            },
+            "slow_queries": list(self.slow_queries),
+            "n_plus_one": list(self.n_plus_one),
+        }
+
+
+diagnostics = QueryDiagnostics()
+
+
+class QueryDiagnosticsMiddleware:
+    """リクエスト単位でSQLの形を集計するASGIミドルウェア"""
+
+    def __init__(self, app, diagnostics: QueryDiagnostics = diagnostics):
+        self.app = app
+        self.diagnostics = diagnostics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = _RequestState(scope["method"], scope["path"])
+        token = _request.set(state)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request.reset(token)
+            self.diagnostics.finish_request(state)
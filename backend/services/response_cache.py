@@ -0,0 +1,205 @@
+"""
+未認証ユーザー向けレスポンスキャッシュ
+
+未認証の写真一覧は同じクエリパラメータなら誰が呼んでも同じ結果になるため、
+シリアライズ済みのJSONを短いTTLでキャッシュする。
+
+- キー: キャッシュ名 + 世代番号 + 正規化したクエリパラメータ
+- 無効化: 公開・限定公開の写真が追加・更新・削除されたら世代番号を進める
+- 同時ミス: 同じキーの計算は1回だけ行い、他のリクエストはその結果を待つ
+- バックエンド: プロセス内（既定）または Redis（RESPONSE_CACHE_BACKEND=redis、複数ワーカー用）
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+from services.metrics import registry
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "10"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# 未認証ユーザーから見える公開範囲（これらの写真が変わったら無効化する）
+ANONYMOUS_VISIBLE = ("public", "unlisted")
+
+cache_requests = registry.counter(
+    "response_cache_requests_total", "レスポンスキャッシュの参照結果（hit/miss/coalesced）", ["cache", "result"])
+cache_invalidations = registry.counter(
+    "response_cache_invalidations_total", "レスポンスキャッシュの無効化回数", ["cache"])
+
+
+class InProcessBackend:
+    """
+    プロセス内のTTL付きLRU
+
+    無効化でエントリを捨てられるよう名前空間ごとにキーを索引する。世代番号も max_entries 件までのLRUで、
+    追い出した名前空間には追い出した中で最大の世代を返す（世代は減らないので、古い世代のキーが再び使われることはない）。
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, bytes, Optional[str]]]" = OrderedDict()
+        self._keys_by_namespace: Dict[str, Set[str]] = {}
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._next_generation = 1
+        self._evicted_generation = 0
+        self._lock = threading.Lock()
+
+    def _delete(self, key: str):
+        _, _, namespace = self._entries.pop(key)
+        keys = self._keys_by_namespace.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_namespace[namespace]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, _ = entry
+            if expires_at < time.monotonic():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float, namespace: Optional[str] = None):
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = (time.monotonic() + ttl, value, namespace)
+            if namespace is not None:
+                self._keys_by_namespace.setdefault(namespace, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)))
+
+    def generation(self, namespace: str) -> int:
+        with self._lock:
+            return self._generations.get(namespace, self._evicted_generation)
+
+    def bump_generation(self, namespace: str):
+        with self._lock:
+            # 世代はプロセス内で単調増加の番号を使う（追い出し後に同じ番号を返さないため）
+            self._generations[namespace] = self._next_generation
+            self._next_generation += 1
+            self._generations.move_to_end(namespace)
+            while len(self._generations) > self.max_entries:
+                _, evicted = self._generations.popitem(last=False)
+                self._evicted_generation = max(self._evicted_generation, evicted)
+            # 古い世代のエントリは参照されないので捨てる
+            for key in self._keys_by_namespace.pop(namespace, ()):
+                del self._entries[key]
+
+
+class RedisBackend:
+    """複数ワーカーで共有するRedisバックエンド（redisパッケージが必要）"""
+
+    def __init__(self, url: str = RESPONSE_CACHE_REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis には redis パッケージが必要です（pip install redis）")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(f"response_cache:{key}")
+
+    def set(self, key: str, value: bytes, ttl: float, namespace: Optional[str] = None):
+        self._client.set(f"response_cache:{key}", value, px=int(ttl * 1000))
+
+    def generation(self, namespace: str) -> int:
+        value = self._client.get(f"response_cache_generation:{namespace}")
+        return int(value) if value else 0
+
+    def bump_generation(self, namespace: str):
+        self._client.incr(f"response_cache_generation:{namespace}")
+
+
+def normalize_params(params: dict) -> str:
+    """Noneを除き、キー順に並べたクエリ文字列"""
+    items = []
+    for key in sorted(params):
+        value = params[key]
+        if value is None:
+            continue
+        items.append((key, getattr(value, "value", value)))
+    return urlencode(items)
+
+
+class ResponseCache:
+    def __init__(self, name: str, backend=None, ttl: float = RESPONSE_CACHE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self._backend = backend
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = _default_backend()
+        return self._backend
+
+    def _key(self, params: dict) -> str:
+        return f"{self.name}:{self.backend.generation(self.name)}:{normalize_params(params)}"
+
+    async def get_or_compute(self, params: dict, compute: Callable[[], Awaitable[bytes]]) -> Tuple[bytes, str]:
+        """キャッシュ済みの値、なければ compute() の結果を返す（値, HIT/MISS）"""
+        key = self._key(params)
+        value = self.backend.get(key)
+        if value is not None:
+            cache_requests.inc(cache=self.name, result="hit")
+            return value, "HIT"
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # 同じキーを計算中のリクエストがあればその結果を待つ
+            cache_requests.inc(cache=self.name, result="coalesced")
+            return await asyncio.shield(inflight), "HIT"
+
+        cache_requests.inc(cache=self.name, result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            self.backend.set(key, value, self.ttl, namespace=self.name)
+            future.set_result(value)
+            return value, "MISS"
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 待機者がいなくても警告を出さない
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self):
+        self.backend.bump_generation(self.name)
+        cache_invalidations.inc(cache=self.name)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _default_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = RedisBackend() if RESPONSE_CACHE_BACKEND == "redis" else InProcessBackend()
+    return _backend
+
+
+feed_cache = ResponseCache("photo_feed")
+
+
+def invalidate_public_photo(*visibilities):
+    """未認証ユーザーから見える写真が変わった場合にキャッシュを無効化"""
+    if any(getattr(v, "value", v) in ANONYMOUS_VISIBLE for v in visibilities if v is not None):
+        feed_cache.invalidate()
@@ -0,0 +1,232 @@
+"""
+再開可能なアップロード（tus方式）
+
+アップロードセッションごとに UPLOAD_SPOOL_DIR/<upload_id>/ を作り、
+- data: 受信済みのバイト列（オフセット順に追記）
+- meta.json: 総サイズ・受信済みオフセット・チャンクごとのSHA-256・写真のメタデータ
+を保存する。通信が切れてもHEADで受信済みオフセットを確認し、残りだけを送り直せばよい。
+同じホストの複数ワーカーで共有できるよう、セッションの更新はファイルロックで直列化する。
+UPLOAD_SESSION_TTL_HOURS 時間更新のないセッションは定期タスクで削除する。
+"""
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "photo-uploads"))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+# 完了処理中のまま残ったセッション（ワーカーの異常終了など）を再度完了できるまでの秒数
+FINALIZE_TIMEOUT_SECONDS = 300
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """アップロードセッションの操作エラー（status_code はHTTPステータス）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    """Upload-Checksum ヘッダー（"sha256 <base64>"）からダイジェストを取り出す"""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise UploadError(400, "Upload-Checksum は sha256 のみ対応しています")
+    try:
+        return base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError(400, "Upload-Checksum の値が不正です")
+
+
+class UploadSpool:
+    def __init__(self, root: str = UPLOAD_SPOOL_DIR, ttl_hours: float = UPLOAD_SESSION_TTL_HOURS):
+        self.root = root
+        self.ttl_seconds = ttl_hours * 3600
+
+    def _dir(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise UploadError(404, "アップロードが見つかりません")
+        return os.path.join(self.root, upload_id)
+
+    def _read_meta(self, directory: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError(404, "アップロードが見つかりません")
+
+    def _write_meta(self, directory: str, meta: Dict[str, Any]):
+        # 書き込み途中で落ちても壊れないよう、一時ファイルから置き換える
+        path = os.path.join(directory, "meta.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _locked(self, upload_id: str, user_id: str):
+        """セッションをロックして meta を返す（所有者以外には存在しないものとして扱う）"""
+        directory = self._dir(upload_id)
+        try:
+            lock = open(os.path.join(directory, "lock"), "a")
+        except FileNotFoundError:
+            raise UploadError(404, "アップロードが見つかりません")
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            meta = self._read_meta(directory)
+            if meta["user_id"] != user_id:
+                raise UploadError(404, "アップロードが見つかりません")
+            yield directory, meta
+
+    def create(self, user_id: str, length: int, filename: str, content_type: Optional[str],
+               photo: Dict[str, Any]) -> Dict[str, Any]:
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, upload_id)
+        os.makedirs(directory, exist_ok=False)
+        open(os.path.join(directory, "data"), "wb").close()
+        open(os.path.join(directory, "lock"), "w").close()
+        now = time.time()
+        meta = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "length": length,
+            "offset": 0,
+            "filename": filename,
+            "content_type": content_type,
+            "photo": photo,
+            "chunks": [],
+            "photo_id": None,
+            "finalizing_at": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._write_meta(directory, meta)
+        return meta
+
+    def get(self, upload_id: str, user_id: str) -> Dict[str, Any]:
+        meta = self._read_meta(self._dir(upload_id))
+        if meta["user_id"] != user_id:
+            raise UploadError(404, "アップロードが見つかりません")
+        return meta
+
+    def expires_at(self, meta: Dict[str, Any]) -> float:
+        return meta["updated_at"] + self.ttl_seconds
+
+    def append(self, upload_id: str, user_id: str, offset: int, data: bytes,
+               checksum: Optional[bytes] = None) -> Dict[str, Any]:
+        """オフセットの位置にチャンクを追記し、更新後の meta を返す"""
+        digest = hashlib.sha256(data).digest()
+        if checksum is not None and checksum != digest:
+            # tusのチェックサム拡張に合わせて460を返す
+            raise UploadError(460, "チャンクのチェックサムが一致しません")
+
+        with self._locked(upload_id, user_id) as (directory, meta):
+            if meta["photo_id"]:
+                raise UploadError(409, "このアップロードは完了しています")
+            if offset != meta["offset"]:
+                raise UploadError(409, f"Upload-Offset が受信済みのオフセット（{meta['offset']}）と一致しません")
+            if offset + len(data) > meta["length"]:
+                raise UploadError(413, "宣言したサイズを超えています")
+            if not data:
+                return meta
+
+            with open(os.path.join(directory, "data"), "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            meta["chunks"].append({"offset": offset, "length": len(data), "sha256": digest.hex()})
+            meta["offset"] = offset + len(data)
+            meta["updated_at"] = time.time()
+            self._write_meta(directory, meta)
+            return meta
+
+    def begin_finalize(self, upload_id: str, user_id: str) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        """
+        完了処理を開始する
+
+        完了済みなら (meta, None) を返す。未完了なら全チャンクのチェックサムを再確認して
+        (meta, 内容) を返す。同じセッションの完了処理が並行して走らないようにする。
+        """
+        with self._locked(upload_id, user_id) as (directory, meta):
+            if meta["photo_id"]:
+                return meta, None
+            if meta["offset"] != meta["length"]:
+                raise UploadError(409, f"未受信のデータがあります（{meta['offset']}/{meta['length']}バイト）")
+            if meta.get("finalizing_at") and time.time() - meta["finalizing_at"] < FINALIZE_TIMEOUT_SECONDS:
+                raise UploadError(409, "このアップロードは完了処理中です")
+            with open(os.path.join(directory, "data"), "rb") as f:
+                content = f.read()
+            meta["finalizing_at"] = time.time()
+            self._write_meta(directory, meta)
+        for chunk in meta["chunks"]:
+            part = content[chunk["offset"]:chunk["offset"] + chunk["length"]]
+            if hashlib.sha256(part).hexdigest() != chunk["sha256"]:
+                self.abort_finalize(upload_id, user_id)
+                raise UploadError(500, "保存済みのデータが破損しています。アップロードをやり直してください")
+        return meta, content
+
+    def abort_finalize(self, upload_id: str, user_id: str):
+        """完了処理が失敗した場合に、再度完了できる状態に戻す"""
+        with self._locked(upload_id, user_id) as (directory, meta):
+            meta["finalizing_at"] = None
+            self._write_meta(directory, meta)
+
+    def mark_finalized(self, upload_id: str, user_id: str, photo_id: str):
+        """完了した写真のIDを記録（完了処理の再送には同じ写真を返す）。データは不要になるので消す"""
+        with self._locked(upload_id, user_id) as (directory, meta):
+            meta["photo_id"] = photo_id
+            meta["finalizing_at"] = None
+            meta["updated_at"] = time.time()
+            self._write_meta(directory, meta)
+            with open(os.path.join(directory, "data"), "wb"):
+                pass
+
+    def delete(self, upload_id: str, user_id: str):
+        with self._locked(upload_id, user_id) as (directory, _):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def collect_garbage(self) -> int:
+        """期限切れのセッションを削除し、削除した数を返す"""
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for upload_id in os.listdir(self.root):
+            directory = os.path.join(self.root, upload_id)
+            try:
+                # 作成途中（meta.jsonがまだない）のセッションはディレクトリの更新時刻で判断する
+                meta_path = os.path.join(directory, "meta.json")
+                updated = os.path.getmtime(meta_path if os.path.exists(meta_path) else directory)
+            except OSError:
+                continue
+            if updated < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+spool = UploadSpool()
+
+
+def run_collect_garbage() -> Optional[str]:
+    """定期タスク用"""
+    removed = spool.collect_garbage()
+    return f"期限切れのアップロードセッションを{removed}件削除しました" if removed else None
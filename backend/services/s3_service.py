@@ -1,24 +1,92 @@
-import boto3
 import os
+import threading
 from botocore.exceptions import ClientError
 from fastapi import HTTPException
 import uuid
 from typing import Optional
 import mimetypes
 
+from services.metrics import track
+
 
 class S3Service:
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION', 'ap-northeast-1')
-        )
-        self.bucket_name = os.getenv('S3_BUCKET_NAME')
-
-        if not self.bucket_name:
-            raise ValueError("S3_BUCKET_NAME environment variable is required")
+        # boto3のインポートとクライアント生成は初回利用時まで遅延させる
+        self._s3_client = None
+        self._bucket_name: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        """共有のS3クライアント（スレッドセーフなので全リクエストで使い回す）"""
+        if self._s3_client is None:
+            with self._lock:
+                if self._s3_client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    self._s3_client = boto3.client(
+                        's3',
+                        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                        region_name=os.getenv('AWS_REGION', 'ap-northeast-1'),
+                        config=Config(max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '10')))
+                    )
+        return self._s3_client
+
+    @s3_client.setter
+    def s3_client(self, client):
+        self._s3_client = client
+
+    @property
+    def bucket_name(self) -> str:
+        if self._bucket_name is None:
+            bucket_name = os.getenv('S3_BUCKET_NAME')
+            if not bucket_name:
+                raise ValueError("S3_BUCKET_NAME environment variable is required")
+            self._bucket_name = bucket_name
+        return self._bucket_name
+
+    def object_url(self, key: str) -> str:
+        """photos.s3_key に保存する形式のURL"""
+        return f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION', 'ap-northeast-1')}.amazonaws.com/{key}"
+
+    @staticmethod
+    def key_from_url(s3_url: str) -> str:
+        """保存されているURL（またはキー）からS3キーを取り出す"""
+        if '/photos/' in s3_url:
+            return 'photos/' + s3_url.split('/photos/')[-1]
+        # すでにキーの場合
+        return s3_url
+
+    def get_image_bytes(self, s3_url: str) -> bytes:
+        """画像本体を取得（バックフィル等のジョブ用）"""
+        with track("storage", "get_object"):
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key_from_url(s3_url))
+            return response["Body"].read()
+
+    def get_object_range(self, key: str, start: int, end: int) -> bytes:
+        """オブジェクトの [start, end) を取得（ZIPエクスポート用）"""
+        with track("storage", "get_object"):
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end - 1}")
+            return response["Body"].read()
+
+    def download_object(self, s3_url: str, fileobj, chunk_size: int = 256 * 1024) -> int:
+        """オブジェクトをファイルに書き出す（全体をメモリに載せない。配信キャッシュ用）"""
+        written = 0
+        with track("storage", "get_object"):
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key_from_url(s3_url))
+            body = response["Body"]
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                fileobj.write(chunk)
+                written += len(chunk)
+        return written
 
     async def upload_image(self, file_content: bytes, file_name: str, content_type: str) -> str:
         """
@@ -30,17 +98,17 @@ class S3Service:
             unique_filename = f"{uuid.uuid4()}{file_extension}"
 
             # S3にアップロード
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=f"photos/{unique_filename}",
-                Body=file_content,
-                ContentType=content_type
-                # ACL='public-read'  # ACLがサポートされていないため削除
-            )
+            with track("storage", "put_object"):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=f"photos/{unique_filename}",
+                    Body=file_content,
+                    ContentType=content_type
+                    # ACL='public-read'  # ACLがサポートされていないため削除
+                )
 
             # パブリックURLを生成
-            url = f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION', 'ap-northeast-1')}.amazonaws.com/photos/{unique_filename}"
-            return url
+            return self.object_url(f"photos/{unique_filename}")
 
         except ClientError as e:
             print(f"S3 ClientError: {e}")
@@ -57,21 +125,18 @@ class S3Service:
         """
         try:
             # URLからキーを抽出
-            if '/photos/' in s3_url:
-                key = 'photos/' + s3_url.split('/photos/')[-1]
-            else:
-                # すでにキーの場合
-                key = s3_url
+            key = self.key_from_url(s3_url)
 
             # 署名付きURLを生成
-            presigned_url = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': self.bucket_name,
-                    'Key': key
-                },
-                ExpiresIn=expiration
-            )
+            with track("storage", "presign"):
+                presigned_url = self.s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={
+                        'Bucket': self.bucket_name,
+                        'Key': key
+                    },
+                    ExpiresIn=expiration
+                )
             return presigned_url
 
         except ClientError as e:
@@ -86,10 +151,11 @@ class S3Service:
             # URLからキーを抽出
             key = image_url.split('/photos/')[-1]
 
-            self.s3_client.delete_object(
-                Bucket=self.bucket_name,
-                Key=f"photos/{key}"
-            )
+            with track("storage", "delete_object"):
+                self.s3_client.delete_object(
+                    Bucket=self.bucket_name,
+                    Key=f"photos/{key}"
+                )
             return True
 
         except ClientError as e:
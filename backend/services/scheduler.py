@@ -0,0 +1,54 @@
+"""
+アプリ内の定期実行タスク
+
+パーティション作成や期限切れデータの削除など、軽い定期処理をワーカー内で実行する。
+同期関数はスレッドで実行するため、イベントループを止めない。
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, List
+
+logger = logging.getLogger("scheduler")
+
+
+@dataclass
+class _Task:
+    name: str
+    interval_s: float
+    func: Callable[[], object]
+    run_at_start: bool = True
+
+
+class PeriodicTasks:
+    def __init__(self):
+        self._tasks: List[_Task] = []
+        self._running: List[asyncio.Task] = []
+
+    def add(self, name: str, interval_s: float, func: Callable[[], object], run_at_start: bool = True):
+        self._tasks.append(_Task(name, interval_s, func, run_at_start))
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def _loop(self, task: _Task):
+        if not task.run_at_start:
+            await asyncio.sleep(task.interval_s)
+        while True:
+            try:
+                result = await asyncio.to_thread(task.func)
+                if result:
+                    logger.info("%s: %s", task.name, result)
+            except Exception:
+                logger.exception("定期タスク %s が失敗しました", task.name)
+            await asyncio.sleep(task.interval_s)
+
+    def start(self):
+        for task in self._tasks:
+            self._running.append(asyncio.create_task(self._loop(task), name=f"periodic:{task.name}"))
+
+    async def stop(self):
+        for running in self._running:
+            running.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running.clear()
@@ -0,0 +1,97 @@
+"""
+ORMのメタデータと実際のデータベースのスキーマの差分検出
+
+スキーマは migrations/ のAlembicリビジョンで管理し、models/database.py はそれと一致させる。
+- 適用済みのリビジョンが head か
+- alembic の autogenerate と同じ比較（テーブル・カラム・型・インデックス・制約）で差分がないか
+を確認する。パーティションや PostGIS のテーブルなど、モデルに載せないものは比較から除く。
+"""
+import os
+import re
+from typing import List, Optional
+
+from geoalchemy2 import Geography
+
+from services import photo_partitions
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALEMBIC_INI = os.path.join(BACKEND_DIR, "alembic.ini")
+
+# モデルに載せないテーブル（PostGIS・パーティション移行の作業用）
+IGNORED_TABLES = {
+    "spatial_ref_sys",
+    photo_partitions.NEW_TABLE,
+    photo_partitions.LEGACY_TABLE,
+    photo_partitions.DEFAULT_PARTITION,
+}
+_PARTITION_TABLE = re.compile(r"^photos(_p)?_p\d{6}$")
+# 運用者が必要に応じて手動で作るインデックス（jobs.reconcile_storage の関数インデックスなど）
+MANUAL_INDEXES = {"idx_photos_storage_key"}
+
+
+def include_object(obj, name, type_, reflected, compare_to) -> bool:
+    """autogenerate・差分検出の対象にするか"""
+    if type_ == "table" and reflected and compare_to is None:
+        return name not in IGNORED_TABLES and not _PARTITION_TABLE.match(name)
+    if type_ == "index" and name in MANUAL_INDEXES:
+        return False
+    return True
+
+
+def compare_type(context, inspected_column, metadata_column, inspected_type, metadata_type) -> Optional[bool]:
+    """型が異なるか（Geography は形状とSRIDで比較し、それ以外は alembic の既定の比較に任せる）"""
+    if isinstance(metadata_type, Geography):
+        if not isinstance(inspected_type, Geography):
+            return True
+        return (
+            (inspected_type.geometry_type or "").upper() != (metadata_type.geometry_type or "").upper()
+            or inspected_type.srid != metadata_type.srid
+        )
+    return None
+
+
+def _alembic_config():
+    from alembic.config import Config
+
+    return Config(ALEMBIC_INI)
+
+
+def head_revision() -> str:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(_alembic_config()).get_current_head()
+
+
+def describe(diff) -> List[str]:
+    """compare_metadata の差分を1行ずつの説明にする"""
+    if isinstance(diff, list):
+        return [line for item in diff for line in describe(item)]
+    kind = diff[0]
+    if kind.startswith("modify_"):
+        _, _, table, column, _, old, new = diff
+        return [f"{kind} {table}.{column}: {old!r} -> {new!r}"]
+    obj = diff[-1]
+    if kind.endswith("_column"):
+        return [f"{kind} {diff[2]}.{obj.name}"]
+    if kind.endswith("_table"):
+        return [f"{kind} {obj.name}"]
+    # インデックス・ユニーク制約・外部キー
+    return [f"{kind} {obj.table.name}.{obj.name}"]
+
+
+def check(conn) -> dict:
+    """適用済みリビジョンとモデルとの差分（drift が空かつ at_head なら一致）"""
+    from alembic.autogenerate import compare_metadata
+    from alembic.runtime.migration import MigrationContext
+
+    import models.database  # noqa: F401  テーブル定義を Base.metadata に登録する
+    from database import Base
+
+    context = MigrationContext.configure(conn, opts={
+        "include_object": include_object,
+        "compare_type": compare_type,
+    })
+    current = context.get_current_revision()
+    head = head_revision()
+    drift = describe(compare_metadata(context, Base.metadata))
+    return {"current": current, "head": head, "at_head": current == head, "drift": drift}
@@ -0,0 +1,188 @@
+"""
+類似写真の検索
+
+ユーザーごとにdHashのBKツリーを保持し、ハミング距離k以内の写真を全件比較せずに探す。
+インデックスは初回利用時にDBから読み込み、同じワーカーでのアップロード・削除は逐次反映する。
+他のワーカーでの変更は SIMILARITY_INDEX_TTL 秒後の再読み込みで反映される。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from services.image_hash import from_db, hamming
+
+SIMILARITY_INDEX_TTL = float(os.getenv("SIMILARITY_INDEX_TTL", "300"))
+SIMILARITY_MAX_USERS = int(os.getenv("SIMILARITY_MAX_USERS", "1000"))
+
+
+class BKTree:
+    """ハミング距離によるBKツリー（削除は墓標で行い、半数を超えたら作り直す）"""
+
+    def __init__(self):
+        # ノード: [hash, {距離: 子ノード}, 同じhashを持つIDの集合]
+        self._root = None
+        self._ids: Dict[object, int] = {}
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, item_id, value: int):
+        if item_id in self._ids:
+            self.remove(item_id)
+        self._ids[item_id] = value
+        if self._root is None:
+            self._root = [value, {}, {item_id}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[2].add(item_id)
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}, {item_id}]
+                return
+            node = child
+
+    def remove(self, item_id):
+        value = self._ids.pop(item_id, None)
+        if value is None:
+            return
+        node = self._root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[2].discard(item_id)
+                break
+            node = node[1].get(distance)
+        self._removed += 1
+        if self._removed > len(self._ids):
+            self._rebuild()
+
+    def _rebuild(self):
+        items = list(self._ids.items())
+        self._root = None
+        self._ids = {}
+        self._removed = 0
+        for item_id, value in items:
+            self.add(item_id, value)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """距離max_distance以内の (距離, ID) を距離順に返す"""
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item_id) for item_id in node[2])
+            # 三角不等式により |d - max| から d + max の枝だけを辿る
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node[1].items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        results.sort(key=lambda r: (r[0], str(r[1])))
+        return results
+
+    def items(self) -> Iterable[Tuple[object, int]]:
+        return self._ids.items()
+
+    def get(self, item_id) -> Optional[int]:
+        return self._ids.get(item_id)
+
+
+def duplicate_groups(tree: BKTree, max_distance: int) -> List[List[object]]:
+    """距離max_distance以内でつながる写真のグループ（2枚以上）を返す"""
+    parent: Dict[object, object] = {item_id: item_id for item_id, _ in tree.items()}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for item_id, value in tree.items():
+        for _, other in tree.search(value, max_distance):
+            a, b = find(item_id), find(other)
+            if a != b:
+                parent[b] = a
+
+    groups: Dict[object, List[object]] = {}
+    for item_id in parent:
+        groups.setdefault(find(item_id), []).append(item_id)
+    return [sorted(g, key=str) for g in groups.values() if len(g) > 1]
+
+
+class _UserIndex:
+    def __init__(self, tree: BKTree):
+        self.tree = tree
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class SimilarityIndex:
+    """ユーザーごとのBKツリーをLRUで保持"""
+
+    def __init__(self, ttl: float = SIMILARITY_INDEX_TTL, max_users: int = SIMILARITY_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._indexes: "OrderedDict[UUID, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, db, user_id: UUID) -> BKTree:
+        from models.database import Photo
+
+        tree = BKTree()
+        rows = db.query(Photo.id, Photo.phash).filter(
+            Photo.user_id == user_id, Photo.phash.isnot(None))
+        for photo_id, phash in rows:
+            tree.add(photo_id, from_db(phash))
+        return tree
+
+    def get(self, db, user_id: UUID) -> _UserIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and time.monotonic() - index.loaded_at <= self.ttl:
+                self._indexes.move_to_end(user_id)
+                return index
+        index = _UserIndex(self._load(db, user_id))
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add(self, user_id: UUID, photo_id: UUID, phash: Optional[int]):
+        """読み込み済みのインデックスにだけ反映（未読み込みなら次回DBから読む）"""
+        index = self._indexes.get(user_id)
+        if index is not None and phash is not None:
+            with index.lock:
+                index.tree.add(photo_id, from_db(phash))
+
+    def remove(self, user_id: UUID, photo_id: UUID):
+        index = self._indexes.get(user_id)
+        if index is not None:
+            with index.lock:
+                index.tree.remove(photo_id)
+
+    def similar(self, db, user_id: UUID, photo_id: UUID, max_distance: int) -> List[Tuple[int, UUID]]:
+        index = self.get(db, user_id)
+        with index.lock:
+            value = index.tree.get(photo_id)
+            if value is None:
+                return []
+            return [(d, i) for d, i in index.tree.search(value, max_distance) if i != photo_id]
+
+    def duplicates(self, db, user_id: UUID, max_distance: int) -> List[List[UUID]]:
+        index = self.get(db, user_id)
+        with index.lock:
+            return duplicate_groups(index.tree, max_distance)
+
+
+similarity_index = SimilarityIndex()
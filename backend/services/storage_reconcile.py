@@ -0,0 +1,125 @@
+"""
+S3とphotosテーブルの突き合わせ
+
+バケットの一覧（キーのバイト順でページング）と photos.s3_key（同じ順に並べたサーバーサイドカーソル）を
+マージジョインし、片方にしかないものを一定のメモリで検出する。
+- orphan_object: S3にあるがDBに行がない（DBコミット失敗後の残骸など）
+- missing_object: DBに行があるがS3にない（S3削除失敗後に行だけ残った場合など）
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import text
+
+STORAGE_PREFIX = "photos/"
+
+# S3Service.key_from_url と同じ規則でURLからキーを取り出す
+STORAGE_KEY_EXPR = (
+    "(CASE WHEN position('/photos/' in s3_key) > 0 "
+    "THEN 'photos/' || regexp_replace(s3_key, '^.*/photos/', '') ELSE s3_key END) COLLATE \"C\""
+)
+
+PHOTO_KEYS_SQL = f"""
+SELECT storage_key, id, created_at FROM (
+    SELECT {STORAGE_KEY_EXPR} AS storage_key, id, created_at FROM photos
+) keys
+WHERE storage_key LIKE :prefix_pattern AND (CAST(:after AS TEXT) IS NULL OR storage_key > :after)
+ORDER BY storage_key
+"""
+
+
+@dataclass
+class StorageObject:
+    key: str
+    size: int
+    last_modified: Optional[datetime]
+
+
+@dataclass
+class PhotoKey:
+    key: str
+    photo_id: object
+    created_at: Optional[datetime]
+
+
+class OrderingError(RuntimeError):
+    """入力がキーのバイト順に並んでいない（照合順序の不一致など。誤削除を防ぐため中断する）"""
+
+
+def _ascending(items, name: str):
+    previous = None
+    for item in items:
+        current = item.key.encode("utf-8")
+        if previous is not None and current < previous:
+            raise OrderingError(f"{name} がキー順に並んでいません: {item.key!r}")
+        previous = current
+        yield item
+
+
+def iter_storage_objects(client, bucket: str, prefix: str = STORAGE_PREFIX,
+                         start_after: Optional[str] = None, page_size: int = 1000) -> Iterator[StorageObject]:
+    """バケットのオブジェクトをキー順に1ページずつ取得"""
+    params = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": page_size}
+    if start_after:
+        params["StartAfter"] = start_after
+    while True:
+        response = client.list_objects_v2(**params)
+        for item in response.get("Contents", []):
+            yield StorageObject(item["Key"], item.get("Size", 0), item.get("LastModified"))
+        if not response.get("IsTruncated"):
+            return
+        params.pop("StartAfter", None)
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def iter_photo_keys(conn, prefix: str = STORAGE_PREFIX, start_after: Optional[str] = None,
+                    batch_size: int = 5000) -> Iterator[PhotoKey]:
+    """photos のキーをサーバーサイドカーソルでキー順に取得"""
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+        text(PHOTO_KEYS_SQL), {"prefix_pattern": prefix + "%", "after": start_after})
+    for storage_key, photo_id, created_at in result:
+        yield PhotoKey(storage_key, photo_id, created_at)
+
+
+def merge_orphans(objects, rows) -> Iterator[Tuple[str, str, object]]:
+    """
+    キー順の2つの列をマージし、(種類, キー, 要素) を順に返す
+
+    種類は "matched"・"orphan_object"・"missing_object"。同じキーの行が複数あっても1つのオブジェクトに対応させる。
+    """
+    objects = _ascending(objects, "オブジェクト一覧")
+    rows = _ascending(rows, "photos")
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj is not None or row is not None:
+        if row is None or (obj is not None and obj.key.encode("utf-8") < row.key.encode("utf-8")):
+            yield "orphan_object", obj.key, obj
+            obj = next(objects, None)
+        elif obj is None or row.key.encode("utf-8") < obj.key.encode("utf-8"):
+            yield "missing_object", row.key, row
+            row = next(rows, None)
+        else:
+            key = obj.key
+            yield "matched", key, obj
+            obj = next(objects, None)
+            while row is not None and row.key == key:
+                row = next(rows, None)
+
+
+class RateLimiter:
+    """1秒あたりの処理件数を上限以下に保つ（0は無制限）"""
+
+    def __init__(self, per_second: float):
+        self.per_second = per_second
+        self._started = time.monotonic()
+        self._count = 0
+
+    def wait(self, n: int = 1):
+        if self.per_second <= 0:
+            return
+        self._count += n
+        ahead = self._count / self.per_second - (time.monotonic() - self._started)
+        if ahead > 0:
+            time.sleep(ahead)
@@ -0,0 +1,168 @@
+"""
+ユーザーごとの写真数・容量カウンタ
+
+写真の追加・削除・公開範囲変更のたびに、同じトランザクション内で user_stats を
+差分更新する。集計クエリを使わずO(1)で件数・容量を参照でき、アップロード時の
+クォータ判定にも使う。ずれが生じた場合は reconcile で実データから修復する。
+"""
+import os
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, bindparam, func, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PGUUID, insert
+from sqlalchemy.orm import Session
+
+from models.database import UserStats
+
+# 0 は無制限
+QUOTA_MAX_PHOTOS = int(os.getenv("QUOTA_MAX_PHOTOS", "0"))
+QUOTA_MAX_BYTES = int(os.getenv("QUOTA_MAX_BYTES", "0"))
+
+VISIBILITY_COLUMNS = {
+    "public": "public_count",
+    "unlisted": "unlisted_count",
+    "private": "private_count",
+}
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+def _visibility_value(visibility) -> str:
+    return getattr(visibility, "value", visibility)
+
+
+def get_stats(db: Session, user_id: UUID) -> Optional[UserStats]:
+    return db.get(UserStats, user_id)
+
+
+def check_quota(db: Session, user_id: UUID, incoming_bytes: int):
+    """アップロード前にクォータを確認（超過時は QuotaExceededError）"""
+    if not QUOTA_MAX_PHOTOS and not QUOTA_MAX_BYTES:
+        return
+    stats = get_stats(db, user_id)
+    photo_count = stats.photo_count if stats else 0
+    total_bytes = stats.total_bytes if stats else 0
+    if QUOTA_MAX_PHOTOS and photo_count + 1 > QUOTA_MAX_PHOTOS:
+        raise QuotaExceededError(f"写真の枚数が上限（{QUOTA_MAX_PHOTOS}枚）に達しています")
+    if QUOTA_MAX_BYTES and total_bytes + incoming_bytes > QUOTA_MAX_BYTES:
+        raise QuotaExceededError("ストレージ容量の上限を超えています")
+
+
+def _apply_delta(db: Session, user_id: UUID, photos: int, size_bytes: int,
+                 visibility_deltas: Dict[str, int], enforce_quota: bool = False):
+    values = {
+        "user_id": user_id,
+        "photo_count": photos,
+        "total_bytes": size_bytes,
+        "public_count": 0,
+        "unlisted_count": 0,
+        "private_count": 0,
+    }
+    for visibility, delta in visibility_deltas.items():
+        values[VISIBILITY_COLUMNS[visibility]] += delta
+
+    stmt = insert(UserStats).values(**{k: (max(v, 0) if k != "user_id" else v) for k, v in values.items()})
+    table = UserStats.__table__
+    set_ = {
+        column: func.greatest(table.c[column] + values[column], 0)
+        for column in ("photo_count", "total_bytes", "public_count", "unlisted_count", "private_count")
+        if values[column]
+    }
+    set_["updated_at"] = func.now()
+
+    where = None
+    if enforce_quota:
+        conditions = []
+        if QUOTA_MAX_PHOTOS:
+            conditions.append(table.c.photo_count + photos <= QUOTA_MAX_PHOTOS)
+        if QUOTA_MAX_BYTES:
+            conditions.append(table.c.total_bytes + size_bytes <= QUOTA_MAX_BYTES)
+        if conditions:
+            where = and_(*conditions)
+
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id], set_=set_, where=where)
+    result = db.execute(stmt.returning(table.c.user_id))
+    if enforce_quota and result.first() is None:
+        # 同時アップロードで事前チェック後に上限を超えた場合
+        raise QuotaExceededError("ストレージ容量の上限を超えています")
+
+
+def record_photo_added(db: Session, photo, enforce_quota: bool = True):
+    """写真の追加を反映（コミット前に呼ぶ）"""
+    _apply_delta(db, photo.user_id, 1, photo.size_bytes,
+                 {_visibility_value(photo.visibility): 1}, enforce_quota=enforce_quota)
+
+
+def record_photos_added(db: Session, user_id: UUID, photos: int, size_bytes: int, visibility,
+                        enforce_quota: bool = True):
+    """同じ公開範囲の写真をまとめて追加したことを反映（一括インポート用、コミット前に呼ぶ）"""
+    if photos:
+        _apply_delta(db, user_id, photos, size_bytes,
+                     {_visibility_value(visibility): photos}, enforce_quota=enforce_quota)
+
+
+def record_photo_removed(db: Session, photo):
+    """写真の削除を反映（コミット前に呼ぶ）"""
+    _apply_delta(db, photo.user_id, -1, -photo.size_bytes,
+                 {_visibility_value(photo.visibility): -1})
+
+
+def record_visibility_changed(db: Session, user_id: UUID, old_visibility, new_visibility):
+    """公開範囲の変更を反映（コミット前に呼ぶ）"""
+    old_value, new_value = _visibility_value(old_visibility), _visibility_value(new_visibility)
+    if old_value == new_value:
+        return
+    _apply_delta(db, user_id, 0, 0, {old_value: -1, new_value: 1})
+
+
+RECONCILE_SQL = text("""
+WITH actual AS (
+    SELECT u.id AS user_id,
+           COUNT(p.id) AS photo_count,
+           COALESCE(SUM(p.size_bytes), 0) AS total_bytes,
+           COUNT(p.id) FILTER (WHERE p.visibility::text = 'public') AS public_count,
+           COUNT(p.id) FILTER (WHERE p.visibility::text = 'unlisted') AS unlisted_count,
+           COUNT(p.id) FILTER (WHERE p.visibility::text = 'private') AS private_count
+    FROM users u
+    LEFT JOIN photos p ON p.user_id = u.id
+    WHERE u.id = ANY(:user_ids)
+    GROUP BY u.id
+)
+INSERT INTO user_stats (user_id, photo_count, total_bytes, public_count, unlisted_count, private_count, updated_at)
+SELECT user_id, photo_count, total_bytes, public_count, unlisted_count, private_count, NOW()
+FROM actual
+ON CONFLICT (user_id) DO UPDATE SET
+    photo_count = EXCLUDED.photo_count,
+    total_bytes = EXCLUDED.total_bytes,
+    public_count = EXCLUDED.public_count,
+    unlisted_count = EXCLUDED.unlisted_count,
+    private_count = EXCLUDED.private_count,
+    updated_at = NOW()
+WHERE (user_stats.photo_count, user_stats.total_bytes, user_stats.public_count,
+       user_stats.unlisted_count, user_stats.private_count)
+   IS DISTINCT FROM
+      (EXCLUDED.photo_count, EXCLUDED.total_bytes, EXCLUDED.public_count,
+       EXCLUDED.unlisted_count, EXCLUDED.private_count)
+RETURNING user_id
+""").bindparams(bindparam("user_ids", type_=ARRAY(PGUUID(as_uuid=True))))
+
+LOCK_SQL = text(
+    "SELECT user_id FROM user_stats WHERE user_id = ANY(:user_ids) ORDER BY user_id FOR UPDATE"
+).bindparams(bindparam("user_ids", type_=ARRAY(PGUUID(as_uuid=True))))
+
+
+def reconcile(db: Session, user_ids: Iterable[UUID]) -> List[UUID]:
+    """
+    指定ユーザーのカウンタを実データから再計算し、ずれていた行を修復する
+
+    先に既存行をロックするため、集計中にコミットされたアップロードの差分を
+    上書きで失うことはない。修復したユーザーIDを返す（コミットは呼び出し側）。
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    db.execute(LOCK_SQL, {"user_ids": user_ids})
+    return [row[0] for row in db.execute(RECONCILE_SQL, {"user_ids": user_ids})]
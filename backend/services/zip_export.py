@@ -0,0 +1,320 @@
+"""
+ライブラリのZIPエクスポート
+
+写真は無圧縮（stored）で格納し、アーカイブをその場で組み立てながらストリーミングする。
+各エントリのサイズ（と分かっていればCRC）からレイアウトを事前に計算できるので、
+全体の長さが決まり、Rangeリクエストで途中から再開できる。
+
+- CRC32が保存されている写真はローカルヘッダーにCRCを書く
+- 未保存の写真はデータディスクリプタ（データの後ろにCRC）を使い、送信中に計算する。
+  途中から再開するとそれより前の未保存分をすべて取得し直すことになるため、
+  未保存の写真が残っている間は Range に応じない（jobs.backfill_image_features で埋める）
+- 4GiBを超える位置や65535件を超えるエントリにはZIP64のレコードを使う
+
+エントリの列は何度でも同じ順で取り出せる関数として受け取り、一覧をメモリに保持しない。
+"""
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+EXPORT_READ_AHEAD = int(os.getenv("EXPORT_READ_AHEAD", "4"))
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_ZIP64_OFFSET_EXTRA = struct.Struct("<HHQ")
+_ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_LOCATOR = struct.Struct("<IIQI")
+_END = struct.Struct("<IHHHHIIH")
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION = 20
+_VERSION_ZIP64 = 45
+_MADE_BY_UNIX = 3 << 8
+_EXTERNAL_ATTR = 0o100644 << 16
+_MAX_32 = 0xFFFFFFFF
+_MAX_16 = 0xFFFF
+
+
+@dataclass
+class ExportEntry:
+    name: str  # アーカイブ内のパス
+    key: str  # ストレージのキー
+    size: int
+    crc: Optional[int]  # 未保存ならNone（送信時に計算する）
+    modified: datetime
+
+
+class ExportError(RuntimeError):
+    """ストレージの内容がレイアウトと一致しない（送信を中断する）"""
+
+
+def _dos_time(value: datetime) -> Tuple[int, int]:
+    if value.year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    return (
+        (value.hour << 11) | (value.minute << 5) | (value.second // 2),
+        ((value.year - 1980) << 9) | (value.month << 5) | value.day,
+    )
+
+
+def local_header(entry: ExportEntry) -> bytes:
+    if entry.size >= _MAX_32:
+        raise ExportError(f"{entry.name} は大きすぎます")
+    name = entry.name.encode("utf-8")
+    flags = _FLAG_UTF8 | (_FLAG_DATA_DESCRIPTOR if entry.crc is None else 0)
+    time, date = _dos_time(entry.modified)
+    return _LOCAL_HEADER.pack(
+        0x04034B50, _VERSION, flags, 0, time, date,
+        entry.crc or 0, entry.size, entry.size, len(name), 0,
+    ) + name
+
+
+def data_descriptor(crc: int, size: int) -> bytes:
+    return _DATA_DESCRIPTOR.pack(0x08074B50, crc, size, size)
+
+
+def central_header(entry: ExportEntry, crc: int, offset: int) -> bytes:
+    name = entry.name.encode("utf-8")
+    flags = _FLAG_UTF8 | (_FLAG_DATA_DESCRIPTOR if entry.crc is None else 0)
+    time, date = _dos_time(entry.modified)
+    extra = b""
+    version = _VERSION
+    if offset >= _MAX_32:
+        extra = _ZIP64_OFFSET_EXTRA.pack(0x0001, 8, offset)
+        version = _VERSION_ZIP64
+        offset = _MAX_32
+    return _CENTRAL_HEADER.pack(
+        0x02014B50, _MADE_BY_UNIX | _VERSION_ZIP64, version, flags, 0, time, date,
+        crc, entry.size, entry.size, len(name), len(extra), 0, 0, 0, _EXTERNAL_ATTR, offset,
+    ) + name + extra
+
+
+def central_header_size(entry: ExportEntry, offset: int) -> int:
+    return (_CENTRAL_HEADER.size + len(entry.name.encode("utf-8"))
+            + (_ZIP64_OFFSET_EXTRA.size if offset >= _MAX_32 else 0))
+
+
+def end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b""
+    if count >= _MAX_16 or cd_offset >= _MAX_32 or cd_size >= _MAX_32:
+        zip64_offset = cd_offset + cd_size
+        records += _ZIP64_END.pack(
+            0x06064B50, _ZIP64_END.size - 12, _MADE_BY_UNIX | _VERSION_ZIP64, _VERSION_ZIP64,
+            0, 0, count, count, cd_size, cd_offset,
+        )
+        records += _ZIP64_LOCATOR.pack(0x07064B50, 0, zip64_offset, 1)
+    records += _END.pack(
+        0x06054B50, 0, 0, min(count, _MAX_16), min(count, _MAX_16),
+        min(cd_size, _MAX_32), min(cd_offset, _MAX_32), 0,
+    )
+    return records
+
+
+def _manifest_entry(name: str, modified: datetime, chunks: Callable[[], Iterable[bytes]]) -> ExportEntry:
+    """マニフェストのサイズとCRCを一度生成して求める（内容は保持しない）"""
+    size = 0
+    crc = 0
+    for chunk in chunks():
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    return ExportEntry(name, "", size, crc, modified)
+
+
+@dataclass
+class _Segment:
+    start: int
+    length: int
+    kind: str  # header / data / manifest / descriptor / central / end
+    entry: Optional[ExportEntry] = None
+    payload: Optional[bytes] = None
+    offset: int = 0  # central: ローカルヘッダーの位置
+
+
+class ZipExport:
+    """
+    エクスポートアーカイブ
+
+    entries は呼ぶたびに同じ順序のエントリ列を返す関数、manifest はマニフェストのバイト列を
+    チャンクで返す関数、fetch(key, start, end) はオブジェクトの [start, end) を返す関数。
+    """
+
+    def __init__(self, entries: Callable[[], Iterable[ExportEntry]],
+                 manifest: Callable[[], Iterable[bytes]],
+                 fetch: Callable[[str, int, int], bytes],
+                 modified: datetime,
+                 manifest_name: str = "manifest.json",
+                 read_ahead: int = EXPORT_READ_AHEAD):
+        self._entries = entries
+        self._manifest = manifest
+        self._fetch = fetch
+        self._read_ahead = max(1, read_ahead)
+        self._manifest_entry = _manifest_entry(manifest_name, modified, manifest)
+        # 送信中に計算したCRC（CRC未保存のエントリのみ）
+        self._crcs: Dict[str, int] = {}
+        self._crc_lock = threading.Lock()
+
+        self.count = 0
+        self.missing_crc = 0
+        cd_offset = 0
+        cd_size = 0
+        for entry in self._all_entries():
+            self.count += 1
+            if entry.crc is None:
+                self.missing_crc += 1
+            cd_size += central_header_size(entry, cd_offset)
+            cd_offset += self._entry_length(entry)
+        self.cd_offset = cd_offset
+        self.cd_size = cd_size
+        self._end = end_records(self.count, cd_offset, cd_size)
+        self.size = cd_offset + cd_size + len(self._end)
+
+    def _all_entries(self) -> Iterator[ExportEntry]:
+        yield from self._entries()
+        yield self._manifest_entry
+
+    @staticmethod
+    def _entry_length(entry: ExportEntry) -> int:
+        length = _LOCAL_HEADER.size + len(entry.name.encode("utf-8")) + entry.size
+        if entry.crc is None:
+            length += _DATA_DESCRIPTOR.size
+        return length
+
+    def _segments(self) -> Iterator[_Segment]:
+        position = 0
+        for entry in self._all_entries():
+            header = local_header(entry)
+            yield _Segment(position, len(header), "header", entry, header)
+            position += len(header)
+            kind = "manifest" if entry is self._manifest_entry else "data"
+            yield _Segment(position, entry.size, kind, entry)
+            position += entry.size
+            if entry.crc is None:
+                yield _Segment(position, _DATA_DESCRIPTOR.size, "descriptor", entry)
+                position += _DATA_DESCRIPTOR.size
+        offset = 0
+        for entry in self._all_entries():
+            length = central_header_size(entry, offset)
+            yield _Segment(position, length, "central", entry, offset=offset)
+            position += length
+            offset += self._entry_length(entry)
+        yield _Segment(position, len(self._end), "end", payload=self._end)
+
+    def _crc_of(self, entry: ExportEntry) -> int:
+        if entry.crc is not None:
+            return entry.crc
+        with self._crc_lock:
+            crc = self._crcs.get(entry.key)
+        if crc is None:
+            # この範囲より前のエントリなので、取得し直して計算する
+            self._read(entry, 0, entry.size)
+            with self._crc_lock:
+                crc = self._crcs[entry.key]
+        return crc
+
+    def _read(self, entry: ExportEntry, start: int, end: int) -> bytes:
+        data = self._fetch(entry.key, start, end)
+        if len(data) != end - start:
+            raise ExportError(f"{entry.name} のサイズが記録と一致しません")
+        if start == 0 and end == entry.size:
+            crc = zlib.crc32(data)
+            if entry.crc is None:
+                with self._crc_lock:
+                    self._crcs[entry.key] = crc
+            elif crc != entry.crc:
+                raise ExportError(f"{entry.name} の内容が記録と一致しません")
+        return data
+
+    def _render(self, segment: _Segment, start: int, end: int) -> Iterator[bytes]:
+        """セグメント内の [start, end) を返す（data以外）"""
+        if segment.kind == "manifest":
+            position = 0
+            for chunk in self._manifest():
+                chunk_end = position + len(chunk)
+                if chunk_end > start and position < end:
+                    yield chunk[max(0, start - position):end - position]
+                position = chunk_end
+                if position >= end:
+                    break
+            return
+        if segment.kind == "descriptor":
+            payload = data_descriptor(self._crc_of(segment.entry), segment.entry.size)
+        elif segment.kind == "central":
+            payload = central_header(segment.entry, self._crc_of(segment.entry), segment.offset)
+        else:
+            payload = segment.payload
+        yield payload[start:end]
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """アーカイブの [start, end) をチャンクで返す（写真は最大 read_ahead 件を先読みする）"""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        # 出力順に並べた待ち行列。ディスクリプタ等は取り出した時点で描画するので、
+        # 先行する写真の取得（とCRCの計算）は済んでいる
+        pending = deque()
+        in_flight = 0
+        with ThreadPoolExecutor(max_workers=self._read_ahead) as pool:
+            for segment in self._segments():
+                segment_end = segment.start + segment.length
+                if segment_end <= start or segment.length == 0:
+                    continue
+                if segment.start >= end:
+                    break
+                lo = max(start, segment.start) - segment.start
+                hi = min(end, segment_end) - segment.start
+                if segment.kind == "data":
+                    pending.append(pool.submit(self._read, segment.entry, lo, hi))
+                    in_flight += 1
+                else:
+                    pending.append((segment, lo, hi))
+                while in_flight > self._read_ahead or (pending and isinstance(pending[0], tuple)):
+                    item = pending.popleft()
+                    if isinstance(item, tuple):
+                        yield from self._render(*item)
+                    else:
+                        in_flight -= 1
+                        yield from self._chunks(item.result())
+            while pending:
+                item = pending.popleft()
+                if isinstance(item, tuple):
+                    yield from self._render(*item)
+                else:
+                    yield from self._chunks(item.result())
+
+    @staticmethod
+    def _chunks(data: bytes) -> Iterator[bytes]:
+        for i in range(0, len(data), EXPORT_CHUNK_SIZE):
+            yield data[i:i + EXPORT_CHUNK_SIZE]
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    単一の bytes=a-b 形式のRangeを [start, end) にして返す
+
+    ヘッダーがない・複数範囲・解釈できない場合はNone（全体を返す）。
+    満たせない範囲はValueError。
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("Range が範囲外です")
+        return max(0, size - suffix), size
+    start = int(first)
+    end = int(last) + 1 if last else size
+    if start >= size or end <= start:
+        raise ValueError("Range が範囲外です")
+    return start, min(end, size)
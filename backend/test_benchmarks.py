@@ -0,0 +1,70 @@
+from benchmarks.fake_s3 import InMemoryS3Client
+from benchmarks.run import compare_reports, percentile, summarize
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 95) == 0.0
+
+
+def test_summarize_reports_throughput_and_percentiles():
+    summary = summarize([0.01] * 99 + [0.5], elapsed=2.0, errors=1)
+    assert summary["requests"] == 100
+    assert summary["throughput_rps"] == 50.0
+    assert summary["latency_ms"]["p50"] == 10.0
+    assert summary["latency_ms"]["max"] == 500.0
+    assert summary["errors"] == 1
+
+
+def _report(p95, rps):
+    return {"results": [{"scenario": "feed", "concurrency": 8,
+                         "throughput_rps": rps, "latency_ms": {"p95": p95}}]}
+
+
+def test_compare_reports_flags_regressions():
+    [same] = compare_reports(_report(10.0, 100.0), _report(10.5, 98.0), max_regression_pct=10)
+    assert not same["regression"]
+
+    [slower] = compare_reports(_report(10.0, 100.0), _report(12.0, 100.0), max_regression_pct=10)
+    assert slower["regression"]
+    assert slower["p95_change_pct"] == 20.0
+
+
+def test_fake_s3_lists_keys_in_pages():
+    s3 = InMemoryS3Client()
+    for i in range(5):
+        s3.put_object(Bucket="b", Key=f"photos/{i}.jpg", Body=b"x")
+
+    first = s3.list_objects_v2(Bucket="b", Prefix="photos/", MaxKeys=3)
+    assert [o["Key"] for o in first["Contents"]] == ["photos/0.jpg", "photos/1.jpg", "photos/2.jpg"]
+    assert first["IsTruncated"]
+
+    second = s3.list_objects_v2(Bucket="b", Prefix="photos/", MaxKeys=3,
+                                ContinuationToken=first["NextContinuationToken"])
+    assert [o["Key"] for o in second["Contents"]] == ["photos/3.jpg", "photos/4.jpg"]
+    assert not second["IsTruncated"]
+
+
+def test_generator_is_deterministic_and_skewed():
+    from datetime import datetime, timezone
+
+    from benchmarks.generate import LineStream, photo_lines, user_plan
+
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    plans = [user_plan(42, i, now, mean_photos=20, mean_sessions=2, max_photos=20000) for i in range(5000)]
+    assert plans[10] == user_plan(42, 10, now, mean_photos=20, mean_sessions=2, max_photos=20000)
+
+    counts = sorted(plan.photos for plan in plans)
+    assert counts[len(counts) // 2] < 20 < counts[-1] // 10  # 中央値は平均より小さく、裾は長い
+
+    stream = LineStream(photo_lines(iter(plans[:50]), 42, now))
+    data = ""
+    while True:
+        chunk = stream.read(1000)
+        if not chunk:
+            break
+        data += chunk
+    assert data.count("\n") == stream.lines == sum(plan.photos for plan in plans[:50])
@@ -0,0 +1,53 @@
+import csv
+import os
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+
+from jobs.bulk_import import Ledger, analyze_file, copy_rows, iter_files, photo_id_for
+
+
+def _jpeg_with_gps(path):
+    exif = Image.Exif()
+    exif[0x8825] = {1: "S", 2: (33.0, 52.0, 12.0), 3: "E", 4: (151.0, 12.0, 36.0)}
+    exif[0x8769] = {0x9003: "2023:08:01 10:20:30", 0x9011: "+10:00"}
+    Image.new("RGB", (40, 30), (200, 10, 10)).save(path, "JPEG", exif=exif.tobytes())
+
+
+def test_analyze_file_reads_gps_and_capture_time(tmp_path):
+    path = tmp_path / "sydney.jpg"
+    _jpeg_with_gps(path)
+    values = analyze_file(str(path), 5 * 1024 * 1024)
+    assert round(values["lat"], 4) == -33.87
+    assert round(values["lng"], 4) == 151.21
+    assert values["taken_at"] == datetime(2023, 8, 1, 10, 20, 30, tzinfo=timezone(timedelta(hours=10)))
+    assert (values["width"], values["height"]) == (40, 30)
+    assert values["size_bytes"] == os.path.getsize(path)
+
+
+def test_copy_rows_writes_ewkt_location_and_nulls():
+    row = {"id": "a", "lat": 35.5, "lng": 139.25, "exif": {"271": "Canon"}, "title": None}
+    fields = next(csv.reader(copy_rows([row])))
+    assert fields[8] == "SRID=4326;POINT(139.25 35.5)"
+    assert fields[9] == '{"271": "Canon"}'
+    assert fields[5] == ""
+
+
+def test_walk_is_ordered_and_filtered(tmp_path):
+    for name in ["b/2.jpg", "a/1.PNG", "a/notes.txt", "c.jpeg"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"x")
+    found = [os.path.relpath(e.path, tmp_path) for e in iter_files(str(tmp_path), {"jpg", "jpeg", "png"})]
+    assert found == ["c.jpeg", os.path.join("a", "1.PNG"), os.path.join("b", "2.jpg")]
+
+
+def test_ledger_resumes_only_unchanged_files(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite"))
+    photo_id = photo_id_for("user", "a/1.jpg", 10, 5)
+    assert photo_id == photo_id_for("user", "a/1.jpg", 10, 5)
+    ledger.mark([("a/1.jpg", 10, 5, str(photo_id), None)], "uploaded")
+    ledger.mark([("a/1.jpg", 10, 5, str(photo_id), None)], "done")
+    assert ledger.status("a/1.jpg", 10, 5) == "done"
+    assert ledger.status("a/1.jpg", 11, 5) is None
+    assert ledger.counts() == {"done": 1}
+    ledger.close()
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from services.content_cache import DiskCache, FileRangeResponse, cache_control, etag_for, etag_matches
+
+
+def _fetcher(data, calls, delay=0.0):
+    def fetch(out):
+        calls.append(1)
+        time.sleep(delay)
+        out.write(data)
+    return fetch
+
+
+def _read(cache, key, data=b"x", calls=None, delay=0.0):
+    file, size, result = cache.open(key, _fetcher(data, calls if calls is not None else [], delay))
+    with file:
+        return file.read(), size, result
+
+
+def test_hits_after_first_fetch_and_least_recently_used_is_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    calls = []
+    assert _read(cache, "a", b"a" * 100, calls) == (b"a" * 100, 100, "miss")
+    assert _read(cache, "b", b"b" * 100, calls)[2] == "miss"
+    assert _read(cache, "a", b"a" * 100, calls)[2] == "hit"
+    # c を入れると上限を超えるので、最後に使ったのが古い b が消える
+    assert _read(cache, "c", b"c" * 100, calls)[2] == "miss"
+    assert cache.total_bytes == 200
+    assert _read(cache, "a", b"a" * 100, calls)[2] == "hit"
+    assert _read(cache, "b", b"b" * 100, calls)[2] == "miss"
+    assert len(calls) == 4
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_concurrent_misses_fetch_once(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10_000)
+    calls, results = [], []
+
+    def worker():
+        results.append(_read(cache, "photos/u/1.jpg", b"jpeg" * 100, calls, delay=0.3)[2])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(results) == ["coalesced"] * 7 + ["miss"]
+
+
+def test_failed_fetch_leaves_nothing_behind_and_is_retried(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10_000)
+
+    def broken(out):
+        out.write(b"partial")
+        raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        cache.open("k", broken)
+    assert os.listdir(tmp_path) == []
+    assert _read(cache, "k", b"full")[0:2] == (b"full", 4)
+
+
+def test_index_is_restored_from_disk(tmp_path):
+    _read(DiskCache(str(tmp_path)), "k", b"data")
+    (tmp_path / "leftover.tmp").write_bytes(b"partial")
+    restored = DiskCache(str(tmp_path))
+    assert _read(restored, "k", b"other")[0] == b"data"
+    assert restored.total_bytes == 4
+    assert not (tmp_path / "leftover.tmp").exists()
+
+
+def test_validators():
+    etag = etag_for("photos/u/1.jpg")
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert cache_control("public") == "public, max-age=300, must-revalidate"
+    assert cache_control("unlisted") == "private, no-cache"
+    assert "immutable" not in cache_control("public")
+
+
+def test_file_range_response_streams_the_requested_slice(tmp_path):
+    path = tmp_path / "photo"
+    path.write_bytes(bytes(range(256)) * 2000)
+
+    async def endpoint(request):
+        return FileRangeResponse(open(path, "rb"), 1000, 300_000, status_code=206, media_type="image/jpeg")
+
+    client = TestClient(Starlette(routes=[Route("/", endpoint)]))
+    response = client.get("/")
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "300000"
+    assert response.content == path.read_bytes()[1000:301_000]
+
+
+def test_file_range_response_uses_zerocopysend_when_offered(tmp_path):
+    path = tmp_path / "photo"
+    path.write_bytes(b"0123456789")
+    file = open(path, "rb")
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "extensions": {"http.response.zerocopysend": {}}}
+    asyncio.run(FileRangeResponse(file, 2, 5)(scope, None, send))
+    assert messages[1] == {"type": "http.response.zerocopysend", "file": file, "offset": 2, "count": 5}
+    assert file.closed
+
+
+class _Query:
+    def __init__(self, result):
+        self.result = result
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.result
+
+
+class _Session:
+    def __init__(self, photo, user):
+        self.photo = photo
+        self.user = user
+
+    def query(self, model):
+        from models.database import Photo, User
+        return _Query({Photo: self.photo, User: self.user}.get(model))
+
+    def close(self):
+        pass
+
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def content_client(tmp_path, monkeypatch):
+    import uuid
+    from types import SimpleNamespace
+
+    from botocore.exceptions import ClientError
+
+    import database
+    import main
+    from auth.auth_service import AuthService
+    from routers import photos
+    from services.s3_service import s3_service
+
+    owner = SimpleNamespace(id=uuid.uuid4())
+    other = SimpleNamespace(id=uuid.uuid4())
+    photo = SimpleNamespace(id=uuid.uuid4(), user_id=owner.id, visibility="public",
+                            s3_key=f"photos/{uuid.uuid4()}.jpg", mime_type="image/jpeg")
+    state = SimpleNamespace(photo=photo, user=None, objects={photo.s3_key: CONTENT}, downloads=[])
+
+    def download_object(s3_key, fileobj):
+        state.downloads.append(s3_key)
+        if s3_key not in state.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        fileobj.write(state.objects[s3_key])
+        return len(state.objects[s3_key])
+
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: None)
+    monkeypatch.setattr(database, "SessionLocal", lambda: _Session(state.photo, state.user))
+    monkeypatch.setattr(photos, "content_cache", DiskCache(str(tmp_path)))
+    monkeypatch.setattr(s3_service, "download_object", download_object)
+
+    def login(user):
+        state.user = user
+        return {"Authorization": f"Bearer {AuthService.create_access_token({'sub': str(user.id)})}"}
+
+    state.client = TestClient(main.create_app())
+    state.url = f"/photos/{photo.id}/content"
+    state.owner, state.other, state.login = owner, other, login
+    return state
+
+
+def test_content_route_serves_the_photo_with_validators(content_client):
+    response = content_client.client.get(content_client.url)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == etag_for(content_client.photo.s3_key)
+    assert response.headers["cache-control"] == cache_control("public")
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "image/jpeg"
+
+    # 2回目はディスクキャッシュから返す
+    assert content_client.client.get(content_client.url).content == CONTENT
+    assert content_client.downloads == [content_client.photo.s3_key]
+
+
+def test_content_route_answers_matching_if_none_match_with_304(content_client):
+    etag = etag_for(content_client.photo.s3_key)
+    response = content_client.client.get(content_client.url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    assert content_client.downloads == []
+
+
+def test_content_route_ranges(content_client):
+    client, url = content_client.client, content_client.url
+    etag = etag_for(content_client.photo.s3_key)
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.content == CONTENT[100:200]
+
+    response = client.get(url, headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    # If-Range が古ければ全体を返す
+    response = client.get(url, headers={"Range": "bytes=100-199", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert "content-range" not in response.headers
+    assert response.content == CONTENT
+
+    response = client.get(url, headers={"Range": "bytes=100-199", "If-Range": etag})
+    assert response.status_code == 206
+
+
+def test_content_route_hides_private_photos_from_other_users(content_client):
+    content_client.photo.visibility = "private"
+    client, url = content_client.client, content_client.url
+
+    assert client.get(url, headers=content_client.login(content_client.other)).status_code == 403
+    assert client.get(url).status_code == 403
+    response = client.get(url, headers=content_client.login(content_client.owner))
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "private, no-cache"
+
+
+def test_content_route_returns_404_when_the_object_is_missing(content_client):
+    content_client.objects.clear()
+    assert content_client.client.get(content_client.url).status_code == 404
+
+    # 写真の行がなければオブジェクトを取りに行かずに404
+    content_client.photo = None
+    assert content_client.client.get(content_client.url).status_code == 404
@@ -0,0 +1,45 @@
+from services.db_diagnostics import THRESHOLDS, evaluate, find_duplicate_indexes
+
+
+def _index(name, columns, unique=False, constraint=False, table="users"):
+    return {"table": table, "index": name, "method": "btree", "columns": columns,
+            "opclasses": " ".join(["3125"] * len(columns.split())), "expressions": "", "predicate": "",
+            "is_unique": unique, "is_primary": False, "backs_constraint": constraint, "bytes": 8192, "scans": 0}
+
+
+def test_finds_duplicate_and_prefix_indexes():
+    indexes = [
+        _index("users_pkey", "1", unique=True, constraint=True),
+        _index("ix_users_id", "1"),
+        _index("users_email_key", "2", unique=True, constraint=True),
+        _index("idx_users_email", "2"),
+        _index("idx_photos_user_id", "2", table="photos"),
+        _index("idx_photos_user_change_seq", "2 18", table="photos"),
+    ]
+    findings = {(f["type"], f["keep"], tuple(f["drop"])) for f in find_duplicate_indexes(indexes)}
+    assert findings == {
+        ("duplicate", "users_pkey", ("ix_users_id",)),
+        ("duplicate", "users_email_key", ("idx_users_email",)),
+        ("redundant_prefix", "idx_photos_user_change_seq", ("idx_photos_user_id",)),
+    }
+
+
+def test_evaluate_applies_thresholds():
+    report = {
+        "bloat": {"tables": [{"table": "photos", "actual_bytes": 100 * 1024 * 1024, "bloat_ratio": 0.5},
+                             {"table": "users", "actual_bytes": 8192, "bloat_ratio": 0.9}], "indexes": []},
+        "indexes": {"unused": [{"table": "photos", "index": "idx_photos_visibility", "bytes": 50 * 1024 * 1024}],
+                    "duplicates": []},
+        "cache": {"database_hit_ratio": 0.995, "tables": [{"table": "photos", "heap_hit_ratio": 0.9}]},
+        "vacuum": [{"table": "sessions", "dead_tuple_ratio": 0.4, "autovacuum_lag_ratio": 1.0, "xid_age_ratio": 0.1}],
+        "statements": {"available": False},
+        "table_sizes": {"error": "permission denied"},
+    }
+    kinds = sorted((w["type"], w["target"]) for w in evaluate(report, THRESHOLDS))
+    assert kinds == [
+        ("bloat", "photos"),
+        ("cache_hit", "photos"),
+        ("collection_error", "table_sizes"),
+        ("dead_tuples", "sessions"),
+        ("unused_index", "idx_photos_visibility"),
+    ]
@@ -0,0 +1,158 @@
+from services.db_routing import ReplicaRouter
+
+
+class _Conn:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        return self
+
+    def scalar(self):
+        return self.lag
+
+
+class FakeEngine:
+    def __init__(self, lag=0.0, fail=False):
+        self.lag = lag
+        self.fail = fail
+
+    def connect(self):
+        if self.fail:
+            raise ConnectionError("replica down")
+        return _Conn(self.lag)
+
+
+def test_reads_go_to_replica_and_writes_to_primary():
+    router = ReplicaRouter(sticky_seconds=10, max_lag_seconds=5, check_interval=60)
+    engine = FakeEngine()
+    assert router.choose("GET", "u1", None, engine) == "replica"
+    assert router.choose("POST", "u1", None, engine) == "primary"
+    assert router.choose("GET", None, None, None) == "primary"
+
+
+def test_user_is_pinned_to_primary_after_write():
+    router = ReplicaRouter(sticky_seconds=10, max_lag_seconds=5, check_interval=60)
+    engine = FakeEngine()
+    router.choose("DELETE", "u1", None, engine)
+    assert router.choose("GET", "u1", None, engine) == "primary"
+    assert router.choose("GET", "u2", None, engine) == "replica"
+    assert router.choose("GET", "u2", "strong", engine) == "primary"
+
+
+def test_lagging_or_unreachable_replica_falls_back_to_primary():
+    router = ReplicaRouter(sticky_seconds=10, max_lag_seconds=5, check_interval=0)
+    assert router.choose("GET", None, None, FakeEngine(lag=30)) == "primary"
+    assert router.choose("GET", None, None, FakeEngine(fail=True)) == "primary"
+    assert router.choose("GET", None, None, FakeEngine(lag=1)) == "replica"
+
+
+class _FakeQuery:
+    def __init__(self, result):
+        self.result = result
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.result
+
+    def __iter__(self):
+        return iter([])
+
+
+class _FakeSession:
+    def __init__(self, user):
+        self.user = user
+
+    def query(self, model):
+        from models.database import User
+        return _FakeQuery(self.user if model is User else None)
+
+    def close(self):
+        pass
+
+
+def test_batch_get_does_not_pin_the_user_to_the_primary(monkeypatch):
+    import uuid
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+
+    import database
+    import main
+    from auth.auth_service import AuthService
+    from services.db_routing import replica_router
+
+    user = SimpleNamespace(id=uuid.uuid4())
+    sessions = []
+
+    def session_factory(target):
+        def create():
+            sessions.append(target)
+            return _FakeSession(user)
+        return create
+
+    writes = []
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: FakeEngine())
+    monkeypatch.setattr(database, "SessionLocal", session_factory("primary"))
+    monkeypatch.setattr(database, "ReplicaSessionLocal", session_factory("replica"))
+    monkeypatch.setattr(replica_router, "mark_write", writes.append)
+
+    token = AuthService.create_access_token({"sub": str(user.id)})
+    response = TestClient(main.create_app()).post(
+        "/photos/batch-get", json={"ids": [str(uuid.uuid4())]}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["error"] == "not_found"
+    assert writes == []
+    assert sessions == ["replica"]
+
+
+def test_login_and_register_pin_the_new_user_to_the_primary(monkeypatch):
+    import uuid
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+
+    import database
+    import main
+    from auth.auth_service import AuthService
+    from services.db_routing import replica_router
+
+    class WritableSession(_FakeSession):
+        def add(self, obj):
+            obj.id = uuid.uuid4()
+            obj.created_at = datetime.now(timezone.utc)
+
+        def commit(self):
+            pass
+
+        def refresh(self, obj):
+            pass
+
+    user = SimpleNamespace(id=uuid.uuid4())
+    writes = []
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: FakeEngine())
+    monkeypatch.setattr(database, "SessionLocal", lambda: WritableSession(None))
+    monkeypatch.setattr(replica_router, "mark_write", writes.append)
+    monkeypatch.setattr(AuthService, "hash_password", staticmethod(lambda password: "hashed"))
+    monkeypatch.setattr(AuthService, "authenticate_user", staticmethod(lambda db, email, password: user))
+    monkeypatch.setattr(AuthService, "create_session", staticmethod(lambda *args: None))
+    client = TestClient(main.create_app())
+
+    response = client.post("/auth/register", json={"email": "new@example.com", "username": "new", "password": "secret123"})
+    assert response.status_code == 201
+    assert [key for key in writes if key] == [response.json()["id"]]
+
+    response = client.post("/auth/login", json={"email": "new@example.com", "password": "secret123"})
+    assert response.status_code == 200
+    assert [key for key in writes if key][-1] == str(user.id)
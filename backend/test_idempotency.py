@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import uuid
+
+import httpx
+
+from auth.auth_service import AuthService
+from services.idempotency import IdempotencyMiddleware, IdempotencyStore, request_fingerprint
+
+
+class MemoryStore(IdempotencyStore):
+    def __init__(self):
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def claim(self, user_id, key, method, path, request_hash):
+        with self.lock:
+            row = self.rows.get((user_id, key))
+            if row is None:
+                self.rows[(user_id, key)] = {"status": "in_progress", "request_hash": request_hash}
+                return None
+            return dict(row)
+
+    def complete(self, user_id, key, status, headers, body):
+        with self.lock:
+            self.rows[(user_id, key)].update(
+                status="completed", response_status=status, response_headers=headers, response_body=body)
+
+    def release(self, user_id, key):
+        with self.lock:
+            self.rows.pop((user_id, key), None)
+
+
+def _app(calls, status=201, delay=0.0):
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await asyncio.sleep(delay)
+        body = b'{"n": %d}' % len(calls)
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def _client(app, store):
+    transport = httpx.ASGITransport(app=IdempotencyMiddleware(app, store=store))
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def _headers(key="k1"):
+    token = AuthService.create_access_token({"sub": str(uuid.uuid4())})
+    return {"Authorization": f"Bearer {token}", "Idempotency-Key": key}
+
+
+def test_retry_replays_stored_response_without_rerunning():
+    calls = []
+
+    async def scenario():
+        headers = _headers()
+        async with _client(_app(calls), MemoryStore()) as client:
+            first = await client.put("/photos/abc", content=b"{}", headers=headers)
+            second = await client.put("/photos/abc", content=b"{}", headers=headers)
+            return first, second
+
+    first, second = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert first.status_code == second.status_code == 201
+    assert second.content == first.content
+    assert second.headers["idempotent-replayed"] == "true"
+
+
+def test_concurrent_duplicates_are_coalesced():
+    calls = []
+
+    async def scenario():
+        headers = _headers()
+        async with _client(_app(calls, delay=0.1), MemoryStore()) as client:
+            return await asyncio.gather(*(
+                client.delete("/photos/abc", headers=headers) for _ in range(5)))
+
+    responses = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert {r.content for r in responses} == {b'{"n": 1}'}
+
+
+def test_same_key_with_different_body_is_rejected():
+    calls = []
+
+    async def scenario():
+        headers = _headers()
+        async with _client(_app(calls), MemoryStore()) as client:
+            await client.put("/photos/abc", content=b'{"title": "a"}', headers=headers)
+            return await client.put("/photos/abc", content=b'{"title": "b"}', headers=headers)
+
+    assert asyncio.run(scenario()).status_code == 422
+    assert len(calls) == 1
+
+
+def test_server_errors_are_not_stored():
+    calls = []
+
+    async def scenario():
+        headers = _headers()
+        async with _client(_app(calls, status=503), MemoryStore()) as client:
+            await client.put("/photos/abc", content=b"{}", headers=headers)
+            await client.put("/photos/abc", content=b"{}", headers=headers)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_fingerprint_ignores_multipart_boundary():
+    def body(boundary):
+        return (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n\r\n"
+                f"DATA\r\n--{boundary}--\r\n").encode()
+
+    a = request_fingerprint("POST", "/photos/upload", b"", "multipart/form-data; boundary=aaa111", body("aaa111"))
+    b = request_fingerprint("POST", "/photos/upload", b"", "multipart/form-data; boundary=bbb222", body("bbb222"))
+    assert a == b
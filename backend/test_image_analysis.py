@@ -0,0 +1,48 @@
+import io
+
+from PIL import Image
+
+from services.image_analysis import analyze_image
+from services.placeholder import _BASE83, blurhash_encode, compute_placeholder
+
+
+def _decode83(value: str) -> int:
+    result = 0
+    for ch in value:
+        result = result * 83 + _BASE83.index(ch)
+    return result
+
+
+def _jpeg(image: Image.Image, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", **kwargs)
+    return buffer.getvalue()
+
+
+def test_blurhash_of_solid_colour_encodes_that_colour_as_dc():
+    pixels = [(255, 0, 0)] * (8 * 6)
+    value = blurhash_encode(pixels, 8, 6)
+    assert len(value) == 2 + 4 + 2 * (4 * 3 - 1)
+    assert _decode83(value[2:6]) == 0xFF0000
+
+
+def test_placeholder_dominant_colour_prefers_largest_area():
+    image = Image.new("RGB", (100, 100), (0, 0, 255))
+    image.paste((255, 255, 0), (0, 0, 30, 30))
+    _, colour = compute_placeholder(image)
+    assert colour == "#0000ff"
+
+
+def test_analyze_image_reports_display_dimensions_for_rotated_jpeg():
+    image = Image.new("RGB", (400, 200), (10, 120, 200))
+    exif = image.getexif()
+    exif[0x0112] = 6  # 90度回転して表示
+    features = analyze_image(_jpeg(image, exif=exif.tobytes()))
+    assert (features["width"], features["height"]) == (200, 400)
+    assert features["blurhash"] and features["dominant_color"].startswith("#")
+    assert features["phash"] is not None
+
+
+def test_analyze_image_tolerates_invalid_bytes():
+    features = analyze_image(b"not an image")
+    assert all(value is None for value in features.values())
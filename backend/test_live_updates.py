@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import geohash
+from services.live_updates import LiveHub, Subscriber
+
+
+def test_geohash_encode_and_bbox():
+    cell = geohash.encode(35.681236, 139.767125, 7)
+    assert cell == "xn76urx"
+    min_lat, min_lng, max_lat, max_lng = geohash.bbox(cell)
+    assert min_lat <= 35.681236 <= max_lat and min_lng <= 139.767125 <= max_lng
+
+
+def test_cells_for_radius_cover_the_circle_edges():
+    cells = set(geohash.cells_for_radius(35.68, 139.76, 3, 5))
+    for dlat, dlng in [(0.026, 0), (-0.026, 0), (0, 0.033), (0, -0.033)]:
+        assert geohash.encode(35.68 + dlat, 139.76 + dlng, 5) in cells
+
+
+def test_publish_reaches_only_subscribers_of_the_cell():
+    async def scenario():
+        hub = LiveHub(precision=5, max_cells=10)
+        near, far = Subscriber(), Subscriber()
+        for subscriber in (near, far):
+            hub.register(subscriber)
+        hub.set_cells(near, [geohash.encode(35.68, 139.76, 5)])
+        hub.set_cells(far, [geohash.encode(34.69, 135.50, 5)])
+
+        delivered = hub.publish_local({"id": "p1", "lat": 35.68, "lng": 139.76})
+        return delivered, json.loads(near.queue.get_nowait()), far.queue.empty()
+
+    delivered, message, far_empty = asyncio.run(scenario())
+    assert delivered == 1
+    assert message == {"type": "photo", "photo": {"id": "p1", "lat": 35.68, "lng": 139.76}}
+    assert far_empty
+
+
+def test_slow_consumer_is_dropped_and_unsubscribed():
+    async def scenario():
+        hub = LiveHub(precision=5, max_cells=10)
+        slow = Subscriber(queue_size=2)
+        hub.register(slow)
+        hub.set_cells(slow, [geohash.encode(35.68, 139.76, 5)])
+        for i in range(3):
+            hub.publish_local({"id": f"p{i}", "lat": 35.68, "lng": 139.76})
+        return slow
+
+    slow = asyncio.run(scenario())
+    assert slow.dropped and slow.cells == set()
+    assert slow.queue.get_nowait() is None
+
+
+def test_invalid_cells_are_rejected():
+    hub = LiveHub(precision=5, max_cells=2)
+    subscriber = Subscriber.__new__(Subscriber)
+    subscriber.cells = set()
+    with pytest.raises(ValueError):
+        hub.set_cells(subscriber, ["xn76"])
+    with pytest.raises(ValueError):
+        hub.set_cells(subscriber, ["xn76u", "xn76v", "xn76y"])
+
+
+def test_websocket_subscribe_by_radius():
+    from main import create_app
+
+    with TestClient(create_app()).websocket_connect("/photos/live") as ws:
+        ws.send_text(json.dumps({"type": "subscribe", "lat": 35.68, "lng": 139.76, "radius_km": 1}))
+        reply = ws.receive_json()
+        assert reply["type"] == "subscribed"
+        assert geohash.encode(35.68, 139.76, 5) in reply["cells"]
+
+        ws.send_text(json.dumps({"type": "subscribe", "cells": ["bad!"]}))
+        assert ws.receive_json()["type"] == "error"
+
+        # オブジェクト以外のJSONでも切断せずにエラーを返す
+        for message in ("[]", "1", "null", '"subscribe"'):
+            ws.send_text(message)
+            assert ws.receive_json()["type"] == "error"
+        ws.send_text(json.dumps({"type": "subscribe", "cells": ["xn76u"]}))
+        assert ws.receive_json() == {"type": "subscribed", "cells": ["xn76u"]}
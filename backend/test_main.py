@@ -7,7 +7,7 @@ client = TestClient(app)
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"message": "Mobile App API is running!"}
+    assert response.json() == {"message": "Photo Sharing API is running!", "version": "1.0.0"}
 
 def test_health_check():
     response = client.get("/health")
@@ -16,15 +16,10 @@ def test_health_check():
     assert data["status"] == "healthy"
     assert "timestamp" in data
 
-def test_create_user():
-    user_data = {
-        "name": "Test User",
-        "email": "test@example.com"
-    }
-    response = client.post("/users/", json=user_data)
-    assert response.status_code == 200
-    data = response.json()
-    assert data["name"] == user_data["name"]
-    assert data["email"] == user_data["email"]
-    assert "id" in data
-    assert "created_at" in data
+def test_me_requires_authentication():
+    response = client.get("/auth/me")
+    assert response.status_code == 403
+
+def test_upload_requires_authentication():
+    response = client.post("/photos/upload", files={"file": ("a.png", b"data", "image/png")})
+    assert response.status_code == 403
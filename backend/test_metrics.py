@@ -0,0 +1,55 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from main import app
+from services import metrics
+
+client = TestClient(app)
+
+
+def test_server_timing_header_breaks_down_request():
+    response = client.get("/health")
+    assert response.status_code == 200
+    segments = [part.split(";")[0].strip() for part in response.headers["server-timing"].split(",")]
+    assert segments == ["db", "storage", "auth", "render", "total"]
+
+
+def test_metrics_endpoint_exposes_route_histogram():
+    client.get("/health")
+    body = client.get("/metrics").text
+    assert "# TYPE photoapi_http_request_duration_seconds histogram" in body
+    assert 'photoapi_http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in body
+
+
+def test_unknown_paths_share_one_label():
+    client.get("/no/such/path")
+    assert metrics.http_request_duration.count(method="GET", route="unmatched", status="404") >= 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "test", ["op"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, op="x")
+    lines = histogram.render()
+    assert 'photoapi_test_seconds_bucket{op="x",le="0.1"} 1' in lines
+    assert 'photoapi_test_seconds_bucket{op="x",le="1"} 2' in lines
+    assert 'photoapi_test_seconds_bucket{op="x",le="+Inf"} 3' in lines
+    assert 'photoapi_test_seconds_count{op="x"} 3' in lines
+
+
+def test_engine_hooks_count_queries_in_request_context():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    timings = metrics.RequestTimings()
+    token = metrics._current.set(timings)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        with metrics.track("storage", "put_object"):
+            pass
+    finally:
+        metrics._current.reset(token)
+    assert timings.db_queries == 2
+    assert timings.segments["db"] > 0
+    assert "storage" in timings.segments
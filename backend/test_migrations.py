@@ -0,0 +1,100 @@
+"""
+マイグレーションのテスト
+
+SQL出力モード（alembic upgrade head --sql）で生成されるSQLと、モデルのインデックス定義との一致を確認する。
+MIGRATION_TEST_DATABASE_URL に空のPostGISを指定した場合は、実際に適用してモデルとの差分がないことも確認する。
+"""
+import io
+import os
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from services import photo_partitions, schema_drift
+
+MIGRATION_TEST_DATABASE_URL = os.getenv("MIGRATION_TEST_DATABASE_URL")
+
+
+def alembic_config(**attributes) -> Config:
+    config = Config(schema_drift.ALEMBIC_INI, output_buffer=io.StringIO())
+    config.attributes["configure_logger"] = False
+    config.attributes.update(attributes)
+    return config
+
+
+@pytest.fixture(scope="module")
+def upgrade_sql() -> str:
+    config = alembic_config()
+    command.upgrade(config, "head", sql=True)
+    return config.output_buffer.getvalue()
+
+
+def test_revisions_form_a_single_line():
+    assert schema_drift.head_revision() == "0004"
+
+
+def test_indexes_are_built_concurrently_outside_transactions(upgrade_sql):
+    index_sql = upgrade_sql[upgrade_sql.index("idx_photos_user_created_at") - 200:]
+    assert "COMMIT" in index_sql.split("CREATE INDEX CONCURRENTLY", 1)[0]
+    for name in ("idx_photos_user_created_at", "idx_photos_public_created_at", "idx_photos_public_location"):
+        assert f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON photos" in upgrade_sql
+    for name in ("idx_photos_user_id", "idx_photos_visibility", "idx_users_email"):
+        assert f"DROP INDEX CONCURRENTLY IF EXISTS {name}" in upgrade_sql
+    assert "USING gist (location) WHERE visibility = 'public' AND location IS NOT NULL" in upgrade_sql
+
+
+def test_model_indexes_match_the_migrations():
+    import models.database  # noqa: F401
+    from database import Base
+
+    migrated = {}
+    script = ScriptDirectory.from_config(alembic_config())
+    baseline = script.get_revision("0001").module
+    indexes = script.get_revision("0003").module
+    for statement in baseline.STATEMENTS:
+        if statement.startswith("CREATE INDEX"):
+            name, table = statement.split()[5], statement.split()[7].split("(")[0]
+            migrated.setdefault(table, set()).add(name)
+    migrated["photos"] -= {name for name, *_ in indexes.REDUNDANT_PHOTO_INDEXES}
+    migrated["photos"] |= {name for name, *_ in indexes.NEW_PHOTO_INDEXES}
+    migrated["users"] -= {name for name, *_ in indexes.REDUNDANT_USER_INDEXES}
+
+    for table in Base.metadata.sorted_tables:
+        assert {index.name for index in table.indexes} == migrated.get(table.name, set()), table.name
+
+
+def test_partitioned_indexes_are_built_per_partition_and_attached():
+    statements = photo_partitions.concurrent_index_ddl(
+        "idx_photos_public_created_at", "created_at", where="visibility = 'public'",
+        partitions=["photos_p202511", "photos_pdefault"])
+    assert statements[0] == (
+        "CREATE INDEX IF NOT EXISTS idx_photos_public_created_at ON ONLY photos (created_at) WHERE visibility = 'public'")
+    assert statements[1].startswith(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_photos_public_created_at_photos_p202511 ON photos_p202511")
+    assert statements[2] == "ALTER INDEX idx_photos_public_created_at ATTACH PARTITION idx_photos_public_created_at_photos_p202511"
+    assert len(statements) == 5
+    assert photo_partitions.drop_index_ddl("idx_photos_user_id", partitioned=True) == "DROP INDEX IF EXISTS idx_photos_user_id"
+
+
+def test_partitions_and_postgis_tables_are_not_drift():
+    assert not schema_drift.include_object(None, "photos_p202511", "table", True, None)
+    assert not schema_drift.include_object(None, "photos_legacy", "table", True, None)
+    assert not schema_drift.include_object(None, "spatial_ref_sys", "table", True, None)
+    assert schema_drift.include_object(None, "photo_albums", "table", True, None)
+    assert not schema_drift.include_object(None, "idx_photos_storage_key", "index", True, None)
+
+
+@pytest.mark.skipif(not MIGRATION_TEST_DATABASE_URL, reason="MIGRATION_TEST_DATABASE_URL が未設定")
+def test_migrated_database_matches_the_models():
+    from sqlalchemy import create_engine
+
+    engine = create_engine(MIGRATION_TEST_DATABASE_URL)
+    with engine.connect() as conn:
+        command.upgrade(alembic_config(connection=conn), "head")
+        conn.commit()
+        result = schema_drift.check(conn)
+    engine.dispose()
+    assert result["at_head"]
+    assert result["drift"] == []
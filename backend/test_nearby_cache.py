@@ -0,0 +1,119 @@
+import uuid
+from datetime import datetime, timedelta
+
+from services import geohash
+from services.nearby_cache import NearbyCache, distance_km, precision_for_radius
+from services.response_cache import InProcessBackend
+
+TOKYO = (35.6812, 139.7671)
+BASE = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def photo(lat, lng, minutes, visibility="public", user_id=None):
+    return {
+        "id": str(uuid.uuid4()), "user_id": str(user_id or uuid.uuid4()), "lat": lat, "lng": lng,
+        "visibility": visibility, "created_at": (BASE + timedelta(minutes=minutes)).isoformat(),
+    }
+
+
+class FakeStore:
+    """load_cell の代わり（セル内の写真を新しい順に返し、呼び出し回数を数える）"""
+
+    def __init__(self, photos):
+        self.photos = photos
+        self.calls = 0
+
+    def __call__(self, db, cell, scope, limit):
+        self.calls += 1
+        min_lat, min_lng, max_lat, max_lng = geohash.bbox(cell)
+        matched = [
+            p for p in self.photos
+            if min_lat <= p["lat"] <= max_lat and min_lng <= p["lng"] <= max_lng
+            and (p["visibility"] == scope or scope == f"private:{p['user_id']}" and p["visibility"] == "private")
+        ]
+        return sorted(matched, key=lambda p: p["created_at"], reverse=True)[:limit]
+
+
+def make_cache(store, **kwargs):
+    return NearbyCache(backend=InProcessBackend(), ttl=60, load=store, **kwargs)
+
+
+def test_precision_cells_are_at_least_as_large_as_the_radius():
+    assert precision_for_radius(TOKYO[0], 0.1) == 7
+    assert precision_for_radius(TOKYO[0], 1.0) == 5
+    assert precision_for_radius(TOKYO[0], 100.0) == 3
+    for radius in (0.1, 0.5, 1, 5, 20, 100):
+        cells = geohash.cells_for_radius(*TOKYO, radius, precision_for_radius(TOKYO[0], radius))
+        assert len(cells) <= 9
+
+
+def test_nearby_requests_share_cells_and_filter_exactly():
+    lat, lng = TOKYO
+    near = photo(lat + 0.003, lng, minutes=1)      # 約330m
+    nearer = photo(lat, lng + 0.001, minutes=2)    # 約90m
+    far = photo(lat + 0.02, lng, minutes=3)        # 約2.2km
+    store = FakeStore([near, nearer, far])
+    cache = make_cache(store)
+
+    photos, status = cache.lookup(None, lat, lng, 1.0, 50)
+    assert [p["id"] for p in photos] == [nearer["id"], near["id"]]
+    assert status == "MISS"
+    loads = store.calls
+
+    # 少しずれた座標でも同じセルを使うのでDBを読まない
+    photos, status = cache.lookup(None, lat + 0.0005, lng - 0.0004, 1.0, 1)
+    assert [p["id"] for p in photos] == [nearer["id"]]
+    assert status == "HIT"
+    assert store.calls == loads
+    assert distance_km(lat, lng, far["lat"], far["lng"]) > 2
+
+
+def test_private_photos_are_only_visible_to_their_owner():
+    owner = uuid.uuid4()
+    mine = photo(*TOKYO, minutes=1, visibility="private", user_id=owner)
+    unlisted = photo(*TOKYO, minutes=2, visibility="unlisted")
+    cache = make_cache(FakeStore([mine, unlisted]))
+
+    assert cache.lookup(None, *TOKYO, 1.0, 50)[0] == []
+    assert [p["id"] for p in cache.lookup(None, *TOKYO, 1.0, 50, owner)[0]] == [unlisted["id"], mine["id"]]
+    assert [p["id"] for p in cache.lookup(None, *TOKYO, 1.0, 50, uuid.uuid4())[0]] == [unlisted["id"]]
+
+
+def test_invalidation_only_reloads_the_written_cell():
+    tokyo = photo(*TOKYO, minutes=1)
+    osaka = photo(34.7025, 135.4959, minutes=1)
+    store = FakeStore([tokyo, osaka])
+    cache = make_cache(store)
+    cache.lookup(None, *TOKYO, 1.0, 50)
+    cache.lookup(None, osaka["lat"], osaka["lng"], 1.0, 50)
+
+    added = photo(TOKYO[0] + 0.001, TOKYO[1], minutes=5)
+    store.photos.append(added)
+    cache.invalidate(added["lat"], added["lng"])
+
+    photos, status = cache.lookup(None, *TOKYO, 1.0, 50)
+    assert [p["id"] for p in photos] == [added["id"], tokyo["id"]]
+    assert status == "MISS"
+    assert cache.lookup(None, osaka["lat"], osaka["lng"], 1.0, 50)[1] == "HIT"
+
+
+def test_truncated_cells_fall_back_when_older_photos_could_be_missing():
+    # 同じセルの西端に古い写真（円の中）、東端に新しい写真（円の外）
+    min_lat, min_lng, max_lat, max_lng = geohash.bbox(geohash.encode(*TOKYO, precision_for_radius(TOKYO[0], 0.5)))
+    lat = (min_lat + max_lat) / 2
+    inside = photo(lat, min_lng + 0.0001, minutes=1)
+    outside = [photo(lat, max_lng - 0.0001, minutes=100 + i) for i in range(5)]
+    cache = make_cache(FakeStore(outside + [inside]), max_photos=3)
+
+    assert cache.lookup(None, lat, min_lng + 0.0002, 0.5, 10) is None
+    assert [p["id"] for p in make_cache(FakeStore(outside + [inside])).lookup(
+        None, lat, min_lng + 0.0002, 0.5, 10)[0]] == [inside["id"]]
+
+
+def test_truncated_cells_are_used_when_the_newest_results_are_complete():
+    lat, lng = TOKYO
+    photos = [photo(lat, lng + i * 0.0001, minutes=i) for i in range(10)]
+    cache = make_cache(FakeStore(photos), max_photos=5)
+
+    result, _ = cache.lookup(None, lat, lng, 1.0, 3)
+    assert [p["id"] for p in result] == [p["id"] for p in photos[::-1][:3]]
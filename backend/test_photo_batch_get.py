@@ -0,0 +1,115 @@
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+
+
+def _photo(owner, visibility):
+    return SimpleNamespace(
+        id=uuid.uuid4(), user_id=owner.id, s3_key=f"photos/{uuid.uuid4()}.jpg", mime_type="image/jpeg",
+        size_bytes=100, exif=None, created_at=datetime(2024, 5, 1, tzinfo=timezone.utc), visibility=visibility,
+        title=None, description=None, lat=None, lng=None, accuracy_m=None, address=None, taken_at=None)
+
+
+class _PhotoQuery:
+    def __init__(self, session):
+        self.session = session
+        self.ids = None
+
+    def filter(self, criterion):
+        # Photo.id = ANY(:ids) に渡された配列を取り出す
+        self.ids = criterion.compile(dialect=postgresql.dialect()).params["ids"]
+        self.session.queried.append(self.ids)
+        return self
+
+    def __iter__(self):
+        return iter([self.session.photos[i] for i in self.ids if i in self.session.photos])
+
+
+class _Session:
+    def __init__(self, state):
+        self.photos = state.photos
+        self.user = state.user
+        self.queried = state.queried
+
+    def query(self, model):
+        from models.database import User
+        if model is User:
+            return SimpleNamespace(filter=lambda *criteria: SimpleNamespace(first=lambda: self.user))
+        return _PhotoQuery(self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    import database
+    import main
+    from auth.auth_service import AuthService
+    from services.s3_service import s3_service
+
+    owner, other = SimpleNamespace(id=uuid.uuid4()), SimpleNamespace(id=uuid.uuid4())
+    state = SimpleNamespace(photos={}, keys={}, user=None, queried=[], presigned=[])
+    for name, user, visibility in (("mine_private", owner, "private"), ("mine_public", owner, "public"),
+                                   ("theirs_private", other, "private"), ("theirs_unlisted", other, "unlisted")):
+        photo = _photo(user, visibility)
+        state.photos[photo.id] = photo
+        # ルートは署名付きURLで s3_key を上書きするので元のキーを控えておく
+        state.keys[photo.id] = photo.s3_key
+        setattr(state, name, photo)
+
+    def presign(key):
+        state.presigned.append(key)
+        return f"https://signed.example/{key}"
+
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: None)
+    monkeypatch.setattr(database, "SessionLocal", lambda: _Session(state))
+    monkeypatch.setattr(s3_service, "get_presigned_url", presign)
+
+    client = TestClient(main.create_app())
+
+    def post(ids, user=None):
+        state.user = user
+        headers = {}
+        if user is not None:
+            headers["Authorization"] = f"Bearer {AuthService.create_access_token({'sub': str(user.id)})}"
+        return client.post("/photos/batch-get", json={"ids": [str(i) for i in ids]}, headers=headers)
+
+    state.owner, state.other, state.post = owner, other, post
+    return state
+
+
+def test_items_follow_the_request_order_with_per_id_errors(batch):
+    missing = uuid.uuid4()
+    ids = [batch.theirs_unlisted.id, missing, batch.mine_private.id, batch.theirs_private.id, batch.mine_public.id]
+    response = batch.post(ids, user=batch.owner)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["id"] for item in items] == [str(i) for i in ids]
+    assert [item["error"] for item in items] == [None, "not_found", None, "forbidden", None]
+    assert items[3]["photo"] is None
+    assert items[2]["photo"]["s3_key"] == f"https://signed.example/{batch.keys[batch.mine_private.id]}"
+
+
+def test_private_photos_are_forbidden_without_login(batch):
+    items = batch.post([batch.mine_private.id, batch.mine_public.id]).json()["items"]
+    assert [item["error"] for item in items] == ["forbidden", None]
+
+
+def test_duplicate_ids_are_queried_and_signed_once(batch):
+    ids = [batch.mine_public.id, batch.mine_public.id, batch.theirs_unlisted.id, batch.mine_public.id]
+    items = batch.post(ids).json()["items"]
+    assert [item["id"] for item in items] == [str(i) for i in ids]
+    assert batch.queried == [[batch.mine_public.id, batch.theirs_unlisted.id]]
+    assert sorted(batch.presigned) == sorted([batch.keys[batch.mine_public.id], batch.keys[batch.theirs_unlisted.id]])
+
+
+def test_id_count_is_limited(batch):
+    assert batch.post([uuid.uuid4() for _ in range(501)]).status_code == 422
+    assert batch.post([]).status_code == 422
+    assert batch.queried == []
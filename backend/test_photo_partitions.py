@@ -0,0 +1,30 @@
+from datetime import date
+
+from services.photo_partitions import (
+    _retarget_index, add_months, iter_months, partition_ddl, partition_name,
+)
+
+
+def test_add_months_rolls_over_year():
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+
+
+def test_iter_months_includes_both_ends():
+    months = list(iter_months(date(2025, 11, 15), date(2026, 1, 1)))
+    assert months == [date(2025, 11, 1), date(2025, 12, 1), date(2026, 1, 1)]
+
+
+def test_partition_ddl_covers_one_month():
+    assert partition_name(date(2025, 12, 1)) == "photos_p202512"
+    assert partition_ddl(date(2025, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS photos_p202512 PARTITION OF photos "
+        "FOR VALUES FROM ('2025-12-01') TO ('2026-01-01')"
+    )
+
+
+def test_retarget_index_moves_definition_to_new_table():
+    definition = "CREATE INDEX idx_photos_location ON public.photos USING gist (location)"
+    assert _retarget_index(definition, "idx_photos_location", "idx_photos_location_p", "photos_p") == (
+        "CREATE INDEX idx_photos_location_p ON photos_p USING gist (location)"
+    )
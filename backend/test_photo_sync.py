@@ -0,0 +1,22 @@
+from services.photo_sync import merge_changes
+
+
+def test_merge_orders_updates_and_deletions_by_sequence():
+    result = merge_changes([(3, "p3"), (7, "p7")], [(5, "d5")], after=2, limit=10)
+    assert result == {"changes": ["p3", "p7"], "deleted": ["d5"], "next_cursor": 7, "has_more": False}
+
+
+def test_merge_cuts_at_limit_and_resumes_from_last_sequence():
+    photos = [(1, "p1"), (4, "p4"), (6, "p6")]
+    tombstones = [(2, "d2"), (5, "d5")]
+    first = merge_changes(photos, tombstones, after=0, limit=3)
+    assert first["changes"] == ["p1", "p4"] and first["deleted"] == ["d2"]
+    assert first["next_cursor"] == 4 and first["has_more"]
+
+    rest = merge_changes([p for p in photos if p[0] > 4], [t for t in tombstones if t[0] > 4],
+                         after=first["next_cursor"], limit=3)
+    assert rest["changes"] == ["p6"] and rest["deleted"] == ["d5"] and not rest["has_more"]
+
+
+def test_empty_result_keeps_cursor():
+    assert merge_changes([], [], after=42, limit=10)["next_cursor"] == 42
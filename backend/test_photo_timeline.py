@@ -0,0 +1,59 @@
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services import photo_timeline
+
+JST = timezone(timedelta(hours=9))
+
+
+class RecordingSession:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+
+
+def _photo(visibility="private", taken_at=None, created_at=None):
+    return SimpleNamespace(user_id=uuid.uuid4(), visibility=visibility, taken_at=taken_at, created_at=created_at)
+
+
+def test_photos_are_counted_on_the_utc_day_they_were_taken():
+    assert photo_timeline.photo_day(datetime(2024, 5, 1, 8, 0, tzinfo=JST)) == date(2024, 4, 30)
+    assert photo_timeline.photo_day(None, datetime(2024, 5, 1, 23, 0, tzinfo=timezone.utc)) == date(2024, 5, 1)
+    assert photo_timeline.photo_day(datetime(2024, 5, 1, 23, 0)) == date(2024, 5, 1)
+    assert photo_timeline.photo_day(None, None) == datetime.now(timezone.utc).date()
+
+
+def test_added_photos_are_upserted_per_day():
+    db = RecordingSession()
+    days = [date(2024, 5, 1), date(2024, 5, 1), date(2024, 5, 2)]
+    photo_timeline.record_photos_added(db, uuid.uuid4(), "public", days)
+    (sql, params), = db.statements
+    assert "ON CONFLICT (user_id, visibility, day) DO UPDATE SET photo_count = " \
+           "(photo_timeline_days.photo_count + excluded.photo_count)" in sql
+    assert [params["photo_count_m0"], params["photo_count_m1"]] == [2, 1]
+
+
+def test_visibility_change_moves_the_count_without_going_negative():
+    db = RecordingSession()
+    photo = _photo(taken_at=datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc))
+    photo_timeline.record_visibility_changed(db, photo, "private", "public")
+    (insert_sql, insert_params), (update_sql, update_params) = db.statements
+    assert insert_params["visibility_m0"] == "public"
+    assert update_sql.startswith("UPDATE photo_timeline_days SET photo_count=greatest(")
+    assert update_params["visibility_1"] == "private" and update_params["photo_count_1"] == -1
+
+    db = RecordingSession()
+    photo_timeline.record_visibility_changed(db, photo, "public", "public")
+    assert db.statements == []
+
+
+def test_unknown_granularity_is_rejected():
+    with pytest.raises(ValueError):
+        photo_timeline.histogram(RecordingSession(), uuid.uuid4(), "week")
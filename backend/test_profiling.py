@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import auth_service
+from auth.auth_service import AuthService
+from services.profiling import ProfileStore, ProfilingMiddleware, RequestProfile, Sampler
+
+
+def busy_on_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def busy_in_thread(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def _client(tmp_path, sample_rate):
+    app = FastAPI()
+
+    @app.get("/loop")
+    async def loop():
+        busy_on_loop(0.15)
+        return {}
+
+    @app.get("/thread")
+    def thread():
+        busy_in_thread(0.15)
+        return {}
+
+    @app.get("/sleep")
+    async def sleep():
+        await asyncio.sleep(0.15)
+        return {}
+
+    store = ProfileStore(str(tmp_path), max_profiles=3)
+    app.add_middleware(ProfilingMiddleware, sample_rate=sample_rate, sampler=Sampler(interval_ms=2), store=store)
+    return TestClient(app), store
+
+
+def _folded(store, response):
+    profile_id = response.headers["x-profile-id"]
+    with open(store.folded_path(profile_id), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_samples_are_attributed_to_the_loop_the_threadpool_and_awaits(tmp_path):
+    client, store = _client(tmp_path, sample_rate=1.0)
+
+    folded = _folded(store, client.get("/loop"))
+    assert "busy_on_loop (test_profiling.py:" in folded
+    assert "[thread]" not in folded
+
+    folded = _folded(store, client.get("/thread"))
+    assert ";[thread];" in folded
+    assert "busy_in_thread (test_profiling.py:" in folded
+
+    folded = _folded(store, client.get("/sleep"))
+    assert "_client.<locals>.sleep (test_profiling.py:" in folded
+    assert folded.splitlines()[-1].rsplit(" ", 1)[0].endswith(";[await]")
+
+    summaries = store.list()
+    assert [s["path"] for s in summaries] == ["/sleep", "/thread", "/loop"]
+    assert summaries[0]["status"] == 200 and summaries[0]["trigger"] == "sampled"
+    assert summaries[0]["samples"] > 10
+
+
+def test_only_admins_can_request_a_profile(tmp_path, monkeypatch):
+    client, store = _client(tmp_path, sample_rate=0)
+    admin, other = str(uuid.uuid4()), str(uuid.uuid4())
+    monkeypatch.setattr(auth_service, "ADMIN_USER_IDS", {admin})
+
+    def get(user_id):
+        token = AuthService.create_access_token({"sub": user_id})
+        return client.get("/loop", headers={"X-Profile": "1", "Authorization": f"Bearer {token}"})
+
+    assert "x-profile-id" not in client.get("/loop").headers
+    assert "x-profile-id" not in get(other).headers
+    assert "x-profile-id" not in client.get("/loop", headers={"X-Profile": "1"}).headers
+    response = get(admin)
+    assert store.list()[0]["id"] == response.headers["x-profile-id"]
+    assert store.list()[0]["trigger"] == "header"
+
+
+def test_old_profiles_are_pruned_and_ids_are_validated(tmp_path):
+    client, store = _client(tmp_path, sample_rate=1.0)
+    ids = [client.get("/loop").headers["x-profile-id"] for _ in range(5)]
+    assert [s["id"] for s in store.list()] == ids[:1:-1]
+    assert store.folded_path(ids[0]) is None
+    assert store.folded_path("../" + ids[-1]) is None
+
+
+def test_profile_endpoints_are_only_registered_when_enabled(monkeypatch):
+    import main
+    from services import profiling
+
+    assert TestClient(main.create_app()).get("/admin/profiles").status_code == 404
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    # 認証なしでは一覧を取得できない
+    assert TestClient(main.create_app()).get("/admin/profiles").status_code == 403
+
+
+class _BlockingFrames(dict):
+    """sample() の途中で止めるためのフレーム表"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def get(self, key, default=None):
+        self.entered.set()
+        self.release.wait(5)
+        return default
+
+
+def test_finishing_waits_for_an_in_progress_sample():
+    task = type("Task", (), {"get_coro": lambda self: None})()
+    profile = RequestProfile("GET", "/", "sampled", None, task, threading.get_ident())
+    frames = _BlockingFrames()
+    sampling = threading.Thread(target=profile.sample, args=(frames, {}))
+    sampling.start()
+    assert frames.entered.wait(5)
+
+    finishing = threading.Thread(target=profile.finish, args=(1.0,))
+    finishing.start()
+    finishing.join(0.1)
+    # サンプル中は保存に進まない
+    assert finishing.is_alive()
+    frames.release.set()
+    sampling.join(5)
+    finishing.join(5)
+    assert profile.folded() == "[await] 1\n"
+
+    # 終了後のサンプルは捨てる
+    profile.sample({}, {})
+    assert profile.samples == 1 and profile.duration_ms == 1.0
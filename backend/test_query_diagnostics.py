@@ -0,0 +1,52 @@
+from sqlalchemy import create_engine, text
+
+from services import query_diagnostics
+from services.query_diagnostics import (
+    QueryDiagnostics, _RequestState, find_seq_scans, normalize_statement,
+)
+
+
+def test_normalize_statement_ignores_literals_and_in_list_length():
+    a = normalize_statement("SELECT * FROM photos WHERE id IN (%(id_1_1)s, %(id_1_2)s) AND x = 'a'")
+    b = normalize_statement("SELECT *  FROM photos\n WHERE id IN (%(id_1_1)s) AND x = 'bb'")
+    assert a == b
+
+
+def test_find_seq_scans_walks_nested_plans():
+    plan = {"Plan": {"Node Type": "Limit", "Plans": [
+        {"Node Type": "Sort", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "photos"}]},
+        {"Node Type": "Index Scan", "Relation Name": "users"},
+    ]}}
+    assert find_seq_scans(plan) == ["photos"]
+
+
+def test_repeated_statement_shape_is_flagged_as_n_plus_one():
+    diagnostics = QueryDiagnostics(slow_query_ms=10_000, n_plus_one_threshold=3, explain=False)
+    engine = create_engine("sqlite://")
+    diagnostics.instrument_engine(engine)
+
+    state = _RequestState("GET", "/photos/")
+    token = query_diagnostics._request.set(state)
+    try:
+        with engine.connect() as conn:
+            for i in range(5):
+                conn.execute(text(f"SELECT {i}"))
+    finally:
+        query_diagnostics._request.reset(token)
+    diagnostics.finish_request(state)
+
+    [record] = diagnostics.n_plus_one
+    assert record["count"] == 5
+    assert record["route"] == "GET /photos/"
+
+
+def test_slow_statement_is_recorded_with_parameters():
+    diagnostics = QueryDiagnostics(slow_query_ms=0, explain=False)
+    engine = create_engine("sqlite://")
+    diagnostics.instrument_engine(engine)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT :value"), {"value": 42})
+
+    record = diagnostics.slow_queries[-1]
+    assert record["event"] == "slow_query"
+    assert "42" in str(record["parameters"])
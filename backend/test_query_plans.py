@@ -0,0 +1,138 @@
+"""
+クエリプランの回帰テスト
+
+PLAN_TEST_DATABASE_URL に benchmarks.generate で本番規模のデータを入れたPostGISを指定したときだけ実行する。
+各エンドポイントのクエリの形を EXPLAIN し、photos をSeq Scanしていないこと、
+推定コスト・行数が予算内であることを確認する（インデックスの削除や条件の書き換えをデプロイ前に検出する）。
+"""
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from services.query_diagnostics import find_seq_scans
+
+PLAN_TEST_DATABASE_URL = os.getenv("PLAN_TEST_DATABASE_URL")
+# この件数より少ないとプランナーがSeq Scanを選ぶのが正しいため、テストにならない
+MIN_PHOTOS = int(os.getenv("PLAN_TEST_MIN_PHOTOS", "200000"))
+# 予算はデータ量に依存するので、規模を変える場合は倍率で調整する
+BUDGET_FACTOR = float(os.getenv("PLAN_TEST_BUDGET_FACTOR", "1"))
+
+pytestmark = pytest.mark.skipif(not PLAN_TEST_DATABASE_URL, reason="PLAN_TEST_DATABASE_URL が未設定")
+
+TOKYO = (35.6812, 139.7671)
+
+
+@pytest.fixture(scope="module")
+def db():
+    from psycopg2.extras import register_uuid
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+
+    # EXPLAIN はドライバに直接パラメータを渡すため、UUIDをそのまま渡せるようにする
+    register_uuid()
+    engine = create_engine(PLAN_TEST_DATABASE_URL)
+    session = sessionmaker(bind=engine)()
+    photos = session.execute(text("SELECT reltuples FROM pg_class WHERE relname = 'photos'")).scalar() or 0
+    if photos < MIN_PHOTOS:
+        session.close()
+        pytest.skip(f"photos が {int(photos)} 件しかありません（python -m benchmarks.generate で投入）")
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def heavy_user(db):
+    """写真が最も多いユーザー（べき分布の裾。最悪ケースのプランを見る）"""
+    from sqlalchemy import text
+
+    user_id = db.execute(text("SELECT user_id FROM user_stats ORDER BY photo_count DESC LIMIT 1")).scalar()
+    return SimpleNamespace(id=user_id)
+
+
+def explain(db, query) -> dict:
+    statement = query.statement if hasattr(query, "statement") else query
+    compiled = statement.compile(dialect=db.bind.dialect)
+    plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    return plan[0]["Plan"]
+
+
+def assert_plan(plan: dict, max_cost: float, max_rows: float):
+    assert "photos" not in find_seq_scans({"Plan": plan}), plan
+    assert plan["Total Cost"] <= max_cost * BUDGET_FACTOR, plan
+    assert plan["Plan Rows"] <= max_rows, plan
+
+
+def test_public_feed_page(db):
+    from models.database import Photo
+    from routers.photos import photo_list_query
+
+    query = photo_list_query(db, None, None, None).order_by(Photo.created_at.desc()).limit(20)
+    assert_plan(explain(db, query), max_cost=5_000, max_rows=20)
+
+
+def test_public_feed_for_a_month(db):
+    from models.database import Photo
+    from routers.photos import photo_list_query
+
+    before = datetime.now(timezone.utc)
+    query = photo_list_query(db, None, None, None, before - timedelta(days=30), before)
+    assert_plan(explain(db, query.order_by(Photo.created_at.desc()).limit(20)), max_cost=5_000, max_rows=20)
+
+
+def test_own_library_page_and_count(db, heavy_user):
+    from sqlalchemy import func, select
+
+    from models.database import Photo
+    from routers.photos import photo_list_query
+
+    query = photo_list_query(db, None, None, heavy_user)
+    assert_plan(explain(db, query.order_by(Photo.created_at.desc()).limit(20)), max_cost=50_000, max_rows=20)
+    # Query.count() と同じ形
+    count = select(func.count()).select_from(query.statement.subquery())
+    assert_plan(explain(db, count), max_cost=50_000, max_rows=1)
+
+
+def test_other_users_public_photos(db, heavy_user):
+    from models.database import Photo
+    from routers.photos import photo_list_query
+
+    query = photo_list_query(db, None, heavy_user.id, None)
+    assert_plan(explain(db, query.order_by(Photo.created_at.desc()).limit(20)), max_cost=50_000, max_rows=20)
+
+
+@pytest.mark.parametrize("signed_in", [False, True])
+def test_nearby_uses_the_location_index(db, heavy_user, signed_in):
+    from routers.photos import nearby_photos_query
+
+    query = nearby_photos_query(db, *TOKYO, 1.0, 50, heavy_user if signed_in else None)
+    plan = explain(db, query)
+    assert_plan(plan, max_cost=50_000, max_rows=50)
+    # 未認証は公開写真だけの部分GiST、サインイン済みは全体のGiST
+    assert ("idx_photos_location" if signed_in else "idx_photos_public_location") in str(plan)
+
+
+def test_batch_get_uses_the_primary_key(db):
+    from routers.photos import batch_get_query
+
+    ids = [uuid.uuid4() for _ in range(500)]
+    assert_plan(explain(db, batch_get_query(db, ids)), max_cost=5_000, max_rows=500)
+
+
+def test_changes_since_cursor(db, heavy_user):
+    from services.photo_sync import changed_photos_query, tombstones_query
+
+    assert_plan(explain(db, changed_photos_query(db, heavy_user.id, 0, 501)), max_cost=50_000, max_rows=501)
+    assert_plan(explain(db, tombstones_query(db, heavy_user.id, 0, 501)), max_cost=5_000, max_rows=501)
+
+
+def test_timeline_reads_the_rollup_not_photos(db, heavy_user):
+    from services.photo_timeline import HISTOGRAM_SQL
+
+    query = HISTOGRAM_SQL.bindparams(granularity="month", user_id=heavy_user.id, visibility=None)
+    plan = explain(db, query)
+    assert "photo_timeline_days" not in find_seq_scans({"Plan": plan}), plan
+    assert_plan(plan, max_cost=2_000, max_rows=1_000)
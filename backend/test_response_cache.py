@@ -0,0 +1,84 @@
+import asyncio
+
+from services.response_cache import InProcessBackend, ResponseCache, normalize_params
+
+
+def test_normalize_params_is_order_independent_and_drops_none():
+    assert normalize_params({"limit": 10, "skip": 0, "user_id": None}) == normalize_params({"skip": 0, "limit": 10})
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache("test", backend=InProcessBackend(), ttl=60)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"[]"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute({"skip": 0}, compute) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+    assert calls == 1
+    assert {body for body, _ in results} == {b"[]"}
+    assert [status for _, status in results].count("MISS") == 1
+
+
+def test_invalidate_starts_new_generation():
+    cache = ResponseCache("test", backend=InProcessBackend(), ttl=60)
+    values = iter([b"1", b"2"])
+
+    async def compute():
+        return next(values)
+
+    async def scenario():
+        first = await cache.get_or_compute({}, compute)
+        cached = await cache.get_or_compute({}, compute)
+        cache.invalidate()
+        fresh = await cache.get_or_compute({}, compute)
+        return first, cached, fresh
+
+    first, cached, fresh = asyncio.run(scenario())
+    assert first == (b"1", "MISS")
+    assert cached == (b"1", "HIT")
+    assert fresh == (b"2", "MISS")
+
+
+def test_expired_entries_are_not_returned():
+    backend = InProcessBackend()
+    backend.set("k", b"v", ttl=-1)
+    assert backend.get("k") is None
+
+
+def test_bump_drops_only_the_namespace_entries():
+    backend = InProcessBackend(max_entries=10)
+    backend.set("a:0:x", b"1", ttl=60, namespace="a")
+    backend.set("a:0:y", b"2", ttl=60, namespace="a")
+    backend.set("b:0:x", b"3", ttl=60, namespace="b")
+    backend.bump_generation("a")
+    assert backend.get("a:0:x") is None and backend.get("a:0:y") is None
+    assert backend.get("b:0:x") == b"3"
+    assert set(backend._keys_by_namespace) == {"b"}
+
+    # LRUで追い出したエントリは索引からも消える
+    for i in range(10):
+        backend.set(f"c:0:{i}", b"x", ttl=60, namespace="c")
+    assert "b" not in backend._keys_by_namespace
+    assert len(backend._keys_by_namespace["c"]) == 10
+
+
+def test_generations_are_bounded_and_never_reused():
+    backend = InProcessBackend(max_entries=3)
+    seen = {}
+    for i in range(20):
+        namespace = f"nearby:{i}"
+        before = backend.generation(namespace)
+        backend.bump_generation(namespace)
+        seen[namespace] = backend.generation(namespace)
+        assert seen[namespace] > before
+    assert len(backend._generations) == 3
+    # 追い出された名前空間の世代は、最後に使った世代より小さくならない
+    for namespace, generation in seen.items():
+        assert backend.generation(namespace) >= generation
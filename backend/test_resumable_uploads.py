@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import os
+import time
+
+import pytest
+
+from services.resumable_uploads import UploadError, UploadSpool, parse_checksum
+
+USER = "user-1"
+
+
+def _spool(tmp_path, ttl_hours=24):
+    return UploadSpool(root=str(tmp_path), ttl_hours=ttl_hours)
+
+
+def test_chunks_resume_from_committed_offset(tmp_path):
+    spool = _spool(tmp_path)
+    data = os.urandom(1000)
+    meta = spool.create(USER, len(data), "a.jpg", "image/jpeg", {"title": "t"})
+    upload_id = meta["upload_id"]
+
+    spool.append(upload_id, USER, 0, data[:400])
+    # 送信済みの位置からの再送はオフセット不一致で拒否し、受信済みオフセットを伝える
+    with pytest.raises(UploadError) as e:
+        spool.append(upload_id, USER, 0, data[:400])
+    assert e.value.status_code == 409
+
+    assert spool.get(upload_id, USER)["offset"] == 400
+    spool.append(upload_id, USER, 400, data[400:])
+
+    meta, content = spool.begin_finalize(upload_id, USER)
+    assert content == data
+    spool.mark_finalized(upload_id, USER, "photo-1")
+    meta, content = spool.begin_finalize(upload_id, USER)
+    assert content is None and meta["photo_id"] == "photo-1"
+
+
+def test_checksum_mismatch_is_rejected(tmp_path):
+    spool = _spool(tmp_path)
+    meta = spool.create(USER, 3, "a.jpg", None, {})
+    wrong = parse_checksum("sha256 " + base64.b64encode(hashlib.sha256(b"xyz").digest()).decode())
+    with pytest.raises(UploadError) as e:
+        spool.append(meta["upload_id"], USER, 0, b"abc", wrong)
+    assert e.value.status_code == 460
+    assert spool.get(meta["upload_id"], USER)["offset"] == 0
+
+
+def test_incomplete_upload_cannot_be_finalized_and_other_users_see_nothing(tmp_path):
+    spool = _spool(tmp_path)
+    meta = spool.create(USER, 10, "a.jpg", None, {})
+    spool.append(meta["upload_id"], USER, 0, b"12345")
+    with pytest.raises(UploadError) as e:
+        spool.begin_finalize(meta["upload_id"], USER)
+    assert e.value.status_code == 409
+    with pytest.raises(UploadError) as e:
+        spool.get(meta["upload_id"], "someone-else")
+    assert e.value.status_code == 404
+    with pytest.raises(UploadError):
+        spool.append(meta["upload_id"], USER, 5, b"too many bytes")
+
+
+def test_garbage_collection_removes_stale_sessions(tmp_path):
+    spool = _spool(tmp_path, ttl_hours=1)
+    stale = spool.create(USER, 10, "a.jpg", None, {})
+    fresh = spool.create(USER, 10, "b.jpg", None, {})
+    old = time.time() - 7200
+    os.utime(os.path.join(str(tmp_path), stale["upload_id"], "meta.json"), (old, old))
+
+    assert spool.collect_garbage() == 1
+    assert spool.get(fresh["upload_id"], USER)
+    with pytest.raises(UploadError):
+        spool.get(stale["upload_id"], USER)
+
+
+class _StreamingRequest:
+    def __init__(self, chunks, content_length=None):
+        self.headers = {} if content_length is None else {"content-length": str(content_length)}
+        self.chunks = chunks
+        self.read = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def test_chunk_body_is_not_buffered_past_the_remaining_length():
+    import anyio
+
+    from routers.uploads import _read_chunk
+
+    request = _StreamingRequest([b"abc", b"def"], content_length=6)
+    assert anyio.run(_read_chunk, request, 6) == b"abcdef"
+
+    request = _StreamingRequest([b"abc"], content_length=1 << 40)
+    with pytest.raises(UploadError) as e:
+        anyio.run(_read_chunk, request, 6)
+    assert e.value.status_code == 413 and request.read == 0
+
+    # Content-Length なし（chunked）でも上限を超えた所で読むのをやめる
+    request = _StreamingRequest([b"abcd", b"efgh", b"ijkl"])
+    with pytest.raises(UploadError):
+        anyio.run(_read_chunk, request, 6)
+    assert request.read == 2
@@ -0,0 +1,58 @@
+import random
+
+from PIL import Image, ImageDraw
+
+from services.image_hash import dhash, from_db, hamming, to_db
+from services.similarity import BKTree, duplicate_groups
+
+
+def _sample_image(seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (320, 240), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(300), rng.randrange(220)
+        draw.rectangle([x, y, x + rng.randrange(20, 120), y + rng.randrange(20, 120)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image
+
+
+def test_dhash_is_stable_under_resize_and_distinct_for_other_images():
+    original = _sample_image(1)
+    resized = original.resize((160, 120))
+    other = _sample_image(2)
+    assert hamming(dhash(original), dhash(resized)) <= 4
+    assert hamming(dhash(original), dhash(other)) > 10
+
+
+def test_db_conversion_round_trips_high_bit():
+    value = (1 << 63) | 5
+    assert to_db(value) < 0
+    assert from_db(to_db(value)) == value
+
+
+def test_bktree_search_matches_brute_force():
+    rng = random.Random(0)
+    values = {i: rng.getrandbits(64) for i in range(500)}
+    # ほぼ重複（数ビットだけ異なる）を混ぜる
+    for i in range(500, 550):
+        values[i] = values[i - 500] ^ (1 << rng.randrange(64))
+    tree = BKTree()
+    for item_id, value in values.items():
+        tree.add(item_id, value)
+
+    query = values[3]
+    expected = sorted((hamming(query, v), i) for i, v in values.items() if hamming(query, v) <= 12)
+    assert tree.search(query, 12) == sorted(expected, key=lambda r: (r[0], str(r[1])))
+
+    tree.remove(503)
+    assert 503 not in [i for _, i in tree.search(query, 12)]
+
+
+def test_duplicate_groups_links_transitively():
+    tree = BKTree()
+    tree.add("a", 0b0000)
+    tree.add("b", 0b0001)
+    tree.add("c", 0b0011)
+    tree.add("d", (1 << 64) - 1)
+    assert duplicate_groups(tree, 1) == [["a", "b", "c"]]
@@ -0,0 +1,57 @@
+import pytest
+
+from benchmarks.fake_s3 import InMemoryS3Client
+from services.s3_service import S3Service
+from services.storage_reconcile import (
+    OrderingError, PhotoKey, StorageObject, iter_storage_objects, merge_orphans,
+)
+
+
+def _objects(*keys):
+    return iter([StorageObject(k, 1, None) for k in keys])
+
+
+def _rows(*keys):
+    return iter([PhotoKey(k, f"id-{k}", None) for k in keys])
+
+
+def test_merge_reports_both_directions():
+    events = list(merge_orphans(
+        _objects("photos/a", "photos/b", "photos/d"),
+        _rows("photos/b", "photos/c", "photos/d", "photos/e"),
+    ))
+    assert [(kind, key) for kind, key, _ in events] == [
+        ("orphan_object", "photos/a"),
+        ("matched", "photos/b"),
+        ("missing_object", "photos/c"),
+        ("matched", "photos/d"),
+        ("missing_object", "photos/e"),
+    ]
+
+
+def test_duplicate_rows_share_one_object():
+    events = list(merge_orphans(_objects("photos/a"), _rows("photos/a", "photos/a", "photos/b")))
+    assert [(kind, key) for kind, key, _ in events] == [("matched", "photos/a"), ("missing_object", "photos/b")]
+
+
+def test_unsorted_input_aborts():
+    with pytest.raises(OrderingError):
+        list(merge_orphans(_objects("photos/b", "photos/a"), _rows()))
+
+
+def test_listing_pages_and_resumes_after_key():
+    client = InMemoryS3Client()
+    for name in ["c", "a", "b", "e", "d"]:
+        client.put_object(Bucket="bucket", Key=f"photos/{name}", Body=b"x")
+    client.put_object(Bucket="bucket", Key="other/z", Body=b"x")
+
+    keys = [o.key for o in iter_storage_objects(client, "bucket", page_size=2)]
+    assert keys == ["photos/a", "photos/b", "photos/c", "photos/d", "photos/e"]
+    resumed = [o.key for o in iter_storage_objects(client, "bucket", start_after="photos/c", page_size=2)]
+    assert resumed == ["photos/d", "photos/e"]
+
+
+def test_key_from_url_matches_stored_urls():
+    url = "https://bucket.s3.ap-northeast-1.amazonaws.com/photos/abc.jpg"
+    assert S3Service.key_from_url(url) == "photos/abc.jpg"
+    assert S3Service.key_from_url("photos/abc.jpg") == "photos/abc.jpg"
@@ -0,0 +1,287 @@
+import io
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import anyio
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from sqlalchemy.dialects import postgresql
+
+from services import user_stats
+
+# alembic で head まで上げたデータベース（test_migrations と共用）
+MIGRATION_TEST_DATABASE_URL = os.getenv("MIGRATION_TEST_DATABASE_URL")
+
+
+class _Result:
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+
+class RecordingSession:
+    """実行した文をPostgreSQLの方言でコンパイルして記録する（quota_full なら上限付きのupsertが0行になる）"""
+
+    def __init__(self, stats=None, quota_full=False):
+        self.stats = stats
+        self.quota_full = quota_full
+        self.statements = []
+        self.events = []
+
+    def get(self, model, key):
+        return self.stats
+
+    def add(self, obj):
+        self.events.append("add")
+
+    def execute(self, statement, params=None):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        sql = str(compiled)
+        self.statements.append((sql, compiled.params))
+        if sql.startswith("INSERT INTO user_stats") and " WHERE " in sql and self.quota_full:
+            return _Result(None)
+        return _Result((uuid.uuid4(),))
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def refresh(self, obj):
+        obj.id = uuid.uuid4()
+
+    def stats_upserts(self):
+        return [params for sql, params in self.statements if sql.startswith("INSERT INTO user_stats")]
+
+
+def _photo(visibility="public", size_bytes=1000):
+    return SimpleNamespace(user_id=uuid.uuid4(), size_bytes=size_bytes, visibility=visibility)
+
+
+def _deltas(params):
+    """ON CONFLICT の SET に使われる差分（列名_1）"""
+    return {key[:-2]: value for key, value in params.items() if key.endswith("_1") and not key.startswith("greatest")}
+
+
+def test_added_and_removed_photos_move_every_counter():
+    db = RecordingSession()
+    photo = _photo("unlisted", 1234)
+    user_stats.record_photo_added(db, photo, enforce_quota=False)
+    user_stats.record_photo_removed(db, photo)
+    added, removed = db.stats_upserts()
+    assert _deltas(added) == {"photo_count": 1, "total_bytes": 1234, "unlisted_count": 1}
+    assert added["unlisted_count"] == 1 and added["public_count"] == 0
+    assert _deltas(removed) == {"photo_count": -1, "total_bytes": -1234, "unlisted_count": -1}
+    # 行がない状態での削除は0で作る（負にしない）
+    assert removed["photo_count"] == 0 and removed["total_bytes"] == 0
+    sql, _ = db.statements[1]
+    assert "photo_count = greatest(user_stats.photo_count + %(photo_count_1)s, %(greatest_1)s)" in sql
+
+
+def test_visibility_change_moves_only_the_visibility_counters():
+    db = RecordingSession()
+    user_id = uuid.uuid4()
+    user_stats.record_visibility_changed(db, user_id, "public", "private")
+    (params,) = db.stats_upserts()
+    assert _deltas(params) == {"public_count": -1, "private_count": 1}
+
+    user_stats.record_visibility_changed(db, user_id, "private", "private")
+    assert len(db.stats_upserts()) == 1
+
+
+def test_quota_is_enforced_in_the_upsert(monkeypatch):
+    monkeypatch.setattr(user_stats, "QUOTA_MAX_PHOTOS", 10)
+    monkeypatch.setattr(user_stats, "QUOTA_MAX_BYTES", 5000)
+    db = RecordingSession()
+    user_stats.record_photo_added(db, _photo())
+    sql, _ = db.statements[0]
+    assert sql.endswith(
+        "WHERE user_stats.photo_count + %(photo_count_2)s <= %(param_1)s "
+        "AND user_stats.total_bytes + %(total_bytes_2)s <= %(param_2)s RETURNING user_stats.user_id")
+
+    with pytest.raises(user_stats.QuotaExceededError):
+        user_stats.record_photo_added(RecordingSession(quota_full=True), _photo())
+
+    full = SimpleNamespace(photo_count=10, total_bytes=0)
+    with pytest.raises(user_stats.QuotaExceededError):
+        user_stats.check_quota(RecordingSession(stats=full), uuid.uuid4(), 1)
+    user_stats.check_quota(RecordingSession(stats=SimpleNamespace(photo_count=9, total_bytes=4000)),
+                           uuid.uuid4(), 1000)
+
+
+def _jpeg() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (16, 16), (200, 40, 40)).save(out, "JPEG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    from services.s3_service import s3_service
+
+    calls = SimpleNamespace(uploaded=[], deleted=[])
+
+    async def upload_image(content, filename, content_type):
+        url = f"https://bucket.example/photos/{uuid.uuid4()}.jpg"
+        calls.uploaded.append(url)
+        return url
+
+    async def delete_image(url):
+        calls.deleted.append(url)
+        return True
+
+    monkeypatch.setattr(s3_service, "upload_image", upload_image)
+    monkeypatch.setattr(s3_service, "delete_image", delete_image)
+    return calls
+
+
+def test_upload_records_the_photo_in_the_counters(storage):
+    from routers.photos import create_photo
+
+    db = RecordingSession()
+    user = SimpleNamespace(id=uuid.uuid4())
+    content = _jpeg()
+    anyio.run(create_photo, db, user, content, "a.jpg", "image/jpeg")
+    (params,) = db.stats_upserts()
+    assert _deltas(params) == {"photo_count": 1, "total_bytes": len(content), "private_count": 1}
+    assert db.events == ["add", "commit"]
+    assert storage.deleted == []
+
+
+def test_upload_over_quota_is_rejected_and_the_object_removed(storage, monkeypatch):
+    from routers.photos import create_photo
+
+    monkeypatch.setattr(user_stats, "QUOTA_MAX_PHOTOS", 1)
+    user = SimpleNamespace(id=uuid.uuid4())
+
+    # 事前チェックで超過していればS3には送らない
+    db = RecordingSession(stats=SimpleNamespace(photo_count=1, total_bytes=0))
+    with pytest.raises(HTTPException) as e:
+        anyio.run(create_photo, db, user, _jpeg(), "a.jpg", "image/jpeg")
+    assert e.value.status_code == 413
+    assert storage.uploaded == [] and db.statements == []
+
+    # 同時アップロードで事前チェック後に上限を超えた場合はロールバックしてS3から消す
+    db = RecordingSession(quota_full=True)
+    with pytest.raises(HTTPException) as e:
+        anyio.run(create_photo, db, user, _jpeg(), "a.jpg", "image/jpeg")
+    assert e.value.status_code == 413
+    assert db.events == ["add", "rollback"]
+    assert storage.deleted == storage.uploaded and len(storage.deleted) == 1
+
+
+def test_me_stats_reports_counters_and_quota(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import database
+    import main
+    from auth.auth_service import AuthService
+
+    user = SimpleNamespace(id=uuid.uuid4())
+    stats = SimpleNamespace(photo_count=3, total_bytes=4096, public_count=1, unlisted_count=0, private_count=2,
+                            updated_at=datetime(2024, 5, 1, tzinfo=timezone.utc))
+
+    class Session:
+        def __init__(self, stats):
+            self.stats = stats
+
+        def query(self, model):
+            return SimpleNamespace(filter=lambda *criteria: SimpleNamespace(first=lambda: user))
+
+        def get(self, model, key):
+            assert key == user.id
+            return self.stats
+
+        def close(self):
+            pass
+
+    current = {"stats": stats}
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: None)
+    monkeypatch.setattr(database, "SessionLocal", lambda: Session(current["stats"]))
+    monkeypatch.setattr(user_stats, "QUOTA_MAX_PHOTOS", 0)
+    monkeypatch.setattr(user_stats, "QUOTA_MAX_BYTES", 10_000)
+    client = TestClient(main.create_app())
+    headers = {"Authorization": f"Bearer {AuthService.create_access_token({'sub': str(user.id)})}"}
+
+    assert client.get("/auth/me/stats", headers=headers).json() == {
+        "photo_count": 3, "total_bytes": 4096, "public_count": 1, "unlisted_count": 0, "private_count": 2,
+        "quota_max_photos": None, "quota_max_bytes": 10_000, "updated_at": "2024-05-01T00:00:00Z",
+    }
+
+    # 写真を一度もアップロードしていないユーザーは0
+    current["stats"] = None
+    body = client.get("/auth/me/stats", headers=headers).json()
+    assert body["photo_count"] == 0 and body["total_bytes"] == 0 and body["updated_at"] is None
+
+
+def test_reconcile_job_repairs_in_batches(monkeypatch, capsys):
+    import database
+    from jobs import reconcile_user_stats
+
+    users = [uuid.uuid4() for _ in range(5)]
+    drifted = {users[1], users[4]}
+    batches = []
+    commits = []
+
+    def reconcile(db, user_ids):
+        batches.append(list(user_ids))
+        return [user_id for user_id in user_ids if user_id in drifted]
+
+    monkeypatch.setattr(reconcile_user_stats, "load_dotenv", lambda: None)
+    monkeypatch.setattr(database, "get_engine", lambda: None)
+    monkeypatch.setattr(database, "SessionLocal", lambda: SimpleNamespace(
+        commit=lambda: commits.append(1), close=lambda: None))
+    monkeypatch.setattr(user_stats, "reconcile", reconcile)
+
+    argv = [arg for user_id in users for arg in ("--user-id", str(user_id))] + ["--batch-size", "2"]
+    assert reconcile_user_stats.main(argv) == 0
+    assert batches == [users[0:2], users[2:4], users[4:5]]
+    assert len(commits) == 3
+    report = json.loads(capsys.readouterr().out)
+    assert report["checked"] == 5 and report["repaired"] == 2
+    assert set(report["repaired_user_ids"]) == {str(user_id) for user_id in drifted}
+
+
+@pytest.mark.skipif(not MIGRATION_TEST_DATABASE_URL, reason="MIGRATION_TEST_DATABASE_URL が未設定")
+def test_reconcile_sql_repairs_drifted_rows():
+    from psycopg2.extras import register_uuid
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+
+    # テキストSQLでもUUIDをそのまま渡し、受け取れるようにする
+    register_uuid()
+    engine = create_engine(MIGRATION_TEST_DATABASE_URL)
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection)
+    try:
+        drifted, correct = uuid.uuid4(), uuid.uuid4()
+        for user_id in (drifted, correct):
+            db.execute(text("INSERT INTO users (id, email, password_hash, username) VALUES (:id, :email, 'x', 'u')"),
+                       {"id": user_id, "email": f"{user_id}@example.com"})
+            for visibility, size in (("public", 100), ("private", 50), ("private", 25)):
+                db.execute(text("INSERT INTO photos (user_id, s3_key, mime_type, size_bytes, visibility) "
+                                "VALUES (:user_id, 'k', 'image/jpeg', :size, :visibility)"),
+                           {"user_id": user_id, "size": size, "visibility": visibility})
+        db.execute(text("INSERT INTO user_stats (user_id, photo_count, total_bytes, public_count, unlisted_count, "
+                        "private_count) VALUES (:drifted, 7, 1, 0, 4, 0), (:correct, 3, 175, 1, 0, 2)"),
+                   {"drifted": drifted, "correct": correct})
+
+        assert user_stats.reconcile(db, [drifted, correct]) == [drifted]
+        row = db.execute(text("SELECT photo_count, total_bytes, public_count, unlisted_count, private_count "
+                              "FROM user_stats WHERE user_id = :id"), {"id": drifted}).one()
+        assert tuple(row) == (3, 175, 1, 0, 2)
+        assert user_stats.reconcile(db, [drifted, correct]) == []
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
@@ -0,0 +1,95 @@
+import io
+import json
+import zipfile
+import zlib
+from datetime import datetime
+
+import pytest
+
+from services.zip_export import ExportEntry, ExportError, ZipExport, parse_range
+
+MODIFIED = datetime(2024, 5, 1, 12, 30, 10)
+
+
+def _archive(objects, known_crc=(), read_ahead=2, sizes=None):
+    def entries():
+        for key, data in objects.items():
+            crc = zlib.crc32(data) if key in known_crc else None
+            size = (sizes or {}).get(key, len(data))
+            yield ExportEntry(f"photos/{key}", key, size, crc, MODIFIED)
+
+    def manifest():
+        yield b"["
+        yield b",".join(json.dumps({"file": f"photos/{key}"}).encode() for key in objects)
+        yield b"]"
+
+    fetches = []
+
+    def fetch(key, start, end):
+        fetches.append((key, start, end))
+        return objects[key][start:end]
+
+    return ZipExport(entries, manifest, fetch, MODIFIED, read_ahead=read_ahead), fetches
+
+
+OBJECTS = {f"{i:03d}.jpg": bytes([i]) * (1000 + i * 37) for i in range(12)}
+
+
+def test_archive_is_readable_and_matches_precomputed_size():
+    export, _ = _archive(OBJECTS, known_crc={"000.jpg", "005.jpg", "011.jpg"})
+    data = b"".join(export.iter_bytes())
+    assert len(data) == export.size
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert names == [f"photos/{key}" for key in OBJECTS] + ["manifest.json"]
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+        assert archive.read("photos/007.jpg") == OBJECTS["007.jpg"]
+        assert len(json.loads(archive.read("manifest.json"))) == len(OBJECTS)
+
+
+def test_ranges_reassemble_the_same_bytes():
+    full = b"".join(_archive(OBJECTS)[0].iter_bytes())
+    for cut in (1, 29, 1500, len(full) // 2, len(full) - 30, len(full) - 1):
+        export, _ = _archive(OBJECTS)
+        head = b"".join(export.iter_bytes(0, cut))
+        tail = b"".join(export.iter_bytes(cut))
+        assert head + tail == full
+
+
+def test_resuming_after_entries_without_crc_refetches_them_for_the_directory():
+    export, fetches = _archive(OBJECTS)
+    tail = b"".join(export.iter_bytes(export.cd_offset))
+    full = b"".join(_archive(OBJECTS)[0].iter_bytes())
+    assert tail == full[export.cd_offset:]
+    assert sorted(key for key, _, _ in fetches) == sorted(OBJECTS)
+
+
+def test_size_mismatch_aborts_the_stream():
+    export, _ = _archive(OBJECTS, known_crc=set(OBJECTS), sizes={"003.jpg": 5})
+    with pytest.raises(ExportError):
+        b"".join(export.iter_bytes())
+
+
+def test_zip64_end_records_for_many_entries():
+    objects = {f"{i}": b"" for i in range(70000)}
+    export, _ = _archive(objects, known_crc=set(objects))
+    with zipfile.ZipFile(io.BytesIO(b"".join(export.iter_bytes()))) as archive:
+        assert len(archive.infolist()) == 70001
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=10-19", 100) == (10, 20)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=-10", 100) == (90, 100)
+    assert parse_range("bytes=0-5,10-20", 100) is None
+    assert parse_range("bytes=abc", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+def test_entries_without_crc_are_counted():
+    assert _archive(OBJECTS, known_crc=set(OBJECTS))[0].missing_crc == 0
+    assert _archive(OBJECTS, known_crc={"000.jpg", "005.jpg"})[0].missing_crc == len(OBJECTS) - 2
@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 """
-AWS RDSレコード確認スクリプト
+AWS RDSレコード確認・性能診断スクリプト
+
+既定では性能診断（テーブル・インデックスのサイズと肥大化の推定、未使用・重複インデックス、
+pg_stat_statements の上位のSQL、キャッシュヒット率、autovacuum の遅れ）をJSONで出力する。
+しきい値を超えた項目は warnings に入り、1件でもあれば終了コード1になる（cronでの監視用）。
+
+使い方:
+    python check_rds_records.py                      # 診断（JSON）
+    python check_rds_records.py --top-statements 20 --bloat-ratio 0.4
+    python check_rds_records.py --records            # 従来のレコード一覧
 """
 
+import argparse
+import json
 import os
+import sys
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
 
 # .envファイルの読み込み
 def load_env_file():
-    """環境変数ファイルを読み込み"""
+    """環境変数ファイルを読み込み（標準出力はJSON用に空けておく）"""
     env_file = ".env"
     if os.path.exists(env_file):
         with open(env_file, 'r', encoding='utf-8') as f:
@@ -19,9 +33,9 @@ def load_env_file():
                 if line and not line.startswith('#') and '=' in line:
                     key, value = line.split('=', 1)
                     os.environ[key.strip()] = value.strip()
-        print(f"✅ .envファイルを読み込みました: {env_file}")
+        print(f"✅ .envファイルを読み込みました: {env_file}", file=sys.stderr)
     else:
-        print(f"⚠️ .envファイルが見つかりません: {env_file}")
+        print(f"⚠️ .envファイルが見つかりません: {env_file}", file=sys.stderr)
 
 def check_rds_records():
     """RDSデータベースのレコードを確認"""
@@ -108,8 +122,63 @@ def check_rds_records():
     except Exception as e:
         print(f"❌ エラー: {e}")
 
+def run_diagnostics(args) -> int:
+    """性能診断をJSONで出力（警告があれば1、接続できなければ2を返す）"""
+    from services.db_diagnostics import THRESHOLDS, collect, evaluate
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL環境変数を設定してください", file=sys.stderr)
+        return 2
+    try:
+        conn = psycopg2.connect(database_url)
+    except Exception as e:
+        print(json.dumps({"error": str(e).strip()}, ensure_ascii=False))
+        return 2
+
+    conn.autocommit = True
+    thresholds = dict(THRESHOLDS)
+    for name in thresholds:
+        value = getattr(args, name, None)
+        if value is not None:
+            thresholds[name] = value
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            report = collect(cursor, args.tables, args.top_statements)
+    finally:
+        conn.close()
+
+    warnings = evaluate(report, thresholds)
+    output = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "thresholds": thresholds,
+        "warnings": warnings,
+        **report,
+    }
+    print(json.dumps(output, ensure_ascii=False, default=str, indent=2 if args.pretty else None))
+    return 1 if warnings else 0
+
+
+def parse_args(argv=None):
+    from services.db_diagnostics import DEFAULT_TABLES, THRESHOLDS
+
+    parser = argparse.ArgumentParser(description="RDSのレコード確認・性能診断")
+    parser.add_argument("--records", action="store_true", help="従来のレコード一覧を表示する")
+    parser.add_argument("--tables", nargs="+", default=DEFAULT_TABLES, help="診断するテーブル")
+    parser.add_argument("--top-statements", type=int, default=10, help="pg_stat_statements の上位件数")
+    parser.add_argument("--pretty", action="store_true", help="JSONを整形して出力する")
+    for name, default in THRESHOLDS.items():
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=type(default), default=None,
+                            help=f"しきい値（既定: {default}）")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
     # .envファイルを読み込み
     load_env_file()
-    # RDSレコードを確認
-    check_rds_records()
\ No newline at end of file
+    if args.records:
+        # RDSレコードを確認
+        check_rds_records()
+    else:
+        sys.exit(run_diagnostics(args))
\ No newline at end of file